@@ -2,16 +2,21 @@ import streamlit as st
 import os
 import json
 import time
-import numpy as np
 from PIL import Image
-import google.generativeai as genai
-#from google import genai
-#from google.genai import models
-#from google.genai import types
-from sklearn.neighbors import NearestNeighbors
 from dotenv import load_dotenv
 import uuid
 import utils  # Import the utility functions
+import retrieval
+import stylist
+import bulk_import
+import jobs
+import features
+import images
+import integrity
+import metrics
+import prompt_builder
+import outfit_cache
+import outfit_engine
 
 # Load environment variables
 load_dotenv()
@@ -24,18 +29,33 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Each user's data lives in its own storage namespace, chosen with ?user=<name>
+if 'user' not in st.session_state:
+    try:
+        st.session_state.user = utils.normalise_user(st.query_params.get("user"))
+    except ValueError:
+        st.session_state.user = utils.DEFAULT_USER
+user = st.session_state.user
+
 # Initialize session state with persisted data
 if 'wardrobe_items' not in st.session_state:
-    st.session_state.wardrobe_items = utils.load_wardrobe()
+    st.session_state.wardrobe_items = utils.load_wardrobe(user)
+    
+if 'item_index' not in st.session_state:
+    st.session_state.item_index = utils.ItemIndex(st.session_state.wardrobe_items)
     
 if 'profile' not in st.session_state:
-    st.session_state.profile = utils.load_profile()
+    st.session_state.profile = utils.load_profile(user)
     
 if 'recommended_outfits' not in st.session_state:
     st.session_state.recommended_outfits = []
     
-if 'outfit_history' not in st.session_state:
-    st.session_state.outfit_history = utils.load_outfits()
+if 'history_page' not in st.session_state:
+    st.session_state.history_page = 0
+
+if 'jobs' not in st.session_state:
+    # Background jobs this session waits for (id -> kind), picking up ones still queued from before a restart
+    st.session_state.jobs = {job["id"]: job["kind"] for job in jobs.get_queue().active(user)}
 
 # Function to get API key
 def get_api_key():
@@ -49,181 +69,178 @@ def get_api_key():
 def initialize_gemini():
     api_key = get_api_key()
     if api_key:
-        genai.configure(api_key=api_key)
+        stylist.configure(api_key)
         return True
     return False
 
-# Function to create embeddings
-def embed_text(text):
-    """Get embedding using Google's embedding model"""
-    try:
-        result = genai.embed_content(
-            model="models/embedding-001",
-            content=text,
-            task_type="retrieval_document",
-        )
-        return np.array(result["embedding"])
-    except Exception as e:
-        st.error(f"Error creating embedding: {e}")
-        return None
-
-# Function to analyze an image
-def analyze_image(image):
-    try:
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        prompt = [
-            image,
-            '''Analyze the person's figure and skin tone. Return in this JSON format:
-            {
-              "body_shape": "", 
-              "skin_tone": "",
-              "recommended_colors": [],
-              "avoid_styles": [],
-              "notes": ""
-            }'''
-        ]
-        response = model.generate_content(prompt)
-        return response.text
-    except Exception as e:
-        st.error(f"Error analyzing image: {e}")
-        return None
-
-# Function to analyze clothing item
-def analyze_clothing(image):
-    try:
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        prompt = [
-            image,
-            '''Analyze this clothing item and return in this JSON format:
-            {
-              "type": "", 
-              "color": "",
-              "pattern": "",
-              "style": "",
-              "occasions": []
-            }'''
-        ]
-        response = model.generate_content(prompt)
-        return response.text
-    except Exception as e:
-        st.error(f"Error analyzing clothing: {e}")
-        return None
-
-# Function to analyze location image
-def analyze_location(image):
-    try:
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        prompt = [
-            image,
-            '''Analyze this location and return in this JSON format:
-            {
-              "location_type": "",
-              "environment": "",
-              "weather_indication": "",
-              "dress_code_suggestion": "",
-              "notable_features": [],
-              "recommended_style_elements": []
-            }'''
-        ]
-        response = model.generate_content(prompt)
-        #response = client.models.generate_content(model="gemini-1.5-flash", contents=prompt)
-        response_text = response.text
-        cleaned_response = response_text
-        if "```json" in response_text:
-            cleaned_response = response_text.split("```json")[1].split("```")[0].strip()
-        elif response_text.startswith("```") and response_text.endswith("```"):
-            cleaned_response = response_text.strip("```").strip()
-        return cleaned_response
-    except Exception as e:
-        st.error(f"Error analyzing location: {e}")
-        return None
-
-# Function to generate outfits
-def generate_outfits(profile, wardrobe_items, location_info=None, time_of_day=None, location_analysis=None):
-    try:
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        
-        wardrobe_json = json.dumps(wardrobe_items)
-
-                # Build context-aware prompt
-        location_context = ""
-        if location_info:
-            location_context = f"""
-            Location Context:
-            - Destination: {location_info.get('destination', '')}
-            - Activity: {location_info.get('activity', '')}
-            - Time of Day: {time_of_day if time_of_day else 'Not specified'}
-            """
-
-        if location_analysis:
-            location_context += f"""
-            Location Analysis:
-            {location_analysis}
-            """
-        
-        prompt = f"""
-        You're an expert stylist.
-        Use the following profile, location context, and available wardrobe items to suggest 3 personalized outfit options:
-        
-        Profile:
-        {profile}
+# Interactions inside a fragment rerun only the fragment, not the whole page
+fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None) or (lambda fn: fn)
 
-        {location_context}
-        
-        
-        Wardrobe:
-        {wardrobe_json}
-        
-        Generate outfits that:
-        1. Only use items available in the wardrobe
-        2. Match the location's environment and dress code
-        3. Are appropriate for the time of day
-        4. Consider the weather and environment
-        5. Only use colors from recommended_colors in the profile
-        6. Avoid styles from avoid_styles in the profile
-        
-        Return in JSON format with 3 outfit options.
-        The output should have this structure:
-        {{
-          "outfit_options": [
-            {{
-              "option_id": 1,
-              "name": "Name of outfit",
-              "description": "Brief description",
-              "items": [
-                {{
-                  "type": "top/bottom/etc",
-                  "item_id": "item ID from wardrobe"
-                }},
-                ...
-              ],
-              "occasions": ["casual", "work", etc],
-              "weather": "suitable weather condition",
-              "time_of_day": "when to wear",
-              "location_appropriateness": "why this outfit suits the location"
-            }},
-            ...
-          ]
-        }}
-        """
-        
-        response = model.generate_content(prompt, generation_config={"temperature": 0.7})
-        response_text = response.text
-
-        # Clean up and parse the JSON response
-        cleaned_response = response_text
-        if "```json" in response_text:
-            # If response is wrapped in markdown code block
-            cleaned_response = response_text.split("```json")[1].split("```")[0].strip()
-        elif response_text.startswith("```") and response_text.endswith("```"):
-            # If response is wrapped in generic code block
-            cleaned_response = response_text.strip("```").strip()
+WARDROBE_PAGE_SIZES = [12, 24, 48]
+
+def remove_item(item_id):
+    """Button callback: remove an item before the grid re-renders, so no full rerun is needed"""
+    st.session_state.item_index.remove(item_id)
+    jobs.wardrobe_index(st.session_state.user).forget(item_id)
+    utils.remove_wardrobe_item(item_id, user=st.session_state.user)
+
+def set_wardrobe_page(category, page):
+    st.session_state[f"wardrobe_page_{category}"] = page
+
+@fragment
+def wardrobe_grid():
+    """One category at a time, filtered and paginated, so the cost of a rerun
+    depends on the page size rather than on the size of the wardrobe"""
+    categories = ["tops", "bottoms", "dresses", "shoes", "accessories"]
+    wardrobe = st.session_state.wardrobe_items
+    item_index = st.session_state.item_index
+    category = st.radio("Category", categories, horizontal=True, key="wardrobe_category",
+                        format_func=lambda c: f"{c.title()} ({len(wardrobe.get(c, []))})",
+                        label_visibility="collapsed")
+    items = item_index.items(category)
+    if not items:
+        st.write(f"No {category} in your wardrobe yet.")
+        return
+    
+    # Search and filters, remembered per category
+    colors, types, occasions = utils.filter_options(items)
+    col1, col2, col3, col4 = st.columns([2, 1, 1, 1])
+    with col1:
+        query = st.text_input("Search", key=f"wardrobe_query_{category}", placeholder="e.g. striped, linen, work")
+    with col2:
+        selected_colors = st.multiselect("Color", colors, key=f"wardrobe_colors_{category}")
+    with col3:
+        selected_types = st.multiselect("Type", types, key=f"wardrobe_types_{category}")
+    with col4:
+        selected_occasions = st.multiselect("Occasion", occasions, key=f"wardrobe_occasions_{category}")
+    matched = utils.filter_items(items, query, selected_colors, selected_types, selected_occasions)
+    
+    # Back to the first page whenever the filters change
+    filters = (query, tuple(selected_colors), tuple(selected_types), tuple(selected_occasions))
+    page_key = f"wardrobe_page_{category}"
+    if st.session_state.get(f"wardrobe_filters_{category}") != filters:
+        st.session_state[f"wardrobe_filters_{category}"] = filters
+        st.session_state[page_key] = 0
+    
+    page_size = st.session_state.get("wardrobe_page_size", WARDROBE_PAGE_SIZES[0])
+    page_count = max((len(matched) + page_size - 1) // page_size, 1)
+    page = min(st.session_state.get(page_key, 0), page_count - 1)
+    
+    if not matched:
+        st.write("No items match these filters.")
+        return
+    
+    cols = st.columns(3)
+    for j, item in enumerate(matched[page * page_size:(page + 1) * page_size]):
+        with cols[j % 3]:
+            st.markdown(f"<div class='item-card'>", unsafe_allow_html=True)
+            
+            # Check if image exists
+            thumbnail = images.display_path(item)
+            if integrity.exists(thumbnail):
+                st.image(thumbnail, width=150)
+            else:
+                st.write("Image not found")
             
-        return cleaned_response
-    except Exception as e:
-        st.error(f"Error generating outfits: {e}")
-        st.write("Raw response:", response_text if 'response_text' in locals() else "No response received")
-        return None
+            st.write(f"**{item['type']}**")
+            st.write(f"Color: {item['color']}")
+            
+            # Larger image and full attributes, only rendered on demand
+            if st.toggle("Details", key=f"details_{category}_{item['id']}"):
+                medium = images.display_path(item, "medium")
+                if integrity.exists(medium):
+                    st.image(medium, use_column_width=True)
+                st.write(f"Pattern: {item.get('pattern', '')}")
+                st.write(f"Style: {item.get('style', '')}")
+                st.write(f"Occasions: {', '.join(item.get('occasions', []))}")
+            
+            # Delete button
+            st.button("Remove", key=f"remove_{category}_{item['id']}", on_click=remove_item, args=(item['id'],))
+            
+            st.markdown("</div>", unsafe_allow_html=True)
+    
+    # Pagination
+    col1, col2, col3, col4 = st.columns([1, 1, 2, 1])
+    with col1:
+        st.button("Previous", key=f"wardrobe_prev_{category}", disabled=page == 0,
+                  on_click=set_wardrobe_page, args=(category, page - 1))
+    with col2:
+        st.button("Next", key=f"wardrobe_next_{category}", disabled=page >= page_count - 1,
+                  on_click=set_wardrobe_page, args=(category, page + 1))
+    with col3:
+        st.write(f"Page {page + 1} of {page_count} ({len(matched)} of {len(items)} items)")
+    with col4:
+        st.selectbox("Per page", WARDROBE_PAGE_SIZES, key="wardrobe_page_size", label_visibility="collapsed")
+
+# Model calls run as background jobs (see jobs.py); the session keeps the ids of the ones it waits for
+JOB_LABELS = {
+    "profile": "Analyzing your photo",
+    "clothing": "Analyzing clothing item",
+    "location": "Analyzing location",
+    "outfits": "Generating outfit suggestions",
+    "describe_outfits": "Describing outfits",
+}
+JOB_POLL_SECONDS = 1.0
+
+def submit_job(kind, payload=None, data=None):
+    """Queue a job for this session and rerun so its status shows straight away"""
+    job_id = jobs.get_queue().submit(kind, payload, data, user=st.session_state.user)
+    st.session_state.jobs[job_id] = kind
+    st.rerun()
+
+def apply_job(job):
+    """Attach a finished job's result to the session; it is already persisted where it belongs"""
+    kind, result = job["kind"], job["result"]
+    if kind == "profile":
+        st.session_state.profile = result
+        st.toast("Profile analysis complete!")
+    elif kind == "clothing":
+        if result["item"]["id"] not in st.session_state.item_index:
+            st.session_state.item_index.add(result["category"], result["item"])
+        st.toast(f"Added {result['item'].get('type', 'item')} to your wardrobe!")
+    elif kind == "location":
+        st.session_state.location_analysis = result
+        st.toast("Location analyzed!")
+    else:
+        st.session_state.recommended_outfits = result["outfits"]
+        st.session_state.last_prompt_info = result.get("prompt_info")
+        if result.get("skipped"):
+            st.warning(f"Skipped {result['skipped']} outfit(s) that could not be parsed.")
+        st.toast("Generated outfit suggestions!")
+
+def collect_jobs():
+    """Apply the results of the session's finished jobs and report the failed ones"""
+    queue = jobs.get_queue()
+    for job_id, kind in list(st.session_state.jobs.items()):
+        job = queue.get(job_id)
+        if job is not None and job["status"] in (jobs.QUEUED, jobs.RUNNING):
+            continue
+        del st.session_state.jobs[job_id]
+        if job is None:
+            continue
+        if job["status"] == jobs.DONE:
+            apply_job(job)
+        else:
+            st.error(f"{JOB_LABELS.get(kind, kind)} failed: {job['error']}")
+
+def polling_fragment(fn):
+    """Fragment that reruns on its own every JOB_POLL_SECONDS"""
+    decorator = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None)
+    return decorator(run_every=JOB_POLL_SECONDS)(fn) if decorator else fn
+
+@polling_fragment
+def job_status():
+    """Progress of the session's background jobs; reruns the page once one of them finishes"""
+    queue = jobs.get_queue()
+    for job_id, kind in list(st.session_state.jobs.items()):
+        job = queue.get(job_id)
+        if job is None or job["status"] not in (jobs.QUEUED, jobs.RUNNING):
+            st.rerun()
+        state = "waiting" if job["status"] == jobs.QUEUED else "running"
+        st.caption(f"{JOB_LABELS.get(kind, kind)}... ({state})")
+        # Outfits completed so far by a streaming generation
+        for outfit in (job["progress"] or {}).get("outfits", []):
+            st.write(f"**{outfit.get('name', 'Outfit')}** - {outfit.get('description', '')}")
 
 # Design custom CSS
 st.markdown("""
@@ -268,10 +285,30 @@ st.markdown("""
 st.markdown("<h1 class='main-header'>Dress Mind</h1>", unsafe_allow_html=True)
 st.markdown("Upload your clothing items and let AI create personalized outfits for your style and body type.")
 
+# Results of background jobs that finished since the last run, then the status of the rest
+collect_jobs()
+if st.session_state.jobs:
+    job_status()
+
 # Sidebar
 with st.sidebar:
     st.header("Settings")
     
+    # Switching user reloads the session's data from that user's namespace
+    new_user = st.text_input("User", value=user)
+    try:
+        new_user = utils.normalise_user(new_user)
+    except ValueError as e:
+        st.error(str(e))
+    else:
+        if new_user != user:
+            for key in ["wardrobe_items", "item_index", "profile", "recommended_outfits", "history_page", "jobs",
+                        "location_analysis"]:
+                st.session_state.pop(key, None)
+            st.session_state.user = new_user
+            st.query_params["user"] = new_user
+            st.rerun()
+    
     # API Key input
     user_api_key = st.text_input("Enter your Gemini API Key:", value=get_api_key(), type="password")
     if user_api_key:
@@ -285,12 +322,32 @@ with st.sidebar:
     st.subheader("Navigation")
     app_mode = st.radio("", ["Create Profile", "Manage Wardrobe", "Generate Outfits"])
     
+    # Analysis cache statistics
+    cache_stats = stylist.analysis_cache.stats()
+    st.caption(f"Analysis cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses "
+               f"({cache_stats['entries']} entries)")
+    preprocess_stats = stylist.preprocess_summary()
+    if preprocess_stats["calls"]:
+        st.caption(f"Image preprocessing saved {preprocess_stats['bytes_saved'] / 1e6:.1f} MB "
+                   f"over {preprocess_stats['calls']} model calls")
+    
+    # Filled in at the end of the script so it includes this run's calls
+    metrics_panel = st.expander("Debug: metrics")
+    
     # Clean up wardrobe
+    delete_unused = st.checkbox("Also delete unused uploads",
+                                help=f"Images no wardrobe item refers to, older than "
+                                     f"{integrity.ORPHAN_MIN_AGE // 60} minutes")
     if st.button("Clean Missing Files"):
-        st.session_state.wardrobe_items = utils.clean_missing_items(st.session_state.wardrobe_items)
-        utils.save_wardrobe(st.session_state.wardrobe_items)
-        st.success("Cleaned up missing files!")
-        st.rerun()
+        removed = utils.clean_missing_items(user)
+        # Already removed from the store; mirror it in the session
+        for item_id in removed:
+            st.session_state.item_index.remove(item_id)
+        st.success(f"Removed {len(removed)} items with missing images.")
+        if delete_unused:
+            report = utils.check_uploads(user, delete=True)
+            st.success(f"Deleted {report['deleted']} unused uploads, "
+                       f"reclaiming {report['reclaimed_bytes'] / 1e6:.1f} MB.")
 
 # Create Profile section
 if app_mode == "Create Profile":
@@ -311,13 +368,8 @@ if app_mode == "Create Profile":
             with col2:
                 if st.button("Analyze Photo", key="analyze_photo"):
                     if initialize_gemini():
-                        with st.spinner("Analyzing your photo..."):
-                            profile_analysis = analyze_image(image)
-                            if profile_analysis:
-                                st.session_state.profile = profile_analysis
-                                # Save profile to file
-                                utils.save_profile(profile_analysis)
-                                st.success("Analysis complete!")
+                        # Saved as the profile when the analysis is done
+                        submit_job("profile", data=uploaded_image.getvalue())
                     else:
                         st.error("Please enter your Gemini API key in the sidebar.")
         
@@ -333,7 +385,7 @@ if app_mode == "Create Profile":
                 if st.button("Update Profile"):
                     st.session_state.profile = edited_profile
                     # Save updated profile
-                    utils.save_profile(edited_profile)
+                    utils.save_profile(edited_profile, user=user)
                     st.success("Profile updated!")
         
         st.markdown("</div>", unsafe_allow_html=True)
@@ -361,93 +413,85 @@ elif app_mode == "Manage Wardrobe":
                 st.image(item_image, caption=f"New {clothing_type} item", width=250)
                 
             with col2:
-                if st.button("Add to Wardrobe", key="add_to_wardrobe"):
+                # Catch re-uploads of a garment that's already in the wardrobe before paying for an analysis
+                phash = images.perceptual_hash(item_image)
+                color = features.extract(item_image, uploaded_item.getvalue())["color"]
+                duplicates = utils.get_duplicate_index(user).find(phash, color=features.color_family(color))
+                existing = utils.get_wardrobe_item(duplicates[0][1], user) if duplicates else None
+                add_anyway = True
+                if existing:
+                    existing_category, existing_item = existing
+                    st.warning(f"This looks like a {existing_item.get('color', '')} {existing_item.get('type', 'item')} "
+                               f"already in your {existing_category}.")
+                    existing_path = images.display_path(existing_item)
+                    if integrity.exists(existing_path):
+                        st.image(existing_path, caption="Already in your wardrobe", width=150)
+                    add_anyway = st.checkbox("Add it anyway", key="add_duplicate")
+                
+                if st.button("Add to Wardrobe", key="add_to_wardrobe", disabled=not add_anyway):
                     if initialize_gemini():
-                        with st.spinner("Analyzing clothing item..."):
-                            # Generate unique ID for the item
-                            item_id = str(uuid.uuid4())[:8]
-                            
-                            # Save image file
-                            utils.ensure_data_dir()  # Make sure uploads directory exists
-                            
-                            file_path = f"uploads/{item_id}.jpg"
-                            with open(file_path, "wb") as f:
-                                f.write(uploaded_item.getbuffer())
-                            
-                            # Analyze clothing
-                            item_analysis = analyze_clothing(item_image)
-                            
-                            # Add item to wardrobe
-                            if item_analysis:
-                                try:
-                                    # Clean up and parse the JSON response
-                                    cleaned_response = item_analysis
-                                    if "```json" in item_analysis:
-                                        # If response is wrapped in markdown code block
-                                        cleaned_response = item_analysis.split("```json")[1].split("```")[0].strip()
-                                    elif item_analysis.startswith("```") and item_analysis.endswith("```"):
-                                        # If response is wrapped in generic code block
-                                        cleaned_response = item_analysis.strip("```").strip()
-                                    
-                                    # Parse the JSON
-                                    item_data = json.loads(cleaned_response)
-                                    
-                                    # Add debug output
-                                    st.write("Raw Response for Debugging:", item_analysis)
-                                    
-                                    # Add image path and ID
-                                    item_data["id"] = item_id
-                                    item_data["image_path"] = file_path
-                                    
-                                    # Add to wardrobe
-                                    st.session_state.wardrobe_items[clothing_type].append(item_data)
-                                    # Save updated wardrobe
-                                    utils.save_wardrobe(st.session_state.wardrobe_items)
-                                    st.success(f"Added {item_data['type']} to your wardrobe!")
-                                except json.JSONDecodeError as e:
-                                    st.error(f"Error parsing JSON response: {e}")
-                                    st.write("Raw response:", item_analysis)
-                                except Exception as e:
-                                    st.error(f"Error processing item: {e}")
-                                    st.write("Raw response:", item_analysis)
+                        # The image is stored and the item added once the analysis is done
+                        submit_job("clothing", {"category": clothing_type, "item_id": str(uuid.uuid4())[:8],
+                                                "phash": phash}, uploaded_item.getvalue())
                     else:
                         st.error("Please enter your Gemini API key in the sidebar.")
         
-        # Display wardrobe items
-        st.markdown("<h3>Your Wardrobe</h3>", unsafe_allow_html=True)
-        
-        category_tabs = st.tabs(["Tops", "Bottoms", "Dresses", "Shoes", "Accessories"])
-        
-        categories = ["tops", "bottoms", "dresses", "shoes", "accessories"]
-        
-        for i, tab in enumerate(category_tabs):
-            with tab:
-                category = categories[i]
-                if not st.session_state.wardrobe_items[category]:
-                    st.write(f"No {category} in your wardrobe yet.")
+        # Bulk import
+        with st.expander("Bulk Import"):
+            st.write(f"Add many {clothing_type} at once from uploaded files or a local folder.")
+            bulk_files = st.file_uploader("Upload clothing items", type=["jpg", "jpeg", "png"],
+                                          accept_multiple_files=True, key="bulk_uploader")
+            bulk_folder = st.text_input("Or import from a local folder", key="bulk_folder")
+            
+            col1, col2, col3 = st.columns([1, 1, 1])
+            with col1:
+                concurrency = st.slider("Parallel analyses", 1, 16, bulk_import.DEFAULT_CONCURRENCY)
+            with col2:
+                requests_per_minute = st.number_input("Max requests per minute", min_value=1, max_value=1000,
+                                                      value=bulk_import.DEFAULT_REQUESTS_PER_MINUTE)
+            with col3:
+                batch_size = st.slider("Images per request", 1, 16, min(stylist.BATCH_MAX_ITEMS, 16))
+            
+            if st.button("Import All", key="bulk_import"):
+                if not initialize_gemini():
+                    st.error("Please enter your Gemini API key in the sidebar.")
                 else:
-                    cols = st.columns(3)
-                    for j, item in enumerate(st.session_state.wardrobe_items[category]):
-                        with cols[j % 3]:
-                            st.markdown(f"<div class='item-card'>", unsafe_allow_html=True)
-                            
-                            # Check if image exists
-                            if os.path.exists(item["image_path"]):
-                                st.image(item["image_path"], width=150)
+                    files = [(f.name, f.getvalue()) for f in bulk_files or []]
+                    if bulk_folder:
+                        if os.path.isdir(bulk_folder):
+                            files.extend(bulk_import.files_from_folder(bulk_folder))
+                        else:
+                            st.error(f"Folder not found: {bulk_folder}")
+                    
+                    if not files:
+                        st.warning("No images to import.")
+                    else:
+                        progress = st.progress(0.0, text=f"Importing {len(files)} items...")
+                        added, failed, duplicates = 0, [], []
+                        results = bulk_import.import_items(files, clothing_type, concurrency=concurrency,
+                                                           requests_per_minute=requests_per_minute, user=user,
+                                                           batch_size=batch_size)
+                        for done, result in enumerate(results, start=1):
+                            if result["status"] == "added":
+                                # Already committed to the store; mirror it in the session
+                                st.session_state.item_index.add(clothing_type, result["item"])
+                                added += 1
+                            elif result["status"] == "duplicate":
+                                duplicates.append(result)
                             else:
-                                st.write("Image not found")
-                            
-                            st.write(f"**{item['type']}**")
-                            st.write(f"Color: {item['color']}")
-                            
-                            # Delete button
-                            if st.button(f"Remove", key=f"remove_{category}_{item['id']}"):
-                                st.session_state.wardrobe_items[category].remove(item)
-                                # Save updated wardrobe
-                                utils.save_wardrobe(st.session_state.wardrobe_items)
-                                st.rerun()
-                                
-                            st.markdown("</div>", unsafe_allow_html=True)
+                                failed.append(result)
+                            progress.progress(done / len(files), text=f"{done}/{len(files)}: {result['name']} {result['status']}")
+                        
+                        st.success(f"Added {added} of {len(files)} items to your wardrobe.")
+                        if duplicates:
+                            st.info(f"Skipped {len(duplicates)} images of items already in your wardrobe: "
+                                    + ", ".join(result["name"] for result in duplicates))
+                        for result in failed:
+                            st.error(f"{result['name']}: {result['error']} (after {result['attempts']} attempts)")
+        
+        # Display wardrobe items
+        st.markdown("<h3>Your Wardrobe</h3>", unsafe_allow_html=True)
+        wardrobe_grid()
         
         st.markdown("</div>", unsafe_allow_html=True)
 
@@ -489,50 +533,92 @@ elif app_mode == "Generate Outfits":
                         st.image(image, caption="Location Image", width=300)
 
                         if st.button("Analyze Location"):
-                            with st.spinner("Analyzing location..."):
-                                location_analysis = analyze_location(image)
-                                if location_analysis:
-                                    st.success("Location analyzed!")
-                                    try:
-                                        st.json(json.loads(location_analysis))
-                                    except Exception:
-                                        st.write(location_analysis)
-
-            # Generate outfits button
-            if st.button("Generate Outfits"):
-                if initialize_gemini():
-                    with st.spinner("Generating outfit suggestions..."):
-                        location_info = {
-                            "destination": destination,
-                            "activity": activity
-                        } if destination or activity else None
-
-                        outfits = generate_outfits(
-                            st.session_state.profile,
-                            st.session_state.wardrobe_items,
-                            location_info=location_info,
-                            time_of_day=time_of_day,
-                            location_analysis=location_analysis
-                        )
-                        
-                        if outfits:
-                            try:
-                                # Parse the JSON
-                                outfits_data = json.loads(outfits)
-                                st.session_state.recommended_outfits = outfits_data["outfit_options"]
-                                st.success("Generated outfit suggestions!")
-                            except json.JSONDecodeError as e:
-                                st.error(f"Error parsing outfit suggestions: {e}")
-                                st.write("Raw response:", outfits)
-                            except Exception as e:
-                                st.error(f"Error processing outfits: {e}")
-                                st.write("Raw response:", outfits)
+                            if initialize_gemini():
+                                submit_job("location", data=location_image.getvalue())
+                            else:
+                                st.error("Please enter your Gemini API key in the sidebar.")
+                        # Kept in the session, so it's still used after reruns and page switches
+                        location_analysis = st.session_state.get("location_analysis")
+                        if location_analysis:
+                            st.json(json.loads(location_analysis))
+
+            # Outfits come from Gemini, or from the local engine with optional Gemini naming
+            engine = st.radio("Outfit engine", ["Gemini", "Local (works offline)"], horizontal=True)
+            use_local_engine = engine != "Gemini"
+            if use_local_engine:
+                describe_with_ai = st.checkbox("Name and describe outfits with Gemini", value=False)
+            else:
+                stream_results = st.checkbox("Show outfits as they are generated", value=True)
+            
+            # Generate outfits button; Regenerate skips previously generated results
+            col1, col2 = st.columns([1, 5])
+            with col1:
+                generate_clicked = st.button("Generate Outfits")
+            with col2:
+                regenerate_clicked = st.button("Regenerate")
+            
+            if generate_clicked or regenerate_clicked:
+                location_info = {
+                    "destination": destination,
+                    "activity": activity
+                } if destination or activity else None
+                
+                if use_local_engine:
+                    outfits = outfit_engine.generate_outfits(
+                        st.session_state.profile,
+                        st.session_state.wardrobe_items,
+                        location_info=location_info,
+                        time_of_day=time_of_day,
+                        location_analysis=location_analysis
+                    )
+                    if not outfits:
+                        st.warning("No outfit combinations match your profile and wardrobe.")
+                    else:
+                        st.session_state.recommended_outfits = outfits
+                        st.session_state.last_prompt_info = None
+                        if describe_with_ai:
+                            if initialize_gemini():
+                                # Shown unnamed until the descriptions arrive
+                                submit_job("describe_outfits", {
+                                    "outfits": outfits, "profile": st.session_state.profile,
+                                    "location_info": location_info, "time_of_day": time_of_day,
+                                    "location_analysis": location_analysis,
+                                })
+                            else:
+                                st.error("Please enter your Gemini API key in the sidebar.")
+                        st.success("Generated outfit suggestions!")
                 else:
-                    st.error("Please enter your Gemini API key in the sidebar.")
+                    results_cache = outfit_cache.get_outfit_cache()
+                    cache_key = outfit_cache.outfit_key(
+                        st.session_state.profile, location_info, time_of_day, location_analysis,
+                        wardrobe_version=utils.wardrobe_version(user), user=user,
+                        settings={"model": stylist.MODEL_NAME, "top_k": retrieval.DEFAULT_TOP_K,
+                                  "token_budget": prompt_builder.DEFAULT_TOKEN_BUDGET}
+                    )
+                    cached_outfits = None if regenerate_clicked else results_cache.get(cache_key)
+                
+                    if cached_outfits:
+                        st.session_state.recommended_outfits = cached_outfits
+                        st.session_state.last_prompt_info = None
+                        st.success("Showing previously generated suggestions. Click Regenerate for new ones.")
+                    elif initialize_gemini():
+                        # Cached under cache_key by the job; streamed outfits preview in the job status
+                        submit_job("outfits", {
+                            "profile": st.session_state.profile, "location_info": location_info,
+                            "time_of_day": time_of_day, "location_analysis": location_analysis,
+                            "cache_key": cache_key, "stream": stream_results,
+                        })
+                    else:
+                        st.error("Please enter your Gemini API key in the sidebar.")
             
             # Display recommended outfits
             if st.session_state.recommended_outfits:
                 st.markdown("<h3>Recommended Outfits</h3>", unsafe_allow_html=True)
+                prompt_info = st.session_state.get("last_prompt_info")
+                if prompt_info:
+                    dropped = f", {prompt_info['dropped']} left out" if prompt_info["dropped"] else ""
+                    st.caption(f"Prompt: {prompt_info['chars']} chars, ~{prompt_info['tokens']} tokens "
+                               f"(budget {prompt_info['token_budget']}), {prompt_info['items']} items{dropped}")
                 
                 for outfit in st.session_state.recommended_outfits:
                     with st.expander(f"{outfit['name']} - {outfit['description']}", expanded=True):
@@ -548,38 +634,72 @@ elif app_mode == "Generate Outfits":
                         
                         for i, outfit_item in enumerate(outfit['items']):
                             with cols[i]:
-                                # Find the item in wardrobe
-                                item_found = False
-                                for category in st.session_state.wardrobe_items:
-                                    for item in st.session_state.wardrobe_items[category]:
-                                        if item.get('id') == outfit_item.get('item_id'):
-                                            if os.path.exists(item["image_path"]):
-                                                st.image(item["image_path"], width=150)
-                                            st.write(f"**{item['type']}**")
-                                            st.write(f"{item['color']}")
-                                            item_found = True
-                                            break
-                                    if item_found:
-                                        break
-                                        
-                                if not item_found:
+                                # Look up the item by id
+                                item = st.session_state.item_index.get(outfit_item.get('item_id'))
+                                if item:
+                                    thumbnail = images.display_path(item)
+                                    if integrity.exists(thumbnail):
+                                        st.image(thumbnail, width=150)
+                                    st.write(f"**{item['type']}**")
+                                    st.write(f"{item['color']}")
+                                else:
                                     st.write("Item not found in wardrobe")
                         
                         # Save outfit button
                         if st.button("Save to Favorites", key=f"save_{outfit['option_id']}"):
-                            st.session_state.outfit_history.append(outfit)
-                            # Save updated outfit history
-                            utils.save_outfits(st.session_state.outfit_history)
+                            # Append to the outfit history
+                            utils.save_outfit(outfit, user=user)
                             st.success("Outfit saved to favorites!")
             
-            # Display saved outfits
-            if st.session_state.outfit_history:
+            # Display saved outfits, one page at a time
+            saved_count = utils.count_outfits(user)
+            if saved_count:
                 st.markdown("<h3>Favorite Outfits</h3>", unsafe_allow_html=True)
-                for i, saved_outfit in enumerate(st.session_state.outfit_history):
-                    st.write(f"{i+1}. {saved_outfit['name']} - {saved_outfit['description']}")
+                page_size = 10
+                page_count = (saved_count + page_size - 1) // page_size
+                page = min(st.session_state.history_page, page_count - 1)
+                
+                for i, saved_outfit in enumerate(utils.load_outfits_page(page, page_size, user=user)):
+                    number = saved_count - page * page_size - i
+                    st.write(f"{number}. {saved_outfit['name']} - {saved_outfit['description']}")
+                
+                col1, col2, col3, col4 = st.columns([1, 1, 2, 2])
+                with col1:
+                    if st.button("Newer", disabled=page == 0):
+                        st.session_state.history_page = page - 1
+                        st.rerun()
+                with col2:
+                    if st.button("Older", disabled=page >= page_count - 1):
+                        st.session_state.history_page = page + 1
+                        st.rerun()
+                with col3:
+                    st.write(f"Page {page + 1} of {page_count}")
+                with col4:
+                    if st.button("Remove duplicates"):
+                        removed = utils.compact_outfits(user)
+                        st.success(f"Removed {removed} duplicate outfits")
+                        st.rerun()
         
         st.markdown("</div>", unsafe_allow_html=True)
 
 # Footer
 st.markdown("---")
-st.markdown("AI Personal Stylist - Your virtual wardrobe assistant") 
\ No newline at end of file
+st.markdown("AI Personal Stylist - Your virtual wardrobe assistant")
+
+# Debug panel: per-operation timings, bytes, tokens, cache hits and retries
+with metrics_panel:
+    app_metrics = metrics.get_metrics()
+    summary = app_metrics.summary()
+    if summary:
+        columns = ["op", "calls", "errors", "p50_ms", "p95_ms", "cache_hit_rate", "request_bytes",
+                   "response_bytes", "input_tokens", "output_tokens", "retries", "read_bytes", "write_bytes"]
+        rows = ["| " + " | ".join(columns) + " |", "|" + "---|" * len(columns)]
+        for row in summary:
+            rows.append("| " + " | ".join("" if row.get(c) is None else str(row.get(c)) for c in columns) + " |")
+        st.markdown("\n".join(rows))
+        st.caption("Recent calls")
+        st.code("\n".join(json.dumps(record) for record in app_metrics.recent(20)), language="json")
+        app_metrics.write_prometheus()
+        st.caption(f"Exported to {metrics.METRICS_PROM} and {metrics.METRICS_LOG}")
+    else:
+        st.caption("No model or storage calls recorded yet.")
\ No newline at end of file
@@ -0,0 +1,461 @@
+import os
+import io
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime, timezone
+import metrics
+
+# Benchmark the app's main flows against the local fake Gemini backend.
+#
+#   python benchmark.py --sizes 10 100 1000 10000 --latency 0.05
+#   python benchmark.py --compare bench_results/old.json bench_results/new.json
+#
+# Every run works in a throwaway directory, so it never touches data/ or uploads/.
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(REPO_DIR, "bench_results")
+
+CATEGORIES = ["tops", "bottoms", "dresses", "shoes", "accessories"]
+TYPES = {
+    "tops": ["t-shirt", "blouse", "shirt", "sweater"],
+    "bottoms": ["jeans", "skirt", "trousers", "shorts"],
+    "dresses": ["maxi dress", "midi dress", "shirt dress"],
+    "shoes": ["sneakers", "boots", "heels", "loafers"],
+    "accessories": ["scarf", "handbag", "belt", "hat"],
+}
+COLORS = ["navy blue", "white", "black", "olive green", "burgundy", "beige", "red", "light gray", "pink", "mustard"]
+PATTERNS = ["solid", "striped", "floral", "checked", "polka dot"]
+STYLES = ["casual", "formal", "bohemian", "sporty", "smart casual", "baggy"]
+OCCASIONS = [["casual"], ["work", "office"], ["party", "evening"], ["formal", "wedding"], ["beach", "casual"]]
+
+PROFILE = json.dumps({
+    "body_shape": "hourglass",
+    "skin_tone": "warm",
+    "recommended_colors": ["navy", "white", "olive", "burgundy"],
+    "avoid_styles": ["baggy clothes"],
+    "notes": "Fitted silhouettes work well.",
+})
+LOCATION_INFO = {"destination": "Paris museum district", "activity": "sightseeing"}
+
+
+def synthetic_wardrobe(size, seed=0, with_images=False):
+    """Wardrobe of `size` items spread over the categories; optionally writes small image files"""
+    rng = random.Random(seed)
+    wardrobe = {category: [] for category in CATEGORIES}
+    for n in range(size):
+        category = CATEGORIES[n % len(CATEGORIES)]
+        item_id = f"{n:08x}"
+        item = {
+            "type": rng.choice(TYPES[category]),
+            "color": rng.choice(COLORS),
+            "pattern": rng.choice(PATTERNS),
+            "style": rng.choice(STYLES),
+            "occasions": rng.choice(OCCASIONS),
+            "id": item_id,
+            "image_path": f"uploads/{item_id}.jpg",
+        }
+        if with_images:
+            write_image(item["image_path"], rng)
+        wardrobe[category].append(item)
+    return wardrobe
+
+
+def image_bytes(rng, size=(640, 480)):
+    from PIL import Image
+    image = Image.new("RGB", size, tuple(rng.randrange(256) for _ in range(3)))
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def write_image(path, rng):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(image_bytes(rng, (96, 128)))
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(int(round(q / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def measure(fn, iterations, setup=None):
+    """Time fn over several iterations; returns latency percentiles and I/O per call"""
+    durations = []
+    read_total = write_total = 0
+    extra = {}
+    for _ in range(iterations):
+        if setup:
+            setup()
+        read_before, write_before = metrics.io_counters()
+        start = time.perf_counter()
+        result = fn()
+        durations.append((time.perf_counter() - start) * 1000)
+        read_after, write_after = metrics.io_counters()
+        read_total += read_after - read_before
+        write_total += write_after - write_before
+        if isinstance(result, dict):
+            extra = result
+    return dict({
+        "iterations": iterations,
+        "p50_ms": round(percentile(durations, 50), 3),
+        "p95_ms": round(percentile(durations, 95), 3),
+        "mean_ms": round(sum(durations) / len(durations), 3),
+        "read_bytes": read_total // iterations,
+        "write_bytes": write_total // iterations,
+    }, **extra)
+
+
+def reset_state():
+    """Drop the process-wide stores so the next flow opens files in the current directory"""
+    import cache
+    import utils
+    import stylist
+    import embedding_store
+    import outfit_cache
+    import jobs
+    with jobs._queue_lock:
+        if jobs._queue is not None:
+            jobs._queue.stop()
+            jobs._queue = None
+    with jobs._wardrobe_index_lock:
+        jobs._wardrobe_indexes.clear()
+    utils._wardrobe_stores.clear()
+    utils._outfit_histories.clear()
+    utils._duplicate_indexes.clear()
+    utils._read_cache = utils.ReadCache()
+    embedding_store._stores.clear()
+    outfit_cache._outfit_cache = None
+    cache._caches.clear()
+    stylist.analysis_cache = cache.get_cache("analysis", max_entries=1000, max_bytes=50 * 1024 * 1024)
+
+
+def bench_analysis(iterations):
+    """analyze_clothing with a cold cache (new image every call) and a warm one"""
+    from PIL import Image
+    import stylist
+    rng = random.Random(1)
+    results = []
+
+    def cold():
+        data = image_bytes(rng)
+        stylist.analyze_clothing(Image.open(io.BytesIO(data)), data)
+
+    results.append(dict(flow="analyze_clothing_cold", size=None, **measure(cold, iterations)))
+
+    data = image_bytes(rng)
+    stylist.analyze_clothing(Image.open(io.BytesIO(data)), data)
+
+    def warm():
+        stylist.analyze_clothing(Image.open(io.BytesIO(data)), data)
+
+    results.append(dict(flow="analyze_clothing_cached", size=None, **measure(warm, iterations)))
+    return results
+
+
+def bench_batch_analysis(iterations, count, batch_size):
+    """Throughput of analysing count new clothing photos one per request versus batch_size per request"""
+    from PIL import Image
+    import stylist
+    rng = random.Random(2)
+    results = []
+    photos = []
+
+    def new_photos():
+        photos[:] = []
+        for _ in range(count):
+            data = image_bytes(rng)
+            photos.append((Image.open(io.BytesIO(data)), data))
+
+    def single():
+        start = time.perf_counter()
+        for image, data in photos:
+            stylist.analyze_clothing(image, data)
+        return {"items_per_sec": round(count / (time.perf_counter() - start), 2), "requests": count}
+
+    def batched():
+        calls = stylist.get_backend().calls
+        start = time.perf_counter()
+        stylist.analyze_clothing_batch(photos, max_items=batch_size)
+        elapsed = time.perf_counter() - start
+        return {"items_per_sec": round(count / elapsed, 2), "requests": stylist.get_backend().calls - calls}
+
+    results.append(dict(flow="analyze_clothing_single", size=count, **measure(single, iterations, new_photos)))
+    results.append(dict(flow=f"analyze_clothing_batch{batch_size}", size=count,
+                        **measure(batched, iterations, new_photos)))
+    speedup = results[1]["items_per_sec"] / results[0]["items_per_sec"] if results[0]["items_per_sec"] else 0
+    results[1]["speedup"] = round(speedup, 2)
+    return results
+
+
+def bench_generation(wardrobe, size, iterations):
+    """Retrieval + prompt building + generation, streamed and not, plus the local engine"""
+    import retrieval
+    import stylist
+    import json_stream
+    import outfit_engine
+    import utils
+
+    index = retrieval.WardrobeIndex(stylist.embed_text, store=utils.get_embedding_store())
+    query = retrieval.build_query_text(PROFILE, LOCATION_INFO, "Morning")
+    results = []
+
+    def prompt():
+        candidates = index.shortlist(wardrobe, query)
+        return stylist.build_outfit_prompt(PROFILE, candidates, LOCATION_INFO, "Morning")
+
+    # The first call embeds the whole wardrobe; report it separately from steady state
+    results.append(dict(flow="index_wardrobe", size=size, **measure(prompt, 1)))
+
+    def generate():
+        text, info = prompt()
+        outfits = json.loads(stylist.generate_outfits(text, info["id_map"]))
+        return {"prompt_bytes": len(text.encode("utf-8")), "prompt_tokens": info["tokens"],
+                "outfits": len(outfits["outfit_options"])}
+
+    results.append(dict(flow="generate_outfits", size=size,
+                        full_wardrobe_json_bytes=len(json.dumps(wardrobe)), **measure(generate, iterations)))
+
+    def first_outfit():
+        text, info = prompt()
+        start = time.perf_counter()
+        stream = stylist.stream_outfits(text, json_stream.ArrayItemParser(), info["id_map"])
+        next(stream)
+        first_ms = (time.perf_counter() - start) * 1000
+        for _ in stream:
+            pass
+        return {"first_outfit_ms": round(first_ms, 3)}
+
+    results.append(dict(flow="stream_outfits", size=size, **measure(first_outfit, iterations)))
+
+    def local():
+        return {"outfits": len(outfit_engine.generate_outfits(PROFILE, wardrobe, LOCATION_INFO, "Morning"))}
+
+    results.append(dict(flow="local_engine", size=size, **measure(local, iterations)))
+    return results
+
+
+def bench_storage(wardrobe, size, iterations):
+    """Wardrobe persistence: full sync, single-item add/remove and a full load"""
+    import utils
+    utils.save_wardrobe(wardrobe)
+    results = []
+    counter = iter(range(10 ** 9))
+
+    def add_remove():
+        item = dict(wardrobe["tops"][0] if wardrobe["tops"] else {}, id=f"bench{next(counter)}")
+        utils.add_wardrobe_item("tops", item)
+        utils.remove_wardrobe_item(item["id"])
+
+    results.append(dict(flow="add_remove_item", size=size, **measure(add_remove, iterations)))
+
+    def save_changed():
+        wardrobe["tops"][0]["color"] = random.choice(COLORS)
+        utils.save_wardrobe(wardrobe)
+
+    if wardrobe["tops"]:
+        results.append(dict(flow="save_wardrobe", size=size, **measure(save_changed, iterations)))
+
+    def load():
+        return {"items": sum(len(items) for items in utils.load_wardrobe().values())}
+
+    results.append(dict(flow="load_wardrobe", size=size, **measure(load, iterations)))
+    return results
+
+
+# Modules app.py imports besides streamlit; timed in a fresh interpreter
+APP_MODULES = ["utils", "retrieval", "embedding_store", "stylist", "bulk_import", "images", "json_stream",
+               "metrics", "prompt_builder", "outfit_cache", "outfit_engine"]
+
+STARTUP_SCRIPT = """
+import sys, json, time
+start = time.perf_counter()
+if sys.argv[1] == "import":
+    import {modules}
+    print(json.dumps({{"ms": (time.perf_counter() - start) * 1000}}))
+else:
+    from streamlit.testing.v1 import AppTest
+    start = time.perf_counter()
+    app = AppTest.from_file({app!r}, default_timeout=600).run()
+    first = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    app.run()
+    print(json.dumps({{"ms": first, "rerun_ms": (time.perf_counter() - start) * 1000}}))
+"""
+
+
+def bench_startup(iterations):
+    """Cold import time of the app's modules and the first/second script run, each in a new interpreter"""
+    script = STARTUP_SCRIPT.format(modules=", ".join(APP_MODULES), app=os.path.join(REPO_DIR, "app.py"))
+    # The real SDK (imported lazily or not) is what startup pays for; a dummy key exercises configure()
+    env = dict(os.environ, PYTHONPATH=REPO_DIR, GEMINI_API_KEY="bench", PYTHONWARNINGS="ignore")
+    env.pop("STYLIST_BACKEND", None)
+    results = []
+    for flow, mode in (("import_app_modules", "import"), ("app_first_run", "run")):
+        samples = []
+        for _ in range(iterations):
+            output = subprocess.check_output([sys.executable, "-c", script, mode], env=env, text=True,
+                                             stderr=subprocess.DEVNULL)
+            samples.append(json.loads(output.strip().splitlines()[-1]))
+        durations = [sample["ms"] for sample in samples]
+        result = dict(flow=flow, size=None, iterations=iterations,
+                      p50_ms=round(percentile(durations, 50), 3), p95_ms=round(percentile(durations, 95), 3),
+                      mean_ms=round(sum(durations) / len(durations), 3))
+        if mode == "run":
+            result["rerun_ms"] = round(percentile([sample["rerun_ms"] for sample in samples], 50), 3)
+        results.append(result)
+    return results
+
+
+def bench_render(size, iterations):
+    """Rerun time of the Manage Wardrobe page under Streamlit's AppTest"""
+    from streamlit.testing.v1 import AppTest
+    import utils
+    wardrobe = synthetic_wardrobe(size, with_images=True)
+    utils.save_wardrobe(wardrobe)
+
+    app = AppTest.from_file(os.path.join(REPO_DIR, "app.py"), default_timeout=600)
+    app.run()
+    app.sidebar.radio[0].set_value("Manage Wardrobe").run()
+    if app.exception:
+        return [dict(flow="render_wardrobe", size=size, error=str(app.exception[0].value))]
+    return [dict(flow="render_wardrobe", size=size, **measure(app.run, iterations))]
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run(args):
+    # The fake must be selected before stylist is first imported
+    os.environ["STYLIST_BACKEND"] = "fake"
+    os.environ.setdefault("GEMINI_API_KEY", "fake")
+    sys.path.insert(0, REPO_DIR)
+    import fake_gemini
+
+    workdir = tempfile.mkdtemp(prefix="stylist-bench-")
+    os.chdir(workdir)
+    import stylist
+    fake = fake_gemini.FakeGemini(latency=args.latency, jitter=args.jitter, fenced_ratio=args.fenced_ratio,
+                                  malformed_ratio=args.malformed_ratio, token_latency=args.token_latency)
+    stylist.set_backend(fake)
+
+    results = []
+    try:
+        for size in [None] + args.sizes:
+            sizedir = os.path.join(workdir, str(size or "analysis"))
+            os.makedirs(sizedir)
+            os.chdir(sizedir)
+            reset_state()
+            if size is None:
+                if args.startup_iterations:
+                    results.extend(bench_startup(args.startup_iterations))
+                results.extend(bench_analysis(args.iterations))
+                if args.batch_count:
+                    results.extend(bench_batch_analysis(args.iterations, args.batch_count, args.batch_size))
+                continue
+
+            wardrobe = synthetic_wardrobe(size)
+            results.extend(bench_generation(wardrobe, size, args.iterations))
+            results.extend(bench_storage(wardrobe, size, args.iterations))
+            if size <= args.render_max:
+                reset_state()
+                results.extend(bench_render(size, args.iterations))
+            print(f"size {size} done", file=sys.stderr)
+    finally:
+        os.chdir(REPO_DIR)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "commit": git_commit(),
+        "created": datetime.now(timezone.utc).isoformat(),
+        "config": vars(args),
+        "model_calls": fake.calls,
+        "embed_calls": fake.embed_calls,
+        "results": results,
+        "metrics": metrics.get_metrics().summary(),
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"{report['commit']}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print_table(results)
+    print(f"\nSaved results to {output}")
+
+
+def print_table(results):
+    print(f"{'flow':<26}{'size':>7}{'p50 ms':>11}{'p95 ms':>11}{'read B':>11}{'write B':>11}  extra")
+    for r in results:
+        extra = {k: v for k, v in r.items()
+                 if k not in ("flow", "size", "iterations", "p50_ms", "p95_ms", "mean_ms", "read_bytes", "write_bytes")}
+        print(f"{r['flow']:<26}{str(r['size'] or '-'):>7}{r.get('p50_ms', 0):>11.2f}{r.get('p95_ms', 0):>11.2f}"
+              f"{r.get('read_bytes', 0):>11}{r.get('write_bytes', 0):>11}  {json.dumps(extra) if extra else ''}")
+
+
+def compare(old_path, new_path):
+    """Print p50/p95 changes between two saved runs"""
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    old_results = {(r["flow"], r["size"]): r for r in old["results"]}
+    print(f"{old['commit']} -> {new['commit']}")
+    print(f"{'flow':<26}{'size':>7}{'p50 old':>11}{'p50 new':>11}{'change':>9}{'p95 change':>12}")
+    for r in new["results"]:
+        before = old_results.get((r["flow"], r["size"]))
+        if not before or "p50_ms" not in before or "p50_ms" not in r:
+            continue
+
+        def change(key):
+            if not before.get(key):
+                return "n/a"
+            return f"{(r[key] - before[key]) / before[key] * 100:+.1f}%"
+
+        print(f"{r['flow']:<26}{str(r['size'] or '-'):>7}{before['p50_ms']:>11.2f}{r['p50_ms']:>11.2f}"
+              f"{change('p50_ms'):>9}{change('p95_ms') if 'p95_ms' in r else 'n/a':>12}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the stylist flows against a fake Gemini backend")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000],
+                        help="synthetic wardrobe sizes (10 to 10000 items)")
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.05, help="fake model latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="uniform +/- latency jitter in seconds")
+    parser.add_argument("--fenced-ratio", type=float, default=0.5, help="share of replies wrapped in ```json")
+    parser.add_argument("--malformed-ratio", type=float, default=0.0, help="share of truncated, invalid replies")
+    parser.add_argument("--token-latency", type=float, default=0.0,
+                        help="extra fake model latency per output token in seconds")
+    parser.add_argument("--batch-count", type=int, default=16,
+                        help="photos per iteration when comparing batched and single-item analysis (0 to skip)")
+    parser.add_argument("--batch-size", type=int, default=8, help="photos per request in the batched analysis")
+    parser.add_argument("--render-max", type=int, default=100,
+                        help="largest wardrobe to time page rendering for (it writes image files)")
+    parser.add_argument("--startup-iterations", type=int, default=3,
+                        help="fresh interpreters to time imports and the first app run in (0 to skip)")
+    parser.add_argument("--output", help="where to save the JSON results (default bench_results/<commit>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two saved result files")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+    else:
+        run(args)
+
+
+if __name__ == "__main__":
+    main()
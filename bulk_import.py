@@ -0,0 +1,263 @@
+import os
+import io
+import json
+import time
+import uuid
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from PIL import Image
+import features
+import images
+import metrics
+import structured
+import stylist
+import utils
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+DEFAULT_CONCURRENCY = 4
+DEFAULT_REQUESTS_PER_MINUTE = 60
+DEFAULT_MAX_RETRIES = 3
+
+# Error class names (from google.api_core and the standard library) worth retrying
+TRANSIENT_ERRORS = {
+    "ResourceExhausted", "ServiceUnavailable", "DeadlineExceeded", "InternalServerError",
+    "TooManyRequests", "GatewayTimeout", "Aborted",
+    "ConnectionError", "TimeoutError", "ConnectionResetError",
+}
+
+
+def is_transient(error):
+    """True for rate-limit, timeout and server errors that a retry may fix"""
+    return any(cls.__name__ in TRANSIENT_ERRORS for cls in type(error).__mro__)
+
+
+def backoff_delay(attempt, cap=30):
+    """Seconds to wait before retry attempt + 1: exponential backoff with jitter, capped"""
+    return min(2 ** attempt, cap) * (0.5 + random.random())
+
+
+def call_with_retries(fn, max_retries, wait=None, on_attempt=None):
+    """Call fn, retrying transient errors with backoff; other errors and the last one are raised.
+
+    wait() runs before every attempt (e.g. a RateLimiter's) and
+    on_attempt(n) gets the 1-based number of each attempt.
+    """
+    for attempt in range(max_retries + 1):
+        if on_attempt:
+            on_attempt(attempt + 1)
+        if wait:
+            wait()
+        try:
+            return fn()
+        except Exception as e:
+            if not is_transient(e) or attempt == max_retries:
+                raise
+            time.sleep(backoff_delay(attempt))
+
+
+class RateLimiter:
+    """Thread-safe limiter that spaces calls evenly to a requests-per-minute budget"""
+
+    def __init__(self, requests_per_minute):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def files_from_folder(folder):
+    """List (name, bytes) for every image in a local folder"""
+    files = []
+    for entry in sorted(os.scandir(folder), key=lambda e: e.name):
+        if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS):
+            with open(entry.path, "rb") as f:
+                files.append((entry.name, f.read()))
+    return files
+
+
+def import_item(name, data, category, limiter, max_retries=DEFAULT_MAX_RETRIES, user=utils.DEFAULT_USER):
+    """Analyze one image and add it to the wardrobe store.
+
+    Returns a result dict with status "added", "duplicate" or "failed"; the item
+    is committed as soon as its analysis succeeds, independently of the rest of
+    the batch. Images that look like an item already in the wardrobe, or like
+    another image earlier in the same batch, are skipped before any model call.
+    """
+    with metrics.get_metrics().timed("bulk_import.item", request_bytes=len(data)) as sample:
+        result = _import_item(name, data, category, limiter, max_retries, user)
+        sample["retries"] = max(result["attempts"] - 1, 0)
+        if result["status"] == "failed":
+            sample["error"] = "failed"
+    return result
+
+
+def _new_result(name):
+    return {"name": name, "status": "failed", "attempts": 0, "item": None, "error": None}
+
+
+def _claim(result, data, user):
+    """Open an image and claim its perceptual hash in the user's duplicate index.
+
+    Returns (image, item_id, phash), or None with result updated when the
+    image is unreadable or looks like an item already claimed.
+    """
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+    except Exception as e:
+        result["error"] = f"Not a readable image: {e}"
+        return None
+
+    item_id = str(uuid.uuid4())[:8]
+    phash = images.perceptual_hash(image)
+    color = features.color_family(features.extract(image, data)["color"])
+    # Claiming the hash up front makes identical images in one batch race for a single slot
+    matches = utils.get_duplicate_index(user).claim(item_id, phash, color=color)
+    if matches:
+        result.update(status="duplicate", duplicate_of=matches[0][1],
+                      error=f"Looks like item {matches[0][1]} already in the wardrobe")
+        return None
+    return image, item_id, phash
+
+
+def _error_message(error):
+    if isinstance(error, structured.StructuredOutputError):
+        return f"Error parsing JSON response: {error}"
+    return str(error)
+
+
+def _import_item(name, data, category, limiter, max_retries, user):
+    result = _new_result(name)
+    claimed = _claim(result, data, user)
+    if claimed is None:
+        return result
+    image, item_id, phash = claimed
+    try:
+        item_data = _analyze(result, image, data, limiter, max_retries)
+        if item_data is not None:
+            _add(result, item_id, phash, data, item_data, category, user)
+    finally:
+        if result["status"] != "added":
+            utils.get_duplicate_index(user).remove(item_id)
+    return result
+
+
+def _analyze(result, image, data, limiter, max_retries):
+    try:
+        return json.loads(call_with_retries(lambda: stylist.analyze_clothing(image, data), max_retries,
+                                            wait=limiter.wait, on_attempt=lambda n: result.update(attempts=n)))
+    except Exception as e:
+        # Not retried here: a StructuredOutputError was already repaired and re-requested upstream
+        result["error"] = _error_message(e)
+        return None
+
+
+def _add(result, item_id, phash, data, item_data, category, user):
+    # A failure here is this item's alone: it is reported on its result, and
+    # the other items of a batch are still added
+    try:
+        file_path = utils.upload_path(item_id, user)
+        utils.ensure_data_dir(user)
+        with open(file_path, "wb") as f:
+            f.write(data)
+
+        item_data["id"] = item_id
+        item_data["image_path"] = file_path
+        item_data["phash"] = phash
+        images.add_derivatives(item_data)
+        utils.add_wardrobe_item(category, item_data, user=user)
+    except Exception as e:
+        result["error"] = f"Error adding item: {e}"
+        return
+
+    result.update(status="added", item=item_data, error=None)
+
+
+def import_batch(files, category, limiter, max_retries=DEFAULT_MAX_RETRIES, user=utils.DEFAULT_USER):
+    """Analyze several images with shared model requests and add them to the wardrobe store.
+
+    Like import_item for each of files (a list of (name, bytes)), but the
+    analyses go through stylist.analyze_clothing_batch, several images per
+    request. Returns the result dicts in the order of files.
+    """
+    with metrics.get_metrics().timed("bulk_import.batch", items=len(files),
+                                     request_bytes=sum(len(data) for _, data in files)) as sample:
+        results = _import_batch(files, category, limiter, max_retries, user)
+        sample["added"] = sum(result["status"] == "added" for result in results)
+        sample["retries"] = max(max(result["attempts"] for result in results) - 1, 0)
+    return results
+
+
+def _import_batch(files, category, limiter, max_retries, user):
+    results = [_new_result(name) for name, _ in files]
+    pending = []
+    for result, (_, data) in zip(results, files):
+        claimed = _claim(result, data, user)
+        if claimed is not None:
+            pending.append((result, data) + claimed)
+    try:
+        analyses = _analyze_batch(pending, limiter, max_retries)
+        for (result, data, _, item_id, phash), analysis in zip(pending, analyses):
+            if isinstance(analysis, Exception):
+                result["error"] = _error_message(analysis)
+            else:
+                _add(result, item_id, phash, data, json.loads(analysis), category, user)
+    finally:
+        for result, _, _, item_id, _ in pending:
+            if result["status"] != "added":
+                utils.get_duplicate_index(user).remove(item_id)
+    return results
+
+
+def _analyze_batch(pending, limiter, max_retries):
+    photos = [(image, data) for _, data, image, _, _ in pending]
+
+    def attempt(n):
+        for result, *_ in pending:
+            result["attempts"] = n
+
+    try:
+        # Items analysed before a failure stay cached, so a retry only asks for the rest
+        # The group is already sized by the caller; the byte budget can still split it
+        analyze = lambda: stylist.analyze_clothing_batch(photos, wait=limiter.wait, max_items=len(photos))
+        return call_with_retries(analyze, max_retries, on_attempt=attempt)
+    except Exception as e:
+        return [e] * len(photos)
+
+
+def import_items(files, category, concurrency=DEFAULT_CONCURRENCY,
+                 requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE, max_retries=DEFAULT_MAX_RETRIES,
+                 user=utils.DEFAULT_USER, batch_size=1):
+    """Analyze and add many images concurrently, yielding each result as it completes.
+
+    files is a list of (name, bytes). Analyses run on a bounded thread pool
+    and share one rate limiter; results are yielded in completion order so the
+    caller can report per-item progress. With batch_size above 1, images are
+    analysed in groups of up to batch_size per model request (see import_batch)
+    and each group's results are yielded together.
+    """
+    limiter = RateLimiter(requests_per_minute)
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        if batch_size > 1:
+            futures = [
+                pool.submit(import_batch, files[start:start + batch_size], category, limiter, max_retries, user)
+                for start in range(0, len(files), batch_size)
+            ]
+            for future in as_completed(futures):
+                yield from future.result()
+            return
+        futures = [
+            pool.submit(import_item, name, data, category, limiter, max_retries, user)
+            for name, data in files
+        ]
+        for future in as_completed(futures):
+            yield future.result()
@@ -0,0 +1,159 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+CACHE_DIR = "data/cache"
+
+
+def hash_key(*parts):
+    """Hash a sequence of str/bytes parts into a cache key"""
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        h.update(part)
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+class DiskCache:
+    """Bounded on-disk JSON cache with LRU eviction and an optional TTL.
+
+    Each entry is a small file named after its key. Recency is kept in an
+    in-memory OrderedDict seeded from file mtimes, so lookups never scan the
+    directory and eviction just pops from the front.
+    """
+
+    def __init__(self, directory, max_entries=500, max_bytes=None, ttl=None):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.RLock()
+        self._entries = OrderedDict()   # key -> size in bytes, oldest first
+        self._bytes = 0
+        os.makedirs(directory, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        found = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(".json"):
+                    stat = entry.stat()
+                    found.append((stat.st_mtime, entry.name[:-5], stat.st_size))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._bytes += size
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _drop(self, key):
+        self._bytes -= self._entries.pop(key, 0)
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def get(self, key, default=None):
+        """Return the cached value for key, counting a hit or a miss"""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return default
+            try:
+                with open(self._path(key), "r") as f:
+                    record = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                self._drop(key)
+                self.misses += 1
+                return default
+
+            if self.ttl is not None and time.time() - record.get("created", 0) > self.ttl:
+                self._drop(key)
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            try:
+                os.utime(self._path(key))
+            except OSError:
+                pass
+            self.hits += 1
+            return record["value"]
+
+    def set(self, key, value, **meta):
+        """Store a JSON-serialisable value, evicting least recently used entries"""
+        data = json.dumps({"created": time.time(), "meta": meta, "value": value})
+        with self._lock:
+            path = self._path(key)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "w") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+
+            self._bytes -= self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            self._bytes += len(data)
+            self._evict()
+
+    def keys(self):
+        """Keys currently cached, least recently used first"""
+        with self._lock:
+            return list(self._entries)
+
+    def get_meta(self, key):
+        """Return the metadata stored with an entry without counting a hit or touching recency"""
+        try:
+            with open(self._path(key), "r") as f:
+                return json.load(f).get("meta", {})
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._drop(key)
+
+    def _evict(self):
+        while self._entries and (
+            len(self._entries) > self.max_entries
+            or (self.max_bytes is not None and self._bytes > self.max_bytes)
+        ):
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+
+    def stats(self):
+        """Return hit/miss counters and current size"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(name, **kwargs):
+    """Return the process-wide cache with this name, creating it on first use"""
+    with _caches_lock:
+        if name not in _caches:
+            _caches[name] = DiskCache(os.path.join(CACHE_DIR, name), **kwargs)
+        return _caches[name]
@@ -0,0 +1,175 @@
+import threading
+
+# Hashes differing in at most this many of their 64 bits are treated as the same garment
+DEFAULT_MAX_DISTANCE = 6
+HASH_BITS = 64
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+class MultiIndexHash:
+    """Hamming range search by multi-index hashing.
+
+    The hash bits are split into max_distance + 1 bands, each with its own
+    table. Two hashes within max_distance bits of each other must agree
+    exactly on at least one band, so a query only compares against the
+    entries sharing a band with it instead of scanning every hash.
+    """
+
+    def __init__(self, max_distance=DEFAULT_MAX_DISTANCE, bits=HASH_BITS):
+        self.max_distance = max_distance
+        bands = max_distance + 1
+        self._bands = []
+        shift = 0
+        for band in range(bands):
+            width = bits // bands + (1 if band < bits % bands else 0)
+            self._bands.append((shift, (1 << width) - 1))
+            shift += width
+        self._tables = [{} for _ in self._bands]   # band value -> set of keys
+        self._values = {}                            # key -> hash
+
+    def __len__(self):
+        return len(self._values)
+
+    def __contains__(self, key):
+        return key in self._values
+
+    def _band_values(self, value):
+        return [(value >> shift) & mask for shift, mask in self._bands]
+
+    def add(self, key, value):
+        if key in self._values:
+            self.remove(key)
+        self._values[key] = value
+        for table, band in zip(self._tables, self._band_values(value)):
+            table.setdefault(band, set()).add(key)
+
+    def remove(self, key):
+        value = self._values.pop(key, None)
+        if value is None:
+            return
+        for table, band in zip(self._tables, self._band_values(value)):
+            keys = table.get(band)
+            keys.discard(key)
+            if not keys:
+                del table[band]
+
+    def search(self, value, max_distance=None):
+        """(distance, key) pairs for every hash within max_distance of value, closest first"""
+        max_distance = self.max_distance if max_distance is None else max_distance
+        if max_distance > self.max_distance:
+            # The band guarantee no longer holds; compare against everything
+            candidates = self._values.keys()
+        else:
+            candidates = set()
+            for table, band in zip(self._tables, self._band_values(value)):
+                candidates.update(table.get(band, ()))
+        found = []
+        for key in candidates:
+            distance = hamming(value, self._values[key])
+            if distance <= max_distance:
+                found.append((distance, key))
+        return sorted(found)
+
+
+def same_color(a, b):
+    """Colour tags are compatible when they are equal or either one is unknown"""
+    return not a or not b or a == b
+
+
+class DuplicateIndex:
+    """Thread-safe near-duplicate lookup over the perceptual hashes of a wardrobe's images.
+
+    The hash only sees brightness structure, so each entry can also carry a
+    colour tag (e.g. the dominant colour family); entries whose tags differ
+    are never reported as duplicates.
+    """
+
+    def __init__(self, entries=(), max_distance=DEFAULT_MAX_DISTANCE):
+        self._index = MultiIndexHash(max_distance)
+        self._colors = {}
+        self._lock = threading.Lock()
+        for item_id, phash, color in entries:
+            self.add(item_id, phash, color)
+
+    def __len__(self):
+        return len(self._index)
+
+    def add(self, item_id, phash, color=None):
+        if not phash:
+            return
+        with self._lock:
+            self._index.add(item_id, int(phash, 16))
+            self._colors[item_id] = color
+
+    def remove(self, item_id):
+        with self._lock:
+            self._index.remove(item_id)
+            self._colors.pop(item_id, None)
+
+    def _search(self, phash, max_distance, color):
+        return [(distance, item_id) for distance, item_id in self._index.search(int(phash, 16), max_distance)
+                if same_color(color, self._colors.get(item_id))]
+
+    def find(self, phash, max_distance=None, color=None):
+        """(distance, item id) of indexed items within max_distance bits, closest first"""
+        with self._lock:
+            return self._search(phash, max_distance, color)
+
+    def claim(self, item_id, phash, max_distance=None, color=None):
+        """Atomically look for duplicates and, if there are none, index item_id.
+
+        Lets concurrent imports of the same picture agree on which one goes in.
+        Returns the matches; an empty list means item_id now holds the hash.
+        """
+        with self._lock:
+            matches = self._search(phash, max_distance, color)
+            if not matches:
+                self._index.add(item_id, int(phash, 16))
+                self._colors[item_id] = color
+            return matches
+
+
+def find_duplicate_groups(entries, max_distance=DEFAULT_MAX_DISTANCE):
+    """Group (item id, hash, colour tag) entries whose hashes are within
+    max_distance and whose colour tags are compatible.
+
+    Returns lists of item ids with more than one member, each in the order the
+    entries were given, so the first id of a group is the one to keep.
+    """
+    colors = {}
+    hashed = []
+    for item_id, phash, color in entries:
+        if phash:
+            hashed.append((item_id, int(phash, 16)))
+            colors[item_id] = color
+    entries = hashed
+    order = {item_id: n for n, (item_id, _) in enumerate(entries)}
+    parent = {item_id: item_id for item_id, _ in entries}
+
+    def root(item_id):
+        while parent[item_id] != item_id:
+            parent[item_id] = parent[parent[item_id]]
+            item_id = parent[item_id]
+        return item_id
+
+    index = MultiIndexHash(max_distance)
+    for item_id, value in entries:
+        for _, other in index.search(value):
+            if not same_color(colors[item_id], colors[other]):
+                continue
+            a, b = root(item_id), root(other)
+            if a != b:
+                # The earlier entry stays the root, so it is the one kept
+                if order[a] < order[b]:
+                    parent[b] = a
+                else:
+                    parent[a] = b
+        index.add(item_id, value)
+
+    groups = {}
+    for item_id, _ in entries:
+        groups.setdefault(root(item_id), []).append(item_id)
+    return [group for group in groups.values() if len(group) > 1]
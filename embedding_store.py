@@ -0,0 +1,310 @@
+import os
+import json
+import hashlib
+import threading
+import numpy as np
+import locking
+import metrics
+
+# Vectors are stored as raw float32 rows; the log maps content hashes to rows
+VECTORS_FILE = "data/embeddings.f32"
+INDEX_FILE = "data/embeddings.log"
+
+# Compact once at least this many rows are dead and they make up this fraction of the file
+COMPACT_MIN_DEAD = 256
+COMPACT_DEAD_RATIO = 0.25
+# Query vectors (profile plus outfit context) kept; beyond this the oldest are tombstoned
+MAX_QUERY_VECTORS = 256
+
+EMBEDDING_MODEL = "models/embedding-001"
+
+
+def content_key(text, task_type, model=EMBEDDING_MODEL):
+    """Hash the embedding inputs so identical content maps to the same row"""
+    payload = f"{model}\x00{task_type}\x00{text}".encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()
+
+
+class EmbeddingStore:
+    """Append-only on-disk embedding store backed by a memory-mapped float32 file.
+
+    The index log holds one JSON record per line:
+      {"op": "meta", "dim": 768}
+      {"op": "put", "key": ..., "row": 3, "kind": "item", "item_id": "ab12cd34"}
+      {"op": "del", "key": ..., "item_id": "ab12cd34"}
+    Replaying it on load rebuilds the key -> row mapping. An entry is a
+    (content key, item id) pair, so items with identical text share one row
+    and removing one leaves the others' vector in place; a row dies with its
+    last entry. Deletes only write a tombstone and the dead rows are
+    reclaimed by compact(). At most MAX_QUERY_VECTORS query vectors are kept.
+
+    Several processes (the app, run.py plan) may share a store: writes hold
+    locking.file_lock on the log, replay what other processes appended first
+    and take the next row from the vector file's size, and readers replay the
+    log whenever it has changed since they last looked.
+    """
+
+    def __init__(self, vectors_file=VECTORS_FILE, index_file=INDEX_FILE):
+        self.vectors_file = vectors_file
+        self.index_file = index_file
+        self.dim = None
+        self._entries = {}     # (key, item_id) -> {"row", "kind"}
+        self._keys = {}        # key -> {"row", "item_ids": set of the entries' item ids}
+        self._rows = 0
+        self._mmap = None
+        self._log_id = None    # inode of the log last replayed; compaction replaces the file
+        self._offset = 0       # bytes of the log replayed so far
+        self._lock = threading.RLock()
+        os.makedirs(os.path.dirname(self.index_file) or ".", exist_ok=True)
+        with self._lock, locking.file_lock(self.index_file):
+            self._replay()
+
+    def _replay(self):
+        """Apply the log records appended since the last replay, by this or any
+        other process; starts over when the log was replaced. Call with the file lock held."""
+        try:
+            stat = os.stat(self.index_file)
+        except FileNotFoundError:
+            stat = None
+        log_id = stat.st_ino if stat else None
+        if log_id != self._log_id or (stat and stat.st_size < self._offset):
+            self.dim = None
+            self._entries = {}
+            self._keys = {}
+            self._offset = 0
+            self._mmap = None
+            self._log_id = log_id
+        reloaded = self._offset == 0
+
+        if stat is not None and stat.st_size > self._offset:
+            with open(self.index_file, "rb") as f:
+                f.seek(self._offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        # A torn last line from an interrupted append; the next append starts a new line
+                        break
+                    self._offset += len(line)
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    op = record.get("op")
+                    if op == "meta":
+                        self.dim = record["dim"]
+                    elif op == "put":
+                        self._add(record["key"], record.get("item_id"), record["row"], record.get("kind"))
+                    elif op == "del" and "item_id" in record:
+                        self._discard(record["key"], record["item_id"])
+                    elif op == "del":
+                        # Older logs tombstone a key with all its entries
+                        for item_id in list(self._keys.get(record["key"], {}).get("item_ids", ())):
+                            self._discard(record["key"], item_id)
+
+        self._rows = 0
+        if self.dim and os.path.exists(self.vectors_file):
+            self._rows = os.path.getsize(self.vectors_file) // (4 * self.dim)
+        if reloaded:
+            # Drop entries pointing past the end of the vector file (interrupted write)
+            for key, item_id in [entry for entry, e in self._entries.items() if e["row"] >= self._rows]:
+                self._discard(key, item_id)
+
+    def _add(self, key, item_id, row, kind):
+        self._discard(key, item_id)
+        self._entries[(key, item_id)] = {"row": row, "kind": kind}
+        shared = self._keys.setdefault(key, {"row": row, "item_ids": set()})
+        shared["row"] = row
+        shared["item_ids"].add(item_id)
+
+    def _discard(self, key, item_id):
+        """Drop one entry, and its key once no entry uses it; returns whether it existed"""
+        if self._entries.pop((key, item_id), None) is None:
+            return False
+        shared = self._keys[key]
+        shared["item_ids"].discard(item_id)
+        if not shared["item_ids"]:
+            del self._keys[key]
+        return True
+
+    def _current(self):
+        """Whether the replayed log and the vector mapping are up to date with the files"""
+        try:
+            stat = os.stat(self.index_file)
+        except FileNotFoundError:
+            return True
+        if stat.st_ino != self._log_id or stat.st_size != self._offset:
+            return False
+        return not self._rows or (self._mmap is not None and self._mmap.shape[0] == self._rows)
+
+    def _append_log(self, records):
+        # Called with the file lock held, right after _replay(), so the file ends where we stopped reading
+        with open(self.index_file, "ab") as f:
+            if f.tell() > self._offset:
+                f.write(b"\n")
+            f.write("".join(json.dumps(record) + "\n" for record in records).encode("utf-8"))
+            self._offset = f.tell()
+        self._log_id = os.stat(self.index_file).st_ino
+
+    def _vectors(self):
+        """Map the vector file once; remapped only after it grows or is compacted"""
+        if self._mmap is None or self._mmap.shape[0] != self._rows:
+            if not self._rows:
+                return None
+            self._mmap = np.memmap(self.vectors_file, dtype=np.float32, mode="r",
+                                   shape=(self._rows, self.dim))
+        return self._mmap
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def get(self, key):
+        """Return the stored vector for a key, or None"""
+        with self._lock:
+            if not self._current():
+                # Replay and map under the file lock, so a compaction elsewhere
+                # can't swap the vector file between the two
+                with locking.file_lock(self.index_file):
+                    self._replay()
+                    self._vectors()
+            shared = self._keys.get(key)
+            if shared is None:
+                return None
+            return np.array(self._vectors()[shared["row"]])
+
+    def put(self, key, vector, kind=None, item_id=None):
+        """Record a vector for a key and item; an item's previous vectors are tombstoned.
+
+        A key already stored for another item reuses its row instead of
+        appending the vector again.
+        """
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        with self._lock, locking.file_lock(self.index_file):
+            self._replay()
+            if (key, item_id) in self._entries:
+                return
+            records = []
+            if self.dim is None:
+                self.dim = int(vector.shape[0])
+                records.append({"op": "meta", "dim": self.dim})
+            elif vector.shape[0] != self.dim:
+                raise ValueError(f"Expected embedding of size {self.dim}, got {vector.shape[0]}")
+
+            if item_id is not None:
+                records += self._tombstones([entry for entry in self._entries if entry[1] == item_id])
+
+            if key in self._keys:
+                row = self._keys[key]["row"]
+            else:
+                with open(self.vectors_file, "ab") as f:
+                    # The next row is wherever the file ends, whichever process wrote last;
+                    # a partial row from an interrupted write is cut off first
+                    row = f.tell() // (4 * self.dim)
+                    f.truncate(row * 4 * self.dim)
+                    f.write(vector.tobytes())
+                self._rows = row + 1
+            self._add(key, item_id, row, kind)
+            records.append({"op": "put", "key": key, "row": row, "kind": kind, "item_id": item_id})
+
+            if kind == "query":
+                queries = sorted((e["row"], entry) for entry, e in self._entries.items() if e["kind"] == "query")
+                records += self._tombstones([entry for _, entry in queries[:-MAX_QUERY_VECTORS]])
+            self._append_log(records)
+        self.maybe_compact()
+
+    def _tombstones(self, entries):
+        """Discard (key, item_id) entries; returns their del records"""
+        for key, item_id in entries:
+            self._discard(key, item_id)
+        return [{"op": "del", "key": key, "item_id": item_id} for key, item_id in entries]
+
+    def _tombstone(self, select):
+        """Tombstone the entries whose (key, item_id, entry) select accepts; returns how many"""
+        with self._lock, locking.file_lock(self.index_file):
+            self._replay()
+            records = self._tombstones([(key, item_id) for (key, item_id), e in self._entries.items()
+                                        if select(key, item_id, e)])
+            if records:
+                self._append_log(records)
+            return len(records)
+
+    def delete(self, key):
+        """Tombstone a key for every item using it"""
+        self._tombstone(lambda k, item_id, entry: k == key)
+
+    def delete_item(self, item_id):
+        """Tombstone every vector recorded for a wardrobe item; content other items share stays"""
+        self._tombstone(lambda key, i, entry: i == item_id)
+
+    def retain_items(self, item_ids):
+        """Tombstone item vectors whose item is no longer in the wardrobe"""
+        item_ids = set(item_ids)
+        self._tombstone(lambda key, item_id, entry: entry["kind"] == "item" and item_id not in item_ids)
+        self.maybe_compact()
+
+    def embed(self, text, task_type, embed_fn, kind=None, item_id=None):
+        """Return the cached vector for this content, embedding it only on a miss"""
+        key = content_key(text, task_type)
+        vector = self.get(key)
+        metrics.get_metrics().cache_lookup("embedding_cache", vector is not None)
+        if vector is not None:
+            return vector
+        vector = embed_fn(text, task_type)
+        if vector is None:
+            return None
+        self.put(key, vector, kind=kind, item_id=item_id)
+        return np.asarray(vector, dtype=np.float32)
+
+    def maybe_compact(self):
+        """Compact when enough of the vector file is taken up by dead rows"""
+        dead = self._rows - len(self._keys)
+        if dead >= COMPACT_MIN_DEAD and dead >= COMPACT_DEAD_RATIO * self._rows:
+            self.compact()
+
+    def compact(self):
+        """Rewrite the vector file and log with only live rows"""
+        with self._lock, locking.file_lock(self.index_file):
+            self._replay()
+            vectors = self._vectors()
+            keys = sorted(self._keys, key=lambda k: self._keys[k]["row"])
+            tmp_vectors = self.vectors_file + ".tmp"
+            tmp_index = self.index_file + ".tmp"
+
+            entries, shared = {}, {}
+            with open(tmp_vectors, "wb") as vf, open(tmp_index, "w") as lf:
+                if self.dim is not None:
+                    lf.write(json.dumps({"op": "meta", "dim": self.dim}) + "\n")
+                for row, key in enumerate(keys):
+                    vf.write(np.asarray(vectors[self._keys[key]["row"]], dtype=np.float32).tobytes())
+                    shared[key] = {"row": row, "item_ids": set(self._keys[key]["item_ids"])}
+                    for item_id in sorted(shared[key]["item_ids"], key=str):
+                        kind = self._entries[(key, item_id)]["kind"]
+                        entries[(key, item_id)] = {"row": row, "kind": kind}
+                        lf.write(json.dumps({"op": "put", "key": key, "row": row,
+                                             "kind": kind, "item_id": item_id}) + "\n")
+
+            # Release the old mapping before replacing the file underneath it
+            self._mmap = None
+            del vectors
+            os.replace(tmp_vectors, self.vectors_file)
+            os.replace(tmp_index, self.index_file)
+            self._entries = entries
+            self._keys = shared
+            self._rows = len(keys)
+            self._log_id = os.stat(self.index_file).st_ino
+            self._offset = os.path.getsize(self.index_file)
+
+
+_stores = {}
+_store_lock = threading.Lock()
+
+
+def get_store(directory=None):
+    """Return the process-wide embedding store kept in directory (default: next to VECTORS_FILE)"""
+    directory = os.path.normpath(directory or os.path.dirname(VECTORS_FILE))
+    with _store_lock:
+        if directory not in _stores:
+            _stores[directory] = EmbeddingStore(os.path.join(directory, os.path.basename(VECTORS_FILE)),
+                                                os.path.join(directory, os.path.basename(INDEX_FILE)))
+        return _stores[directory]
@@ -0,0 +1,185 @@
+import re
+import json
+import time
+import random
+import hashlib
+import numpy as np
+
+EMBEDDING_DIM = 768
+
+PROFILE_REPLY = {
+    "body_shape": "hourglass",
+    "skin_tone": "warm",
+    "recommended_colors": ["navy", "white", "olive", "burgundy"],
+    "avoid_styles": ["baggy clothes"],
+    "notes": "Fitted silhouettes work well.",
+}
+
+LOCATION_REPLY = {
+    "location_type": "city street",
+    "environment": "urban",
+    "weather_indication": "mild and sunny",
+    "dress_code_suggestion": "smart casual",
+    "notable_features": ["cafes", "cobblestones"],
+    "recommended_style_elements": ["comfortable shoes", "layers"],
+}
+
+CLOTHING_TYPES = ["t-shirt", "blouse", "jeans", "skirt", "dress", "sneakers", "boots", "scarf"]
+COLORS = ["navy", "white", "black", "olive", "burgundy", "beige", "red", "gray"]
+
+
+class FakeUsage:
+    def __init__(self, prompt_token_count, candidates_token_count):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+        self.total_token_count = prompt_token_count + candidates_token_count
+
+
+class FakeResponse:
+    def __init__(self, text, usage_metadata=None):
+        self.text = text
+        self.usage_metadata = usage_metadata
+
+
+class FakeGenerativeModel:
+    def __init__(self, fake, model_name):
+        self.fake = fake
+        self.model_name = model_name
+
+    def generate_content(self, contents, generation_config=None, stream=False, **kwargs):
+        self.fake.calls += 1
+        prompt = contents if isinstance(contents, str) else " ".join(
+            part for part in contents if isinstance(part, str)
+        )
+        self.fake.prompt_bytes += len(prompt.encode("utf-8"))
+        json_mode = (generation_config or {}).get("response_mime_type") == "application/json"
+        text = self.fake.render(self.fake.reply_for(prompt), json_mode)
+        # Roughly four characters per token, like the real tokenizer on English and JSON
+        usage = FakeUsage(len(prompt) // 4, len(text) // 4)
+
+        if not stream:
+            self.fake.sleep(usage.candidates_token_count)
+            return FakeResponse(text, usage)
+        return self._stream(text, usage)
+
+    def _stream(self, text, usage):
+        # First chunk arrives after the model's time to first token; the rest spread over the remainder
+        chunks = [text[i:i + self.fake.chunk_size] for i in range(0, len(text), self.fake.chunk_size)]
+        total = self.fake.latency_sample(usage.candidates_token_count)
+        first = total * self.fake.first_token_fraction
+        time.sleep(first)
+        per_chunk = (total - first) / max(len(chunks), 1)
+        for n, chunk in enumerate(chunks):
+            yield FakeResponse(chunk, usage if n == len(chunks) - 1 else None)
+            time.sleep(per_chunk)
+
+
+class FakeGemini:
+    """Local stand-in for the google.generativeai module.
+
+    Exposes configure, GenerativeModel and embed_content. Replies are canned
+    JSON chosen from the prompt, returned plain, fenced in ```json (unless JSON
+    output was requested) or deliberately malformed in the configured
+    proportions, after a configurable latency. Embeddings are deterministic
+    pseudo-random unit vectors. token_latency adds time per output token, so
+    longer replies take longer, as they do on the real model.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, embed_latency=0.0, fenced_ratio=0.5, malformed_ratio=0.0,
+                 first_token_fraction=0.2, chunk_size=64, token_latency=0.0, seed=0):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.jitter = jitter
+        self.embed_latency = embed_latency
+        self.fenced_ratio = fenced_ratio
+        self.malformed_ratio = malformed_ratio
+        self.first_token_fraction = first_token_fraction
+        self.chunk_size = chunk_size
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.embed_calls = 0
+        self.prompt_bytes = 0
+
+    def configure(self, api_key=None, **kwargs):
+        pass
+
+    def GenerativeModel(self, model_name, **kwargs):
+        return FakeGenerativeModel(self, model_name)
+
+    def latency_sample(self, output_tokens=0):
+        return max(self.latency + self.random.uniform(-self.jitter, self.jitter), 0.0) \
+            + output_tokens * self.token_latency
+
+    def sleep(self, output_tokens=0):
+        delay = self.latency_sample(output_tokens)
+        if delay:
+            time.sleep(delay)
+
+    def embed_content(self, model=None, content="", task_type=None, **kwargs):
+        self.embed_calls += 1
+        if self.embed_latency:
+            time.sleep(self.embed_latency)
+        seed = int.from_bytes(hashlib.sha256(str(content).encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(EMBEDDING_DIM)
+        return {"embedding": (vector / np.linalg.norm(vector)).tolist()}
+
+    def reply_for(self, prompt):
+        """Pick a canned reply based on which prompt template was used"""
+        if "outfit_options" in prompt:
+            return self._outfits(prompt)
+        if "figure and skin tone" in prompt:
+            return PROFILE_REPLY
+        if "this location" in prompt:
+            return LOCATION_REPLY
+        if "Images are numbered" in prompt:
+            count = len(re.findall(r"\bImage \d+:", prompt))
+            return {"items": [dict(self._clothing(), index=n) for n in range(count)]}
+        if "clothing item" in prompt:
+            return self._clothing()
+        return {}
+
+    def _clothing(self):
+        return {
+            "type": self.random.choice(CLOTHING_TYPES),
+            "color": self.random.choice(COLORS),
+            "pattern": "solid",
+            "style": "casual",
+            "occasions": ["casual", "work"],
+        }
+
+    def _outfits(self, prompt):
+        # Use ids that appear in the prompt so replies resolve against the wardrobe
+        ids = re.findall(r"^([tbdsa]\d+)\|", prompt, flags=re.MULTILINE)
+        ids = ids or re.findall(r'"id": "([^"]+)"', prompt) or ["t1", "b1", "s1"]
+        options = []
+        for option_id in range(1, 4):
+            picked = self.random.sample(ids, min(3, len(ids)))
+            options.append({
+                "option_id": option_id,
+                "name": f"Outfit {option_id}",
+                "description": "A balanced everyday look",
+                "items": [{"type": "item", "item_id": item_id} for item_id in picked],
+                "occasions": ["casual"],
+                "weather": "mild",
+                "time_of_day": "Any time",
+                "location_appropriateness": "Fits the setting",
+            })
+        return {"outfit_options": options}
+
+    def render(self, reply, json_mode=False):
+        """Serialise a reply in one of the styles the real model produces.
+
+        In JSON mode (response_mime_type="application/json") replies are never
+        fenced, but can still be cut off.
+        """
+        text = json.dumps(reply, indent=2)
+        roll = self.random.random()
+        if roll < self.malformed_ratio:
+            # Truncated output with a trailing comma, like a cut-off generation
+            truncated = text[: max(len(text) * 2 // 3, 1)] + ","
+            return truncated if json_mode else "```json\n" + truncated + "\n```"
+        if json_mode:
+            return text
+        if roll < self.malformed_ratio + self.fenced_ratio:
+            return "```json\n" + text + "\n```"
+        return text
@@ -0,0 +1,275 @@
+import os
+import io
+import time
+import numpy as np
+from PIL import Image
+import images
+import outfit_engine
+
+# Attributes extracted with at least this confidence are used as they are and
+# no longer asked of the model
+MIN_CONFIDENCE = float(os.getenv("LOCAL_ATTRIBUTES_MIN_CONFIDENCE", "0.6"))
+
+# Longest edge of the probe image the features are computed on
+PROBE_EDGE = 96
+# Colour clusters per item
+CLUSTERS = 4
+KMEANS_ITERATIONS = 12
+
+# Named colours, chosen from the words outfit_engine maps to colour families,
+# with a typical sRGB value for each
+PALETTE = {
+    "black": (25, 25, 25), "charcoal": (60, 63, 68), "gray": (128, 128, 128), "silver": (190, 190, 195),
+    "white": (245, 245, 245), "cream": (245, 235, 200), "beige": (220, 200, 160), "tan": (200, 165, 120),
+    "camel": (190, 145, 95), "brown": (105, 70, 45),
+    "burgundy": (115, 25, 40), "red": (200, 35, 45), "coral": (245, 125, 105), "pink": (240, 160, 185),
+    "fuchsia": (210, 40, 140), "rust": (175, 75, 35), "orange": (240, 130, 30), "mustard": (215, 170, 40),
+    "yellow": (245, 215, 60), "olive": (110, 110, 50), "green": (45, 135, 65), "mint": (170, 230, 195),
+    "teal": (20, 125, 125), "light blue": (150, 195, 230), "denim": (85, 110, 150), "blue": (45, 85, 190),
+    "navy": (30, 38, 75), "purple": (105, 55, 145), "lavender": (190, 170, 220),
+}
+# Further reference values for names that cover a wide range: saturated navies,
+# which would otherwise sit nearer purple than the greyish navy above, and royal blue
+ANCHORS = [
+    ("navy", (0, 0, 128)), ("navy", (20, 30, 120)), ("navy", (15, 25, 60)),
+    ("blue", (65, 105, 225)), ("blue", (0, 50, 160)),
+]
+PALETTE_NAMES = list(PALETTE) + [name for name, _ in ANCHORS]
+
+# Mean absolute gradient (0-1 grey levels) below which a garment reads as solid,
+# and the gradient direction imbalance above which a patterned one reads as striped
+SOLID_ENERGY = 0.035
+STRIPE_ANISOTROPY = 0.35
+
+
+def settings():
+    """Extraction settings, used to tag cache keys"""
+    return {"min_confidence": MIN_CONFIDENCE, "probe_edge": PROBE_EDGE, "clusters": CLUSTERS,
+            "distance": "ciede2000", "name_distance": NAME_DISTANCE}
+
+
+def to_lab(rgb):
+    """sRGB (0-255, shape (..., 3)) to CIELAB, where distances track perceived colour difference"""
+    c = np.asarray(rgb, dtype=np.float64) / 255.0
+    c = np.where(c > 0.04045, ((c + 0.055) / 1.055) ** 2.4, c / 12.92)
+    xyz = c @ np.array([[0.4124, 0.2126, 0.0193],
+                        [0.3576, 0.7152, 0.1192],
+                        [0.1805, 0.0722, 0.9505]]) / np.array([0.9505, 1.0, 1.089])
+    f = np.where(xyz > 216 / 24389, np.cbrt(xyz), (24389 / 27 * xyz + 16) / 116)
+    return np.stack([116 * f[..., 1] - 16, 500 * (f[..., 0] - f[..., 1]), 200 * (f[..., 1] - f[..., 2])], axis=-1)
+
+
+PALETTE_LAB = to_lab(list(PALETTE.values()) + [rgb for _, rgb in ANCHORS])
+
+# CIEDE2000 difference at which a colour no longer reads as its palette name;
+# matches this far off count for little in the confidence
+NAME_DISTANCE = 12.0
+
+
+def ciede2000(lab1, lab2):
+    """CIEDE2000 colour difference between CIELAB arrays (broadcast over leading axes).
+
+    Unlike Euclidean distance in Lab it weighs hue and chroma differences by
+    how visible they are, which matters for dark saturated blues and purples.
+    """
+    L1, a1, b1 = np.moveaxis(np.asarray(lab1, dtype=np.float64), -1, 0)
+    L2, a2, b2 = np.moveaxis(np.asarray(lab2, dtype=np.float64), -1, 0)
+    C_bar = (np.hypot(a1, b1) + np.hypot(a2, b2)) / 2
+    G = 0.5 * (1 - np.sqrt(C_bar ** 7 / (C_bar ** 7 + 25.0 ** 7)))
+    a1, a2 = a1 * (1 + G), a2 * (1 + G)
+    C1, C2 = np.hypot(a1, b1), np.hypot(a2, b2)
+    h1 = np.degrees(np.arctan2(b1, a1)) % 360
+    h2 = np.degrees(np.arctan2(b2, a2)) % 360
+
+    dL, dC = L2 - L1, C2 - C1
+    dh = h2 - h1
+    dh = np.where(dh > 180, dh - 360, np.where(dh < -180, dh + 360, dh))
+    dh = np.where(C1 * C2 == 0, 0.0, dh)
+    dH = 2 * np.sqrt(C1 * C2) * np.sin(np.radians(dh) / 2)
+
+    L_bar, C_bar = (L1 + L2) / 2, (C1 + C2) / 2
+    h_sum = h1 + h2
+    h_bar = np.where(np.abs(h1 - h2) > 180, np.where(h_sum < 360, h_sum + 360, h_sum - 360), h_sum) / 2
+    h_bar = np.where(C1 * C2 == 0, h_sum, h_bar)
+    T = (1 - 0.17 * np.cos(np.radians(h_bar - 30)) + 0.24 * np.cos(np.radians(2 * h_bar))
+         + 0.32 * np.cos(np.radians(3 * h_bar + 6)) - 0.20 * np.cos(np.radians(4 * h_bar - 63)))
+    S_L = 1 + 0.015 * (L_bar - 50) ** 2 / np.sqrt(20 + (L_bar - 50) ** 2)
+    S_C = 1 + 0.045 * C_bar
+    S_H = 1 + 0.015 * C_bar * T
+    R_T = (-2 * np.sqrt(C_bar ** 7 / (C_bar ** 7 + 25.0 ** 7))
+           * np.sin(np.radians(60 * np.exp(-((h_bar - 275) / 25) ** 2))))
+    return np.sqrt((dL / S_L) ** 2 + (dC / S_C) ** 2 + (dH / S_H) ** 2 + R_T * (dC / S_C) * (dH / S_H))
+
+
+def kmeans(points, k=CLUSTERS, iterations=KMEANS_ITERATIONS, seed=0):
+    """Cluster points (N x D) into at most k groups; returns (centers, labels).
+
+    Seeded k-means++ initialisation, so the same image always gives the same colours.
+    """
+    rng = np.random.default_rng(seed)
+    k = min(k, len(points))
+    centers = [points[rng.integers(len(points))]]
+    nearest = ((points - centers[0]) ** 2).sum(axis=1)
+    for _ in range(1, k):
+        if not nearest.any():
+            break
+        centers.append(points[rng.choice(len(points), p=nearest / nearest.sum())])
+        nearest = np.minimum(nearest, ((points - centers[-1]) ** 2).sum(axis=1))
+    centers = np.array(centers)
+
+    def assign(centers):
+        # Squared distances as |p|^2 - 2 p.c + |c|^2, without an N x k x D temporary
+        return ((centers ** 2).sum(axis=1) - 2 * points @ centers.T).argmin(axis=1)
+
+    for _ in range(iterations):
+        labels = assign(centers)
+        counts = np.bincount(labels, minlength=len(centers))
+        sums = np.stack([np.bincount(labels, weights=points[:, d], minlength=len(centers))
+                         for d in range(points.shape[1])], axis=1)
+        updated = np.where(counts[:, None] > 0, sums / np.maximum(counts, 1)[:, None], centers)
+        if np.allclose(updated, centers):
+            break
+        centers = updated
+    labels = assign(centers)
+    return centers, labels
+
+
+def _probe(image, image_bytes=None):
+    if image_bytes is not None and getattr(image, "format", None) == "JPEG":
+        # Decode a separate copy at a fraction of full size; drafting the caller's
+        # image would also shrink what is sent to the model
+        image = Image.open(io.BytesIO(image_bytes))
+        image.draft("RGB", (PROBE_EDGE, PROBE_EDGE))
+    probe = images.reduced(image, PROBE_EDGE).convert("RGB")
+    probe.thumbnail((PROBE_EDGE, PROBE_EDGE))
+    return np.asarray(probe, dtype=np.int16)
+
+
+def _colors(pixels, mask):
+    """Named colours by share of the garment, and how sure we are of the dominant one"""
+    points = to_lab(pixels[mask])
+    centers, labels = kmeans(points)
+    shares = np.bincount(labels, minlength=len(centers)) / len(labels)
+    distances = ciede2000(centers[:, None, :], PALETTE_LAB[None, :, :])
+    names = distances.argmin(axis=1)
+
+    by_name = {}
+    for cluster, name in enumerate(names):
+        by_name[PALETTE_NAMES[name]] = by_name.get(PALETTE_NAMES[name], 0.0) + shares[cluster]
+    ranked = sorted(by_name.items(), key=lambda entry: -entry[1])
+    # A dominant colour that covers most of the garment and sits close to its
+    # named colour; one between palette names is left to the model
+    main = [cluster for cluster, name in enumerate(names) if PALETTE_NAMES[name] == ranked[0][0]]
+    closeness = np.exp(-(distances[main, names[main]].min() / NAME_DISTANCE) ** 2)
+    confidence = ranked[0][1] * closeness
+    return ranked, float(confidence)
+
+
+def _fill(mask):
+    """Fill the gaps inside a mask, e.g. stripes close to the background colour, with
+    the pixels that lie between its extents along their row or their column"""
+    rows = np.maximum.accumulate(mask, axis=1) & np.maximum.accumulate(mask[:, ::-1], axis=1)[:, ::-1]
+    cols = np.maximum.accumulate(mask, axis=0) & np.maximum.accumulate(mask[::-1], axis=0)[::-1]
+    return rows | cols
+
+
+def _erode(mask, steps):
+    """Shrink a boolean mask by steps pixels"""
+    for _ in range(steps):
+        shrunk = mask.copy()
+        shrunk[1:] &= mask[:-1]
+        shrunk[:-1] &= mask[1:]
+        shrunk[:, 1:] &= mask[:, :-1]
+        shrunk[:, :-1] &= mask[:, 1:]
+        shrunk[[0, -1], :] = shrunk[:, [0, -1]] = False
+        mask = shrunk
+    return mask
+
+
+def _pattern(pixels, mask):
+    """Coarse pattern label from grey-level gradients inside the garment"""
+    grey = pixels @ np.array([0.299, 0.587, 0.114]) / 255.0
+    gx = np.abs(np.diff(grey, axis=1))[:-1, :]
+    gy = np.abs(np.diff(grey, axis=0))[:, :-1]
+    # Leave out the garment's outline, and the resampling ringing next to it,
+    # so only its surface counts
+    inner = _erode(mask, 3)[:-1, :-1]
+    if inner.sum() < 16:
+        return "solid", 0.0
+    mean_x, mean_y = gx[inner].mean(), gy[inner].mean()
+    energy = mean_x + mean_y
+    if energy < SOLID_ENERGY:
+        return "solid", float(min(1.0, 1.5 - energy / SOLID_ENERGY))
+    anisotropy = abs(mean_x - mean_y) / energy
+    if anisotropy > STRIPE_ANISOTROPY:
+        return "striped", float(min(1.0, 0.5 + (anisotropy - STRIPE_ANISOTROPY) * 2))
+    # Busy but undirected: print, check or texture; let the model name it
+    return "patterned", 0.3
+
+
+def extract(image, image_bytes=None):
+    """Dominant colours and a coarse pattern of a clothing photo, computed locally in a few milliseconds.
+
+    The photo is reduced to a small probe, the background (the colour of the
+    border) is masked out and the garment's pixels are clustered with k-means
+    in CIELAB, each cluster named after the nearest palette colour. Returns
+    color, colors (named colours by share), pattern and a confidence for each
+    of color and pattern. Pass the uploaded file's bytes to let JPEGs be
+    decoded at reduced size.
+    """
+    start = time.perf_counter()
+    pixels = _probe(image, image_bytes)
+    mask = _fill(images.subject_mask(pixels))
+    if mask.mean() < 0.05:
+        # No clear background (e.g. a close-up of the fabric): use the whole frame
+        mask = np.ones(mask.shape, dtype=bool)
+
+    ranked, color_confidence = _colors(pixels, mask)
+    pattern, pattern_confidence = _pattern(pixels, mask)
+    if pattern == "solid" and len(ranked) > 1 and ranked[1][1] > 0.25:
+        # Large flat areas of two colours: colour-blocked rather than solid
+        pattern, pattern_confidence = "color block", pattern_confidence * 0.6
+    return {
+        "color": ranked[0][0],
+        "colors": [name for name, share in ranked if share >= 0.1],
+        "color_shares": {name: round(float(share), 3) for name, share in ranked},
+        "color_confidence": round(color_confidence, 3),
+        "pattern": pattern,
+        "pattern_confidence": round(pattern_confidence, 3),
+        "ms": round((time.perf_counter() - start) * 1000, 2),
+    }
+
+
+def color_family(name):
+    """Colour family of a palette name (e.g. "light blue" -> "blue"), or None"""
+    words = str(name or "").split()
+    return outfit_engine.COLOR_FAMILIES.get(words[-1]) if words else None
+
+
+def item_color_family(item):
+    """Colour family of an item's dominant extracted colour, or None for items without one"""
+    return color_family((item.get("colors") or [None])[0])
+
+
+def confident_attributes(extracted, min_confidence=None):
+    """The extracted attributes (color, pattern) that are confident enough to use without asking the model"""
+    min_confidence = MIN_CONFIDENCE if min_confidence is None else min_confidence
+    return {field: extracted[field] for field in ("color", "pattern")
+            if extracted[f"{field}_confidence"] >= min_confidence}
+
+
+def _add_colors(item):
+    with open(item["image_path"], "rb") as f:
+        data = f.read()
+    item["colors"] = extract(Image.open(io.BytesIO(data)), data)["colors"]
+
+
+def backfill(wardrobe_items, save_item):
+    """Extract the named colors of existing items that don't have them.
+
+    Only adds the colors list; the item's color and pattern descriptions are
+    left as they are. save_item(category, item) persists each updated item.
+    Returns the number of items that were updated.
+    """
+    return images.backfill_items(wardrobe_items, save_item, lambda item: not item.get("colors"), _add_colors,
+                                 "extracting colors from")
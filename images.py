@@ -0,0 +1,216 @@
+import os
+import io
+import time
+import numpy as np
+from PIL import Image, ImageOps
+
+# Longest edge of each derivative, in pixels. Thumbnails are shown at 150px,
+# so 300px keeps them sharp on high-density screens.
+DERIVATIVE_SIZES = {
+    "thumbnail": 300,
+    "medium": 800,
+}
+DERIVATIVE_QUALITY = 85
+
+# Images sent to the model are downscaled and re-encoded; a max edge of 0
+# sends the original upload unchanged (useful as a baseline when tuning)
+MODEL_MAX_EDGE = int(os.getenv("MODEL_IMAGE_MAX_EDGE", "1024"))
+MODEL_JPEG_QUALITY = int(os.getenv("MODEL_IMAGE_QUALITY", "85"))
+MODEL_CROP_SUBJECT = os.getenv("MODEL_IMAGE_CROP", "0") == "1"
+
+
+def derivative_path(image_path, size_name):
+    """Path of a derivative stored next to the original, e.g. uploads/ab12cd34_thumbnail.jpg"""
+    root, _ = os.path.splitext(image_path)
+    return f"{root}_{size_name}.jpg"
+
+
+def make_derivatives(image_path):
+    """Create every derivative size for an uploaded image; returns {size_name: path}"""
+    paths = {}
+    with Image.open(image_path) as original:
+        image = ImageOps.exif_transpose(original).convert("RGB")
+        for size_name, max_edge in DERIVATIVE_SIZES.items():
+            derivative = image.copy()
+            derivative.thumbnail((max_edge, max_edge), Image.LANCZOS)
+            path = derivative_path(image_path, size_name)
+            derivative.save(path, "JPEG", quality=DERIVATIVE_QUALITY, optimize=True)
+            paths[size_name] = path
+    return paths
+
+
+def add_derivatives(item):
+    """Generate derivatives for a wardrobe item and record their paths on it"""
+    paths = make_derivatives(item["image_path"])
+    item["thumbnail_path"] = paths["thumbnail"]
+    item["medium_path"] = paths["medium"]
+    return item
+
+
+def display_path(item, size_name="thumbnail"):
+    """Best image to render for an item, falling back to the original upload"""
+    return item.get(f"{size_name}_path") or item.get("image_path", "")
+
+
+def backfill_items(wardrobe_items, save_item, needs, compute, action):
+    """Update the existing items that need it, one at a time.
+
+    needs(item) says whether an item with an image on disk is missing the
+    data; compute(item) adds it to the item in place. Failures are printed as
+    "Error <action> <path>" and skip the item. save_item(category, item)
+    persists each updated item. Returns the number of items that were updated.
+    """
+    updated = 0
+    for category, items in wardrobe_items.items():
+        for item in items:
+            image_path = item.get("image_path", "")
+            if not os.path.exists(image_path) or not needs(item):
+                continue
+            try:
+                compute(item)
+            except Exception as e:
+                print(f"Error {action} {image_path}: {e}")
+                continue
+            save_item(category, item)
+            updated += 1
+    return updated
+
+
+def _missing_derivatives(item):
+    return not (all(os.path.exists(derivative_path(item["image_path"], size_name)) for size_name in DERIVATIVE_SIZES)
+                and item.get("thumbnail_path") and item.get("medium_path"))
+
+
+def backfill(wardrobe_items, save_item):
+    """Create missing derivatives for existing items.
+
+    save_item(category, item) persists each updated item. Returns the number
+    of items that were updated.
+    """
+    return backfill_items(wardrobe_items, save_item, _missing_derivatives, add_derivatives, "creating derivatives for")
+
+
+def reduced(image, min_edge):
+    """Cheap EXIF-oriented copy of an image, box-reduced so its shorter edge stays at least min_edge.
+
+    For probes that analyse the image at low resolution: the cost barely grows
+    with the photo's resolution, unlike resizing a full-size copy.
+    """
+    if image.mode not in ("L", "LA", "RGB", "RGBA", "CMYK", "I", "F"):
+        # Palette and bilevel images can't be box-reduced directly
+        image = image.convert("RGBA")
+    probe = image.reduce(max(1, min(image.size) // min_edge))
+    probe.info = image.info   # keep the EXIF orientation for exif_transpose
+    return ImageOps.exif_transpose(probe)
+
+
+# Perceptual hash: a difference hash over a HASH_SIZE x HASH_SIZE grid, 64 bits by default
+HASH_SIZE = 8
+
+
+def perceptual_hash(image, hash_size=HASH_SIZE):
+    """Difference hash (dHash) of an image as a hex string.
+
+    The image is shrunk to a (hash_size + 1) x hash_size grayscale grid and
+    each bit records whether a cell is brighter than its right-hand neighbour,
+    so re-encoding, resizing and small edits change only a few bits.
+    """
+    grid = reduced(image, 64).convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS)
+    pixels = np.asarray(grid, dtype=np.int16)
+    bits = pixels[:, 1:] > pixels[:, :-1]
+    return np.packbits(bits.ravel()).tobytes().hex()
+
+
+def _add_hash(item):
+    with Image.open(item["image_path"]) as image:
+        item["phash"] = perceptual_hash(image)
+
+
+def backfill_hashes(wardrobe_items, save_item):
+    """Compute the perceptual hash of existing items that don't have one.
+
+    save_item(category, item) persists each updated item. Returns the number
+    of items that were updated.
+    """
+    return backfill_items(wardrobe_items, save_item, lambda item: not item.get("phash"), _add_hash, "hashing")
+
+
+def model_settings():
+    """Current preprocessing settings, used to tag cache keys and stats"""
+    return {"max_edge": MODEL_MAX_EDGE, "quality": MODEL_JPEG_QUALITY, "crop": MODEL_CROP_SUBJECT}
+
+
+def subject_mask(pixels, tolerance=30):
+    """Boolean mask of the pixels (an H x W x 3 int array) that differ from the
+    background colour, taken as the median of the border pixels, by more than the tolerance"""
+    border = np.concatenate([pixels[0], pixels[-1], pixels[:, 0], pixels[:, -1]])
+    background = np.median(border, axis=0)
+    return np.abs(pixels - background).max(axis=2) > tolerance
+
+
+def crop_to_subject(image, tolerance=30, margin=0.05, probe_edge=256):
+    """Crop away a roughly uniform background around the subject.
+
+    The background colour is the median of the border pixels; anything that
+    differs from it by more than the tolerance counts as subject. The box is
+    found on a small probe copy and scaled back up, so cost doesn't grow with
+    the photo's resolution.
+    """
+    probe = image.copy()
+    probe.thumbnail((probe_edge, probe_edge))
+    scale_x = image.width / probe.width
+    scale_y = image.height / probe.height
+
+    mask = subject_mask(np.asarray(probe, dtype=np.int16), tolerance)
+    if not mask.any():
+        return image
+
+    rows = np.flatnonzero(mask.any(axis=1))
+    cols = np.flatnonzero(mask.any(axis=0))
+    height, width = mask.shape
+    pad_y, pad_x = int(height * margin), int(width * margin)
+    box = (
+        int(max(cols[0] - pad_x, 0) * scale_x),
+        int(max(rows[0] - pad_y, 0) * scale_y),
+        int(min(cols[-1] + 1 + pad_x, width) * scale_x),
+        int(min(rows[-1] + 1 + pad_y, height) * scale_y),
+    )
+    return image.crop(box)
+
+
+def prepare_for_model(image, image_bytes=None, max_edge=None, quality=None, crop_subject=None):
+    """Normalise an image before it is sent to the model.
+
+    Applies EXIF orientation, optionally crops to the subject, downscales to
+    max_edge and re-encodes as JPEG. Returns (content part, stats) where the
+    content part can be passed to generate_content directly.
+    """
+    max_edge = MODEL_MAX_EDGE if max_edge is None else max_edge
+    quality = MODEL_JPEG_QUALITY if quality is None else quality
+    crop_subject = MODEL_CROP_SUBJECT if crop_subject is None else crop_subject
+    original_bytes = len(image_bytes) if image_bytes is not None else None
+
+    if not max_edge:
+        return image, {"original_bytes": original_bytes, "sent_bytes": original_bytes, "preprocess_ms": 0.0}
+
+    start = time.perf_counter()
+    if image_bytes is not None and getattr(image, "format", None) == "JPEG":
+        # Let the JPEG decoder downscale while decoding instead of after. Drafting
+        # needs an image that isn't loaded yet and changes it, so decode a copy
+        # rather than the caller's
+        image = Image.open(io.BytesIO(image_bytes))
+        image.draft("RGB", (max_edge, max_edge))
+    prepared = ImageOps.exif_transpose(image).convert("RGB")
+    if crop_subject:
+        prepared = crop_to_subject(prepared)
+    prepared.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+    buffer = io.BytesIO()
+    prepared.save(buffer, "JPEG", quality=quality, optimize=True)
+    data = buffer.getvalue()
+    stats = {
+        "original_bytes": original_bytes,
+        "sent_bytes": len(data),
+        "preprocess_ms": (time.perf_counter() - start) * 1000,
+    }
+    return {"mime_type": "image/jpeg", "data": data}, stats
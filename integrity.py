@@ -0,0 +1,149 @@
+import os
+import time
+import threading
+import images
+
+# A directory modified this recently may change again within the same mtime
+# tick (filesystems with coarse timestamps), so its listing isn't trusted yet
+RACY_SECONDS = 2.0
+# Unreferenced uploads younger than this are kept: an analysis may be about to
+# add the item that uses them
+ORPHAN_MIN_AGE = int(os.getenv("ORPHAN_MIN_AGE_SECONDS", "3600"))
+
+
+def _split(path):
+    # Absolute, so relative and absolute paths to one directory share a listing
+    return os.path.split(os.path.abspath(path)) if path else (os.path.abspath("."), "")
+
+
+class PresenceCache:
+    """Which files exist, from one os.scandir per directory.
+
+    A directory's listing is reused until the directory's mtime changes, which
+    happens whenever a file in it is created, deleted or renamed, so checking
+    a path costs one stat of its directory and a set lookup instead of a stat
+    of every file.
+    """
+
+    def __init__(self):
+        self._listings = {}   # directory -> (mtime_ns, names, racy)
+        self._lock = threading.Lock()
+
+    def listing(self, directory):
+        """Names of the files (not subdirectories) in a directory; empty if it doesn't exist"""
+        directory = os.path.abspath(directory or ".")
+        try:
+            stamp = os.stat(directory).st_mtime_ns
+        except OSError:
+            return frozenset()
+        with self._lock:
+            entry = self._listings.get(directory)
+        if entry is not None and entry[0] == stamp and not entry[2]:
+            return entry[1]
+
+        try:
+            with os.scandir(directory) as entries:
+                names = frozenset(entry.name for entry in entries if entry.is_file())
+        except OSError:
+            return frozenset()
+        racy = time.time_ns() - stamp < RACY_SECONDS * 1e9
+        with self._lock:
+            self._listings[directory] = (stamp, names, racy)
+        return names
+
+    def exists(self, path):
+        """os.path.exists for a file, answered from its directory's cached listing"""
+        directory, name = _split(path)
+        return bool(name) and name in self.listing(directory)
+
+    def forget(self, directory):
+        with self._lock:
+            self._listings.pop(os.path.abspath(directory), None)
+
+
+_presence = PresenceCache()
+
+
+def exists(path):
+    """Whether a file exists, via the process-wide presence cache; for renderers checking many images per rerun"""
+    return _presence.exists(path)
+
+
+def item_paths(item):
+    """The files an item refers to: its upload and each derivative, where recorded or else where expected"""
+    image_path = item.get("image_path")
+    if not image_path:
+        return []
+    return [image_path] + [item.get(f"{size}_path") or images.derivative_path(image_path, size)
+                           for size in images.DERIVATIVE_SIZES]
+
+
+def reconcile(wardrobe_items, upload_dir=None, delete=False, min_age=ORPHAN_MIN_AGE):
+    """Check a wardrobe against the files on disk in one pass.
+
+    Each directory the items point into is listed once, so the cost is one
+    scandir per directory plus O(items) set lookups. Returns a report with the
+    items whose image is missing, the items missing a derivative (python
+    run.py backfill-thumbnails recreates those) and, when upload_dir is given,
+    the files in it that no item refers to with their total size. With
+    delete, orphans older than min_age seconds are removed and their size is
+    reported as reclaimed_bytes.
+    """
+    cwd = os.getcwd()
+    directories = {}   # directory as written -> (absolute directory, listing)
+
+    def locate(path):
+        # Resolve each distinct directory once; items share a handful of them.
+        # rpartition rather than os.path.split, which costs more than the lookups it serves
+        if os.altsep:
+            path = path.replace(os.altsep, os.sep)
+        directory, _, name = path.rpartition(os.sep)
+        entry = directories.get(directory)
+        if entry is None:
+            absolute = os.path.normpath(os.path.join(cwd, directory))
+            entry = directories[directory] = (absolute, _presence.listing(absolute))
+        return entry, name
+
+    report = {"items": 0, "missing": [], "missing_derivatives": [], "orphans": [], "orphan_bytes": 0,
+              "deleted": 0, "reclaimed_bytes": 0}
+    referenced = set()   # (absolute directory, file name)
+    for category, items in wardrobe_items.items():
+        for item in items:
+            report["items"] += 1
+            found = []
+            for path in item_paths(item):
+                (directory, listing), name = locate(path)
+                referenced.add((directory, name))
+                found.append(name in listing)
+            entry = {"category": category, "id": item.get("id"), "path": item.get("image_path", "")}
+            # The first path is the upload itself
+            if not found or not found[0]:
+                report["missing"].append(entry)
+            elif not all(found):
+                report["missing_derivatives"].append(entry)
+
+    if upload_dir is None:
+        return report
+    upload_dir = os.path.normpath(os.path.join(cwd, upload_dir))
+    now = time.time()
+    for name in sorted(_presence.listing(upload_dir)):
+        if (upload_dir, name) in referenced:
+            continue
+        path = os.path.join(upload_dir, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        report["orphans"].append({"path": path, "bytes": stat.st_size})
+        report["orphan_bytes"] += stat.st_size
+        if delete and now - stat.st_mtime >= min_age:
+            try:
+                os.remove(path)
+            except OSError as e:
+                print(f"Error deleting {path}: {e}")
+                continue
+            report["deleted"] += 1
+            report["reclaimed_bytes"] += stat.st_size
+    if report["deleted"]:
+        _presence.forget(upload_dir)
+    return report
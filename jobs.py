@@ -0,0 +1,350 @@
+import io
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from PIL import Image
+import bulk_import
+import images
+import json_stream
+import metrics
+import outfit_cache
+import retrieval
+import stylist
+import utils
+
+# Background jobs: model calls submitted from the app run on a worker pool
+# outside the Streamlit script, and their state and results are kept in SQLite
+# so they survive reruns, page switches and restarts.
+
+JOBS_DB = "data/jobs.db"
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_MAX_RETRIES = int(os.getenv("JOB_MAX_RETRIES", "3"))
+# Finished jobs (and the uploads they carry) are deleted after this long
+JOB_RETENTION = 7 * 24 * 3600
+# How often idle workers look for jobs submitted by another process
+POLL_SECONDS = 1.0
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    user TEXT NOT NULL,
+    status TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    input BLOB,
+    progress TEXT,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    owner INTEGER,
+    run_after REAL NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_pending ON jobs (status, run_after, created);
+CREATE INDEX IF NOT EXISTS jobs_user ON jobs (user, status);
+"""
+
+# Columns returned to callers; the input blob stays in the database
+_FIELDS = "id, kind, user, status, payload, progress, result, error, attempts, created, updated"
+
+# kind -> handler(job, report); see handler()
+HANDLERS = {}
+
+
+def handler(kind):
+    """Register a function as the handler of a job kind.
+
+    The handler gets the job dict (payload, input bytes, user) and a
+    report(progress) callback for partial results, and returns the job's
+    JSON-serialisable result. Errors that bulk_import.is_transient accepts
+    are retried with backoff; any other error fails the job.
+    """
+    def register(fn):
+        HANDLERS[kind] = fn
+        return fn
+    return register
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # Exists but isn't ours to signal
+        return True
+    return True
+
+
+def _row(row):
+    job = dict(zip([name.strip() for name in _FIELDS.split(",")], row))
+    for field in ("payload", "progress", "result"):
+        job[field] = json.loads(job[field]) if job[field] is not None else None
+    return job
+
+
+class JobQueue:
+    """Persistent job queue with a pool of worker threads.
+
+    submit() stores a job and returns its id at once; workers claim queued
+    jobs in submission order, run their handler and store the result or the
+    error. Jobs left running by a process that is no longer alive are queued
+    again when the next queue starts, so a restart doesn't lose them.
+    """
+
+    def __init__(self, path=JOBS_DB, workers=JOB_WORKERS, max_retries=JOB_MAX_RETRIES, handlers=None):
+        # Absolute, so worker threads opening their connection later use the same file
+        self.path = os.path.abspath(path)
+        self.workers = workers
+        self.max_retries = max_retries
+        self.handlers = HANDLERS if handlers is None else handlers
+        self._local = threading.local()
+        self._wakeup = threading.Condition()
+        self._threads = []
+        self._stopping = False
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._conn()
+
+    def _conn(self):
+        # sqlite3 connections can't be shared across threads; keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            # Idempotent; every connection ensures the table, in case the file was replaced since
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def start(self):
+        """Recover jobs orphaned by a dead process, drop expired ones and start the workers"""
+        if self._threads:
+            return
+        conn = self._conn()
+        running = conn.execute("SELECT id, owner FROM jobs WHERE status = ?", (RUNNING,)).fetchall()
+        orphaned = [job_id for job_id, owner in running
+                    if owner is None or owner == os.getpid() or not _pid_alive(owner)]
+        for job_id in orphaned:
+            conn.execute("UPDATE jobs SET status = ?, owner = NULL, updated = ? WHERE id = ? AND status = ?",
+                         (QUEUED, time.time(), job_id, RUNNING))
+        if orphaned:
+            print(f"Re-queued {len(orphaned)} interrupted jobs")
+        conn.execute("DELETE FROM jobs WHERE status IN (?, ?) AND updated < ?",
+                     (DONE, FAILED, time.time() - JOB_RETENTION))
+        for n in range(max(1, self.workers)):
+            thread = threading.Thread(target=self._work, name=f"job-worker-{n}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        """Let the workers finish their current job and exit"""
+        with self._wakeup:
+            self._stopping = True
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+        self._stopping = False
+
+    def submit(self, kind, payload=None, data=None, user=utils.DEFAULT_USER):
+        """Queue a job and return its id; data is optional binary input such as an uploaded image"""
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job_id = uuid.uuid4().hex[:12]
+        now = time.time()
+        self._conn().execute(
+            "INSERT INTO jobs (id, kind, user, status, payload, input, created, updated) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, kind, utils.normalise_user(user), QUEUED, json.dumps(payload or {}), data, now, now),
+        )
+        metrics.get_metrics().record("job.submit", 0.0, kind=kind, request_bytes=len(data or b""))
+        with self._wakeup:
+            self._wakeup.notify()
+        return job_id
+
+    def get(self, job_id):
+        """The job's status, payload, progress, result and error, or None for an unknown id"""
+        row = self._conn().execute(f"SELECT {_FIELDS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return _row(row) if row else None
+
+    def active(self, user=utils.DEFAULT_USER):
+        """A user's queued and running jobs, oldest first"""
+        rows = self._conn().execute(
+            f"SELECT {_FIELDS} FROM jobs WHERE user = ? AND status IN (?, ?) ORDER BY created",
+            (utils.normalise_user(user), QUEUED, RUNNING),
+        ).fetchall()
+        return [_row(row) for row in rows]
+
+    def _claim(self):
+        """Mark the oldest runnable job as ours; returns it with its input, or None"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE status = ? AND run_after <= ? ORDER BY created LIMIT 1",
+                (QUEUED, time.time()),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE jobs SET status = ?, owner = ?, attempts = attempts + 1, updated = ? WHERE id = ?",
+                         (RUNNING, os.getpid(), time.time(), row[0]))
+        finally:
+            conn.execute("COMMIT")
+        job = self.get(row[0])
+        job["input"] = conn.execute("SELECT input FROM jobs WHERE id = ?", (row[0],)).fetchone()[0]
+        return job
+
+    def _update(self, job_id, **fields):
+        fields["updated"] = time.time()
+        self._conn().execute(f"UPDATE jobs SET {', '.join(f'{name} = ?' for name in fields)} WHERE id = ?",
+                             (*fields.values(), job_id))
+
+    def _run(self, job):
+        def report(progress):
+            self._update(job["id"], progress=json.dumps(progress))
+
+        with metrics.get_metrics().timed(f"job.{job['kind']}", attempt=job["attempts"]) as sample:
+            try:
+                result = self.handlers[job["kind"]](job, report)
+            except Exception as e:
+                sample["error"] = type(e).__name__
+                if bulk_import.is_transient(e) and job["attempts"] <= self.max_retries:
+                    # Requeued for later rather than slept on, so the worker isn't held up
+                    delay = bulk_import.backoff_delay(job["attempts"], cap=60)
+                    self._update(job["id"], status=QUEUED, owner=None, error=str(e), run_after=time.time() + delay)
+                else:
+                    # Finished jobs keep their row for status lookups but not the uploaded bytes
+                    self._update(job["id"], status=FAILED, owner=None, error=str(e) or type(e).__name__, input=None)
+                return
+            self._update(job["id"], status=DONE, owner=None, error=None, result=json.dumps(result), input=None)
+
+    def _work(self):
+        while not self._stopping:
+            try:
+                job = self._claim()
+            except sqlite3.Error as e:
+                print(f"Error claiming job: {e}")
+                job = None
+            if job is None:
+                with self._wakeup:
+                    if not self._stopping:
+                        self._wakeup.wait(POLL_SECONDS)
+                continue
+            self._run(job)
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue():
+    """Return the process-wide job queue, starting its workers on first use"""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue()
+            _queue.start()
+        return _queue
+
+
+# Wardrobe embedding index per user, shared by the outfit jobs so items are embedded once
+_wardrobe_indexes = {}
+_wardrobe_index_lock = threading.Lock()
+
+
+def wardrobe_index(user=utils.DEFAULT_USER):
+    """Return the shared retrieval index over a user's wardrobe"""
+    user = utils.normalise_user(user)
+    with _wardrobe_index_lock:
+        if user not in _wardrobe_indexes:
+            _wardrobe_indexes[user] = retrieval.WardrobeIndex(stylist.try_embed_text, store=utils.get_embedding_store(user))
+        return _wardrobe_indexes[user]
+
+
+def _image(job):
+    return Image.open(io.BytesIO(job["input"]))
+
+
+@handler("profile")
+def analyze_profile(job, report):
+    """Analyze a photo of the user and save it as their profile"""
+    profile = stylist.analyze_image(_image(job), job["input"])
+    utils.save_profile(profile, user=job["user"])
+    return profile
+
+
+@handler("clothing")
+def add_clothing(job, report):
+    """Analyze a clothing photo and add it to the wardrobe under the id chosen at submission"""
+    payload, data, user = job["payload"], job["input"], job["user"]
+    item = json.loads(stylist.analyze_clothing(_image(job), data))
+
+    # Written only once the analysis succeeded; a re-run after a crash overwrites the same files
+    file_path = utils.upload_path(payload["item_id"], user)
+    utils.ensure_data_dir(user)
+    with open(file_path, "wb") as f:
+        f.write(data)
+    item["id"] = payload["item_id"]
+    item["image_path"] = file_path
+    item["phash"] = payload.get("phash")
+    images.add_derivatives(item)
+    utils.add_wardrobe_item(payload["category"], item, user=user)
+    return {"category": payload["category"], "item": item}
+
+
+@handler("location")
+def analyze_location(job, report):
+    """Analyze a location photo; the result is the analysis JSON text"""
+    return stylist.analyze_location(_image(job), job["input"])
+
+
+@handler("outfits")
+def generate_outfits(job, report):
+    """Generate outfits with Gemini from a retrieval shortlist of the stored wardrobe.
+
+    With payload["stream"], the outfits completed so far are reported as
+    progress while the reply streams in. Results are cached under
+    payload["cache_key"], like the app's synchronous generation.
+    """
+    payload, user = job["payload"], job["user"]
+    profile, location_info = payload["profile"], payload.get("location_info")
+    time_of_day, location_analysis = payload.get("time_of_day"), payload.get("location_analysis")
+
+    wardrobe = utils.load_wardrobe(user)
+    query_text = retrieval.build_query_text(profile, location_info, time_of_day, location_analysis)
+    candidates = wardrobe_index(user).shortlist(wardrobe, query_text)
+    prompt, info = stylist.build_outfit_prompt(profile, candidates, location_info, time_of_day, location_analysis)
+
+    skipped = 0
+    if payload.get("stream"):
+        parser = json_stream.ArrayItemParser()
+        outfits = []
+        for outfit in stylist.stream_outfits(prompt, parser, info["id_map"]):
+            outfits.append(outfit)
+            report({"outfits": outfits})
+        skipped = parser.errors
+    else:
+        outfits = json.loads(stylist.generate_outfits(prompt, info["id_map"]))["outfit_options"]
+
+    if outfits and payload.get("cache_key"):
+        outfit_cache.get_outfit_cache().set(payload["cache_key"], outfits)
+    prompt_info = {name: value for name, value in info.items() if name != "id_map"}
+    return {"outfits": outfits, "prompt_info": prompt_info, "skipped": skipped}
+
+
+@handler("describe_outfits")
+def describe_outfits(job, report):
+    """Name and describe outfits chosen by the local engine"""
+    payload, user = job["payload"], job["user"]
+    items = utils.ItemIndex(utils.load_wardrobe(user))
+    outfits = stylist.describe_outfits(payload["outfits"], items.get, payload["profile"],
+                                       payload.get("location_info"), payload.get("time_of_day"),
+                                       payload.get("location_analysis"))
+    return {"outfits": outfits}
@@ -0,0 +1,80 @@
+import json
+
+
+class ArrayItemParser:
+    """Incrementally pull complete objects out of a streamed JSON array.
+
+    Feed text chunks as they arrive; every object that is an element of the
+    first array found (either a top-level array or an array value of the
+    top-level object, e.g. {"outfit_options": [...]}) is returned from feed()
+    as soon as its closing brace has been seen. Text before the first brace,
+    such as a ```json fence, is ignored. Elements that fail to parse are
+    counted in `errors` and skipped rather than aborting the stream.
+    """
+
+    def __init__(self):
+        self.buffer = []
+        self.errors = 0
+        self.items = []
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        self._element = None    # characters of the element being collected
+        self._done = False      # the target array has been closed
+
+    def feed(self, chunk):
+        """Consume a chunk of text and return the elements completed by it"""
+        completed = []
+        for ch in chunk:
+            self.buffer.append(ch)
+            if self._done:
+                continue
+            if self._element is not None:
+                self._element.append(ch)
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+
+            if ch == '"':
+                if self._stack:
+                    self._in_string = True
+            elif ch in "{[":
+                if ch == "{" and self._element is None and self._at_array_level():
+                    self._element = [ch]
+                self._stack.append(ch)
+            elif ch in "}]":
+                if not self._stack:
+                    continue
+                self._stack.pop()
+                if ch == "}" and self._element is not None and self._at_array_level():
+                    item = self._finish_element()
+                    if item is not None:
+                        completed.append(item)
+                elif ch == "]" and self._element is None and len(self._stack) <= 1 and self.items:
+                    self._done = True
+        return completed
+
+    def _at_array_level(self):
+        # Inside the first array: a top-level array, or an array directly under the top-level object
+        return (self._stack == ["["]) or (self._stack == ["{", "["])
+
+    def _finish_element(self):
+        text = "".join(self._element)
+        self._element = None
+        try:
+            item = json.loads(text)
+        except json.JSONDecodeError:
+            self.errors += 1
+            return None
+        self.items.append(item)
+        return item
+
+    def text(self):
+        """Everything fed so far"""
+        return "".join(self.buffer)
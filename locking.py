@@ -0,0 +1,57 @@
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: fall back to in-process locking only
+    fcntl = None
+
+_thread_locks = {}
+_thread_locks_lock = threading.Lock()
+
+
+def _thread_lock(path):
+    with _thread_locks_lock:
+        lock = _thread_locks.get(path)
+        if lock is None:
+            lock = _thread_locks[path] = threading.Lock()
+        return lock
+
+
+@contextmanager
+def file_lock(path):
+    """Exclusive lock for writers of path, held across threads and processes.
+
+    Uses an advisory flock on a sidecar path + ".lock" file, so readers that
+    only open the data file are never blocked.
+    """
+    lock_path = os.path.abspath(path) + ".lock"
+    with _thread_lock(lock_path):
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+        with open(lock_path, "a") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def atomic_write(path, data):
+    """Replace path with data (str or bytes) so readers see either the old or the new file, never a partial one"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    mode = "wb" if isinstance(data, bytes) else "w"
+    try:
+        with open(tmp_path, mode) as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
@@ -0,0 +1,262 @@
+import os
+import json
+import time
+import threading
+import functools
+from collections import deque
+from contextlib import contextmanager
+
+# Every recorded call is appended to METRICS_LOG; aggregates are rewritten to
+# METRICS_PROM in Prometheus text format for a local scraper (node_exporter's
+# textfile collector or anything that reads the file)
+METRICS_LOG = "data/metrics.jsonl"
+METRICS_PROM = "data/metrics.prom"
+MAX_LOG_BYTES = 20 * 1024 * 1024   # rotated to metrics.jsonl.1 beyond this
+PROM_WRITE_INTERVAL = 5.0          # seconds between rewrites of the .prom file
+RECENT_CALLS = 200
+LATENCY_SAMPLES = 512              # per-operation window for the quantiles
+
+
+def io_counters():
+    """(bytes read, bytes written) by this process so far, all threads together, including page-cache hits.
+
+    For whole-flow totals such as the benchmark's. Reads /proc/self/io;
+    returns zeros where it isn't available.
+    """
+    try:
+        with open("/proc/self/io") as f:
+            fields = dict(line.split(": ") for line in f.read().splitlines())
+        return int(fields["rchar"]), int(fields["wchar"])
+    except (OSError, KeyError, ValueError):
+        return 0, 0
+
+
+def thread_io_counters():
+    """(bytes read, bytes written) by the calling thread so far, or None where the
+    kernel doesn't count per thread (/proc/thread-self/io, Linux only)"""
+    try:
+        with open("/proc/thread-self/io") as f:
+            fields = dict(line.split(": ") for line in f.read().splitlines())
+        return int(fields["rchar"]), int(fields["wchar"])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def _quantile(values, q):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(int(round(q * (len(ordered) - 1))), len(ordered) - 1)]
+
+
+class Metrics:
+    """Thread-safe per-operation call metrics.
+
+    Each call records its wall time plus any numeric fields the caller knows
+    (request/response bytes, tokens, retries, storage I/O); numeric fields are
+    summed per operation. Cache lookups are counted separately so hot paths
+    don't write a log line per lookup.
+    """
+
+    def __init__(self, log_path=METRICS_LOG, prom_path=METRICS_PROM):
+        self.log_path = log_path
+        self.prom_path = prom_path
+        self._ops = {}
+        self._recent = deque(maxlen=RECENT_CALLS)
+        self._lock = threading.Lock()
+        self._log_lock = threading.Lock()
+        self._last_prom_write = 0.0
+
+    def _op(self, op):
+        stats = self._ops.get(op)
+        if stats is None:
+            stats = self._ops[op] = {"calls": 0, "errors": 0, "seconds": 0.0, "cache_hits": 0,
+                                     "cache_misses": 0, "totals": {}, "latencies": deque(maxlen=LATENCY_SAMPLES)}
+        return stats
+
+    def record(self, op, seconds, error=None, cache_hit=None, **fields):
+        """Record one completed call"""
+        record = {"ts": round(time.time(), 3), "op": op, "ms": round(seconds * 1000, 3)}
+        if error:
+            record["error"] = error
+        if cache_hit is not None:
+            record["cache_hit"] = cache_hit
+        record.update((k, v) for k, v in fields.items() if v is not None)
+
+        with self._lock:
+            stats = self._op(op)
+            stats["calls"] += 1
+            stats["seconds"] += seconds
+            stats["latencies"].append(seconds)
+            if error:
+                stats["errors"] += 1
+            if cache_hit is not None:
+                stats["cache_hits" if cache_hit else "cache_misses"] += 1
+            for key, value in fields.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    stats["totals"][key] = stats["totals"].get(key, 0) + value
+            self._recent.append(record)
+
+        self._append_log(record)
+        self.maybe_write_prometheus()
+
+    def cache_lookup(self, op, hit):
+        """Count a cache hit or miss without logging a call"""
+        with self._lock:
+            self._op(op)["cache_hits" if hit else "cache_misses"] += 1
+
+    @contextmanager
+    def timed(self, op, **fields):
+        """Time the block as one call of op.
+
+        Yields a dict the block can fill with fields known only at the end
+        (bytes, tokens, retries, cache_hit). Exceptions are recorded and re-raised.
+        """
+        sample = dict(fields)
+        start = time.perf_counter()
+        try:
+            yield sample
+        except GeneratorExit:
+            # A consumer stopped reading a wrapped stream early; not a failure
+            raise
+        except BaseException as e:
+            sample.setdefault("error", type(e).__name__)
+            raise
+        finally:
+            self.record(op, time.perf_counter() - start, **sample)
+
+    def _append_log(self, record):
+        if not self.log_path:
+            return
+        line = json.dumps(record) + "\n"
+        with self._log_lock:
+            try:
+                os.makedirs(os.path.dirname(self.log_path) or ".", exist_ok=True)
+                if os.path.exists(self.log_path) and os.path.getsize(self.log_path) > MAX_LOG_BYTES:
+                    os.replace(self.log_path, self.log_path + ".1")
+                with open(self.log_path, "a") as f:
+                    f.write(line)
+            except OSError as e:
+                print(f"Error writing metrics log: {e}")
+
+    def summary(self):
+        """One row per operation: calls, errors, latency quantiles, cache hit rate and field totals"""
+        rows = []
+        with self._lock:
+            for op, stats in sorted(self._ops.items()):
+                latencies = list(stats["latencies"])
+                lookups = stats["cache_hits"] + stats["cache_misses"]
+                row = {
+                    "op": op,
+                    "calls": stats["calls"],
+                    "errors": stats["errors"],
+                    "p50_ms": round(_quantile(latencies, 0.5) * 1000, 1),
+                    "p95_ms": round(_quantile(latencies, 0.95) * 1000, 1),
+                    "total_s": round(stats["seconds"], 3),
+                    "cache_hit_rate": round(stats["cache_hits"] / lookups, 3) if lookups else None,
+                }
+                row.update(stats["totals"])
+                rows.append(row)
+        return rows
+
+    def recent(self, n=20):
+        """The most recent call records, newest first"""
+        with self._lock:
+            return list(self._recent)[::-1][:n]
+
+    def prometheus_text(self):
+        """Aggregates in the Prometheus text exposition format"""
+        lines = []
+
+        def family(name, kind, help_text, samples):
+            # samples are (suffix, labels, value); summaries need _sum/_count suffixes
+            if not samples:
+                return
+            lines.append(f"# HELP stylist_{name} {help_text}")
+            lines.append(f"# TYPE stylist_{name} {kind}")
+            for suffix, labels, value in samples:
+                label_text = ",".join(f'{k}="{v}"' for k, v in labels.items())
+                lines.append(f"stylist_{name}{suffix}{{{label_text}}} {value}")
+
+        with self._lock:
+            ops = sorted((op, dict(stats, latencies=list(stats["latencies"]), totals=dict(stats["totals"])))
+                         for op, stats in self._ops.items())
+
+        family("calls_total", "counter", "Calls per operation.",
+               [("", {"op": op}, s["calls"]) for op, s in ops if s["calls"]])
+        family("errors_total", "counter", "Failed calls per operation.",
+               [("", {"op": op}, s["errors"]) for op, s in ops if s["calls"]])
+        latency = []
+        for op, s in ops:
+            if s["calls"]:
+                latency += [("", {"op": op, "quantile": q}, round(_quantile(s["latencies"], q), 6))
+                            for q in (0.5, 0.95)]
+                latency += [("_sum", {"op": op}, round(s["seconds"], 6)), ("_count", {"op": op}, s["calls"])]
+        family("call_seconds", "summary", "Wall time per call.", latency)
+        family("cache_lookups_total", "counter", "Cache lookups per operation and result.",
+               [("", {"op": op, "result": result}, s[key]) for op, s in ops
+                for result, key in (("hit", "cache_hits"), ("miss", "cache_misses"))
+                if s["cache_hits"] or s["cache_misses"]])
+        for field in sorted({field for _, s in ops for field in s["totals"]}):
+            family(f"{field}_total", "counter", f"Sum of {field} per operation.",
+                   [("", {"op": op}, s["totals"][field]) for op, s in ops if field in s["totals"]])
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self):
+        """Atomically rewrite the .prom file"""
+        if not self.prom_path:
+            return
+        self._last_prom_write = time.monotonic()
+        tmp_path = f"{self.prom_path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.prom_path) or ".", exist_ok=True)
+            with open(tmp_path, "w") as f:
+                f.write(self.prometheus_text())
+            os.replace(tmp_path, self.prom_path)
+        except OSError as e:
+            print(f"Error writing metrics file: {e}")
+
+    def maybe_write_prometheus(self):
+        if time.monotonic() - self._last_prom_write >= PROM_WRITE_INTERVAL:
+            self.write_prometheus()
+
+    def reset(self):
+        with self._lock:
+            self._ops.clear()
+            self._recent.clear()
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics():
+    """Return the process-wide metrics registry"""
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = Metrics()
+        return _metrics
+
+
+def instrument(op):
+    """Decorator recording each call of a storage function with the bytes it read and wrote.
+
+    The bytes are the calling thread's own, so I/O by import workers and job
+    threads running at the same time isn't counted against the call; where
+    per-thread counters aren't available the fields are left out.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            before = thread_io_counters()
+            with get_metrics().timed(op) as sample:
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    after = thread_io_counters()
+                    if before is not None and after is not None:
+                        sample["read_bytes"] = after[0] - before[0]
+                        sample["write_bytes"] = after[1] - before[1]
+        return wrapper
+    return decorator
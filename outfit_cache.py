@@ -0,0 +1,96 @@
+import json
+import threading
+import cache
+import metrics
+import prompt_builder
+
+# Generated outfits are reused for a week, or until an item they use is removed
+OUTFIT_CACHE_TTL = 7 * 24 * 3600
+OUTFIT_CACHE_SIZE = 200
+
+
+def _normalise(text):
+    return " ".join(str(text or "").lower().split())
+
+
+def outfit_key(profile, location_info=None, time_of_day=None, location_analysis=None,
+               wardrobe_version=0, settings=None, user=None):
+    """Hash the normalised generation inputs together with the user and their wardrobe version"""
+    location_info = location_info or {}
+    inputs = {
+        "user": user,
+        "profile": prompt_builder.compact_profile(profile),
+        "destination": _normalise(location_info.get("destination")),
+        "activity": _normalise(location_info.get("activity")),
+        "time_of_day": _normalise(time_of_day),
+        "location_analysis": prompt_builder.compact_profile(location_analysis) if location_analysis else "",
+        "wardrobe_version": wardrobe_version,
+        "settings": settings or {},
+    }
+    return cache.hash_key(json.dumps(inputs, sort_keys=True))
+
+
+class OutfitCache:
+    """Persistent cache of generated outfit options.
+
+    Entries record the item ids their outfits use, and a reverse index from
+    item id to cache keys lets a removal drop exactly the affected entries.
+    """
+
+    def __init__(self, disk_cache):
+        self.disk_cache = disk_cache
+        self._refs = None   # item id -> set of cache keys, built on first removal
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _item_ids(outfits):
+        return sorted({str(item.get("item_id")) for outfit in outfits for item in outfit.get("items", [])})
+
+    def get(self, key):
+        outfits = self.disk_cache.get(key)
+        metrics.get_metrics().cache_lookup("outfit_cache", outfits is not None)
+        return outfits
+
+    def set(self, key, outfits):
+        item_ids = self._item_ids(outfits)
+        self.disk_cache.set(key, outfits, item_ids=item_ids)
+        with self._lock:
+            if self._refs is not None:
+                for item_id in item_ids:
+                    self._refs.setdefault(item_id, set()).add(key)
+
+    def _load_refs(self):
+        refs = {}
+        for key in self.disk_cache.keys():
+            meta = self.disk_cache.get_meta(key) or {}
+            for item_id in meta.get("item_ids", []):
+                refs.setdefault(item_id, set()).add(key)
+        return refs
+
+    def invalidate_item(self, item_id):
+        """Drop every cached result that uses this item; returns how many were dropped"""
+        with self._lock:
+            if self._refs is None:
+                self._refs = self._load_refs()
+            keys = self._refs.pop(str(item_id), set())
+        for key in keys:
+            self.disk_cache.delete(key)
+        return len(keys)
+
+    def stats(self):
+        return self.disk_cache.stats()
+
+
+_outfit_cache = None
+_outfit_cache_lock = threading.Lock()
+
+
+def get_outfit_cache():
+    """Return the process-wide outfit cache"""
+    global _outfit_cache
+    with _outfit_cache_lock:
+        if _outfit_cache is None:
+            _outfit_cache = OutfitCache(
+                cache.get_cache("outfits", max_entries=OUTFIT_CACHE_SIZE, ttl=OUTFIT_CACHE_TTL)
+            )
+        return _outfit_cache
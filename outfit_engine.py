@@ -0,0 +1,329 @@
+import re
+import numpy as np
+import prompt_builder
+
+# Items kept per category after individual scoring; combinations are only built from these
+DEFAULT_BEAM = 15
+DEFAULT_TOP_N = 3
+
+# Relative weight of each signal in an outfit's score
+WEIGHTS = {
+    "color": 0.35,
+    "occasion": 0.25,
+    "context": 0.15,
+    "harmony": 0.25,
+}
+
+# Outfit shapes: required categories, in display order
+TEMPLATES = [
+    ("tops", "bottoms", "shoes"),
+    ("dresses", "shoes"),
+]
+
+# Color words mapped to a family used for matching and harmony
+COLOR_FAMILIES = {
+    "red": "red", "burgundy": "red", "maroon": "red", "wine": "red", "crimson": "red", "scarlet": "red",
+    "orange": "orange", "rust": "orange", "peach": "orange", "coral": "orange", "terracotta": "orange",
+    "yellow": "yellow", "mustard": "yellow", "gold": "yellow", "lemon": "yellow",
+    "green": "green", "olive": "green", "emerald": "green", "mint": "green", "sage": "green",
+    "khaki": "green", "teal": "green",
+    "blue": "blue", "navy": "blue", "cobalt": "blue", "turquoise": "blue", "denim": "blue", "sky": "blue",
+    "indigo": "blue",
+    "purple": "purple", "lavender": "purple", "violet": "purple", "plum": "purple", "lilac": "purple",
+    "mauve": "purple",
+    "pink": "pink", "magenta": "pink", "fuchsia": "pink", "blush": "pink", "rose": "pink",
+    "brown": "brown", "tan": "brown", "camel": "brown", "beige": "brown", "chocolate": "brown",
+    "taupe": "brown", "nude": "brown",
+    "black": "black",
+    "white": "white", "cream": "white", "ivory": "white", "off-white": "white",
+    "gray": "gray", "grey": "gray", "charcoal": "gray", "silver": "gray",
+}
+FAMILIES = ["red", "orange", "yellow", "green", "blue", "purple", "pink", "brown", "black", "white", "gray"]
+UNKNOWN = len(FAMILIES)
+
+# Families that pair with anything
+NEUTRAL_FAMILIES = {"brown", "black", "white", "gray"}
+NEUTRAL_WORDS = {"navy", "denim", "beige", "cream", "ivory", "tan", "camel", "khaki", "charcoal", "nude", "taupe"}
+
+ANALOGOUS = [("red", "orange"), ("orange", "yellow"), ("yellow", "green"), ("green", "blue"),
+             ("blue", "purple"), ("purple", "pink"), ("pink", "red")]
+COMPLEMENTARY = [("red", "green"), ("blue", "orange"), ("purple", "yellow")]
+
+# Occasion words implied by the time of day
+TIME_OCCASIONS = {
+    "morning": {"casual", "work", "office", "brunch", "daytime"},
+    "afternoon": {"casual", "work", "office", "daytime", "outdoor"},
+    "evening": {"evening", "dinner", "date", "party", "formal", "smart"},
+    "night": {"evening", "night", "party", "formal", "date", "club"},
+}
+
+STOPWORDS = {"a", "an", "the", "and", "or", "of", "in", "on", "for", "to", "with", "at", "by",
+             "is", "are", "be", "this", "that", "it", "as", "from", "wear", "clothes", "clothing",
+             "style", "styles", "item", "items", "very", "too", "overly"}
+
+TOKEN_RE = re.compile(r"[a-z][a-z\-]+")
+
+
+def tokens(text):
+    """Lower-case word tokens without stopwords"""
+    if isinstance(text, (list, tuple)):
+        text = " ".join(str(t) for t in text)
+    return {t for t in TOKEN_RE.findall(str(text or "").lower()) if t not in STOPWORDS}
+
+
+def _occasion_list(occasions):
+    """An item's occasions as a list; older model replies give a single string"""
+    if isinstance(occasions, str):
+        return [occasions] if occasions else []
+    return [str(o) for o in occasions or []]
+
+
+def _harmony_matrix():
+    """Pairwise color-family compatibility, with an extra row/column for unknown colors"""
+    size = len(FAMILIES) + 1
+    matrix = np.full((size, size), 0.3, dtype=np.float32)
+    index = {family: i for i, family in enumerate(FAMILIES)}
+    for a, b in ANALOGOUS:
+        matrix[index[a], index[b]] = matrix[index[b], index[a]] = 0.7
+    for a, b in COMPLEMENTARY:
+        matrix[index[a], index[b]] = matrix[index[b], index[a]] = 0.6
+    np.fill_diagonal(matrix, 0.8)
+    for family in NEUTRAL_FAMILIES:
+        matrix[index[family], :] = matrix[:, index[family]] = 1.0
+    matrix[UNKNOWN, :] = matrix[:, UNKNOWN] = 0.5
+    return matrix
+
+
+HARMONY = _harmony_matrix()
+
+
+def color_family(color_text):
+    """Index of the first recognised color family in a color description"""
+    for word in TOKEN_RE.findall(str(color_text or "").lower()):
+        if word in COLOR_FAMILIES:
+            return FAMILIES.index(COLOR_FAMILIES[word])
+    return UNKNOWN
+
+
+def is_neutral(color_text):
+    words = set(TOKEN_RE.findall(str(color_text or "").lower()))
+    return bool(words & NEUTRAL_WORDS) or any(COLOR_FAMILIES.get(w) in NEUTRAL_FAMILIES for w in words)
+
+
+def item_color_text(item):
+    """An item's color description followed by its dominant named color, when one was extracted locally"""
+    colors = item.get("colors") or []
+    return f"{item.get('color', '')} {colors[0] if colors else ''}".strip()
+
+
+def parse_profile(profile):
+    """Pull recommended_colors and avoid_styles out of a profile, if it is JSON"""
+    data = prompt_builder.parse_json_text(profile)
+    if not isinstance(data, dict):
+        return [], []
+    return list(data.get("recommended_colors") or []), list(data.get("avoid_styles") or [])
+
+
+def context_tokens(location_info=None, time_of_day=None, location_analysis=None):
+    """Occasion words and general context words for the requested outing"""
+    location_info = location_info or {}
+    context = tokens(location_info.get("destination", "")) | tokens(location_info.get("activity", ""))
+    analysis = prompt_builder.parse_json_text(location_analysis) if location_analysis else None
+    if isinstance(analysis, dict):
+        for key in ("location_type", "environment", "dress_code_suggestion", "recommended_style_elements"):
+            context |= tokens(analysis.get(key, ""))
+    elif location_analysis:
+        context |= tokens(location_analysis)
+    occasions = set(context)
+    if time_of_day:
+        occasions |= TIME_OCCASIONS.get(str(time_of_day).lower(), set())
+    return occasions, context
+
+
+class ItemFeatures:
+    """Per-item feature arrays for one category, built once and scored in batch"""
+
+    def __init__(self, items):
+        self.items = items
+        colors = [item_color_text(item) for item in items]
+        self.families = np.array([color_family(color) for color in colors], dtype=np.intp)
+        self.neutral = np.array([is_neutral(color) for color in colors], dtype=bool)
+        self.color_tokens = [tokens(color) for color in colors]
+        self.occasion_tokens = [tokens(item.get("occasions", [])) for item in items]
+        self.text_tokens = [tokens(" ".join(str(item.get(f, "")) for f in ("type", "style", "pattern")))
+                            for item in items]
+
+
+def _overlap_matrix(token_sets, vocabulary):
+    """Binary item x vocabulary matrix"""
+    index = {word: i for i, word in enumerate(vocabulary)}
+    matrix = np.zeros((len(token_sets), max(len(vocabulary), 1)), dtype=np.float32)
+    for row, token_set in enumerate(token_sets):
+        for word in token_set:
+            col = index.get(word)
+            if col is not None:
+                matrix[row, col] = 1.0
+    return matrix
+
+
+def score_items(features, recommended_colors, avoid_styles, occasions, context):
+    """Score every item of a category at once; excluded items get -inf"""
+    n = len(features.items)
+    if not n:
+        return np.zeros(0, dtype=np.float32)
+
+    # Color: recommended family or word > neutral > anything else
+    if recommended_colors:
+        recommended_families = {color_family(c) for c in recommended_colors} - {UNKNOWN}
+        recommended_words = set().union(*(tokens(c) for c in recommended_colors))
+        family_match = np.isin(features.families, list(recommended_families))
+        word_match = _overlap_matrix(features.color_tokens, sorted(recommended_words)).any(axis=1)
+        color = np.where(family_match | word_match, 1.0, np.where(features.neutral, 0.6, 0.0))
+    else:
+        color = np.full(n, 0.5)
+
+    # Avoided styles exclude an item when at least half of the phrase's words match it
+    excluded = np.zeros(n, dtype=bool)
+    item_words = [features.text_tokens[i] | features.color_tokens[i] for i in range(n)]
+    for phrase in avoid_styles:
+        phrase_words = sorted(tokens(phrase))
+        if not phrase_words:
+            continue
+        hits = _overlap_matrix(item_words, phrase_words).sum(axis=1)
+        excluded |= hits >= max(1, (len(phrase_words) + 1) // 2)
+
+    # Occasion overlap with what the outing calls for
+    if occasions:
+        occasion_hits = _overlap_matrix(features.occasion_tokens, sorted(occasions)).sum(axis=1)
+        occasion = np.minimum(occasion_hits / 2.0, 1.0)
+    else:
+        occasion = np.full(n, 0.5)
+
+    # Similarity between the item's description and the context words
+    if context:
+        all_words = [features.text_tokens[i] | features.occasion_tokens[i] for i in range(n)]
+        context_hits = _overlap_matrix(all_words, sorted(context)).sum(axis=1)
+        sizes = np.array([max(len(w), 1) for w in all_words], dtype=np.float32)
+        similarity = np.minimum(context_hits / np.sqrt(sizes), 1.0)
+    else:
+        similarity = np.zeros(n)
+
+    scores = (WEIGHTS["color"] * color + WEIGHTS["occasion"] * occasion + WEIGHTS["context"] * similarity)
+    return np.where(excluded, -np.inf, scores).astype(np.float32)
+
+
+def _beam(scores, size):
+    """Indices of the best `size` non-excluded items"""
+    valid = np.flatnonzero(np.isfinite(scores))
+    if len(valid) > size:
+        valid = valid[np.argpartition(-scores[valid], size - 1)[:size]]
+    return valid[np.argsort(-scores[valid])]
+
+
+def _score_template(categories, features, item_scores, beam):
+    """Score every combination of one template; returns (combo index arrays, scores)"""
+    picks = [_beam(item_scores[c], beam) for c in categories]
+    if any(len(p) == 0 for p in picks):
+        return None, None
+
+    k = len(categories)
+    grids = np.meshgrid(*[np.arange(len(p)) for p in picks], indexing="ij")
+    total = np.zeros(grids[0].shape, dtype=np.float32)
+    for c, p, g in zip(categories, picks, grids):
+        total += item_scores[c][p][g]
+    total /= k
+
+    # Mean pairwise color harmony, gathered from the harmony matrix by broadcasting
+    harmony = np.zeros_like(total)
+    pairs = 0
+    for a in range(k):
+        for b in range(a + 1, k):
+            fam_a = features[categories[a]].families[picks[a]][grids[a]]
+            fam_b = features[categories[b]].families[picks[b]][grids[b]]
+            harmony += HARMONY[fam_a, fam_b]
+            pairs += 1
+    total += WEIGHTS["harmony"] * harmony / max(pairs, 1)
+
+    combos = np.stack([p[g].ravel() for p, g in zip(picks, grids)], axis=1)
+    return combos, total.ravel()
+
+
+def _describe(categories, items):
+    main = items[0]
+    name = f"{main.get('color', '').title()} {main.get('type', '')}".strip()
+    rest = ", ".join(f"{item.get('color', '')} {item.get('type', '')}".strip() for item in items[1:])
+    return name or "Outfit", f"{name} with {rest}" if rest else name
+
+
+def generate_outfits(profile, wardrobe_items, location_info=None, time_of_day=None, location_analysis=None,
+                     top_n=DEFAULT_TOP_N, beam=DEFAULT_BEAM):
+    """Build and rank outfits locally, without a model call.
+
+    Returns a list in the same shape as the model's outfit_options, with an
+    added "score" field. Outfits are picked greedily so that they share as
+    few items as possible.
+    """
+    recommended_colors, avoid_styles = parse_profile(profile)
+    occasions, context = context_tokens(location_info, time_of_day, location_analysis)
+
+    features = {c: ItemFeatures(items) for c, items in wardrobe_items.items()}
+    item_scores = {c: score_items(f, recommended_colors, avoid_styles, occasions, context)
+                   for c, f in features.items()}
+
+    candidates = []
+    for categories in TEMPLATES:
+        if not all(features.get(c) and features[c].items for c in categories):
+            continue
+        combos, scores = _score_template(categories, features, item_scores, beam)
+        if combos is None:
+            continue
+        # Only the best few hundred per template can make the final cut
+        keep = np.argsort(-scores)[: max(top_n * 50, 50)]
+        candidates.extend((float(scores[i]), categories, combos[i]) for i in keep)
+    candidates.sort(key=lambda c: -c[0])
+
+    # Prefer outfits that share no items; allow one shared item if that leaves too few
+    chosen = []
+    used = []
+    for max_shared in (0, 1):
+        for candidate in candidates:
+            if len(chosen) == top_n:
+                break
+            score, categories, combo = candidate
+            ids = {features[c].items[i]["id"] for c, i in zip(categories, combo)}
+            if ids in used or any(len(ids & other) > max_shared for other in used):
+                continue
+            chosen.append(candidate)
+            used.append(ids)
+    chosen.sort(key=lambda c: -c[0])
+
+    # Attach the accessory that best suits each outfit's main piece
+    accessory_features = features.get("accessories")
+    accessory_scores = item_scores.get("accessories")
+    outfits = []
+    for option_id, (score, categories, combo) in enumerate(chosen, start=1):
+        items = [features[c].items[i] for c, i in zip(categories, combo)]
+        types = [c.rstrip("s") if c != "dresses" else "dress" for c in categories]
+        if accessory_features is not None and accessory_features.items:
+            main_family = features[categories[0]].families[combo[0]]
+            fit = accessory_scores + WEIGHTS["harmony"] * HARMONY[main_family, accessory_features.families]
+            if np.isfinite(fit).any():
+                best = int(np.argmax(fit))
+                items.append(accessory_features.items[best])
+                types.append("accessory")
+
+        name, description = _describe(categories, items)
+        item_occasions = sorted(set().union(*(tokens(item.get("occasions", [])) for item in items)) & occasions) \
+            or sorted(set(_occasion_list(items[0].get("occasions", []))))
+        outfits.append({
+            "option_id": option_id,
+            "name": name,
+            "description": description,
+            "items": [{"type": t, "item_id": item["id"]} for t, item in zip(types, items)],
+            "occasions": item_occasions,
+            "weather": "",
+            "time_of_day": time_of_day or "Any time",
+            "location_appropriateness": "",
+            "score": round(score, 3),
+        })
+    return outfits
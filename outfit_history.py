@@ -0,0 +1,170 @@
+import os
+import json
+import struct
+import hashlib
+import threading
+import locking
+
+HISTORY_FILE = "data/outfit_history.jsonl"
+HISTORY_INDEX = "data/outfit_history.idx"
+
+# Each index record is the byte offset of one line, as an unsigned 64-bit integer
+OFFSET = struct.Struct("<Q")
+
+
+def outfit_fingerprint(outfit):
+    """Identify an outfit by the set of wardrobe items it uses"""
+    item_ids = sorted(str(item.get("item_id", "")) for item in outfit.get("items", []))
+    if not any(item_ids):
+        # No usable item ids; fall back to the outfit's name and description
+        item_ids = [outfit.get("name", ""), outfit.get("description", "")]
+    return hashlib.sha1("\x00".join(item_ids).encode("utf-8")).hexdigest()
+
+
+class OutfitHistory:
+    """Append-only JSON lines log of saved outfits with a fixed-width offset index.
+
+    Saving an outfit appends one line and one 8-byte offset, so it costs the
+    same no matter how long the history is. Pages are read by seeking straight
+    to their offsets instead of loading the whole file.
+    """
+
+    def __init__(self, path=HISTORY_FILE, index_path=HISTORY_INDEX):
+        self.path = path
+        self.index_path = index_path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if not self._index_is_valid():
+            self._rebuild_index()
+
+    def _index_is_valid(self):
+        if not os.path.exists(self.path):
+            return not os.path.exists(self.index_path) or os.path.getsize(self.index_path) == 0
+        if not os.path.exists(self.index_path):
+            return False
+        size = os.path.getsize(self.index_path)
+        if size % OFFSET.size:
+            return False
+        if size == 0:
+            return os.path.getsize(self.path) == 0
+        # The last offset must point inside the log
+        with open(self.index_path, "rb") as f:
+            f.seek(size - OFFSET.size)
+            (last,) = OFFSET.unpack(f.read(OFFSET.size))
+        return last < os.path.getsize(self.path)
+
+    def _rebuild_index(self):
+        """Recreate the offset index by scanning the log once"""
+        offsets = []
+        if os.path.exists(self.path):
+            with open(self.path, "rb") as f:
+                offset = 0
+                for line in f:
+                    if line.strip():
+                        offsets.append(offset)
+                    offset += len(line)
+        with open(self.index_path, "wb") as f:
+            for offset in offsets:
+                f.write(OFFSET.pack(offset))
+
+    def __len__(self):
+        if not os.path.exists(self.index_path):
+            return 0
+        return os.path.getsize(self.index_path) // OFFSET.size
+
+    def append(self, outfit):
+        """Append one outfit to the history"""
+        line = (json.dumps(outfit) + "\n").encode("utf-8")
+        # The file lock keeps log and index appends paired when several processes share the history
+        with self._lock, locking.file_lock(self.path):
+            with open(self.path, "ab") as f:
+                offset = f.tell()
+                f.write(line)
+            with open(self.index_path, "ab") as f:
+                f.write(OFFSET.pack(offset))
+
+    def _read_at(self, log, offset):
+        log.seek(offset)
+        return json.loads(log.readline())
+
+    def page(self, page, page_size=10, newest_first=True):
+        """Return the outfits on one page, reading only those lines"""
+        total = len(self)
+        if newest_first:
+            # Page 0 holds the most recent saves
+            end = total - page * page_size
+            start = max(end - page_size, 0)
+        else:
+            start = page * page_size
+            end = min(start + page_size, total)
+        if start >= end or end <= 0:
+            return []
+
+        with open(self.index_path, "rb") as f:
+            f.seek(start * OFFSET.size)
+            raw = f.read((end - start) * OFFSET.size)
+        offsets = [o for (o,) in OFFSET.iter_unpack(raw)]
+        if newest_first:
+            offsets.reverse()
+
+        outfits = []
+        with open(self.path, "rb") as log:
+            for offset in offsets:
+                try:
+                    outfits.append(self._read_at(log, offset))
+                except json.JSONDecodeError:
+                    continue
+        return outfits
+
+    def __iter__(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r") as f:
+            for line in f:
+                if line.strip():
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+
+    def compact(self):
+        """Rewrite the history keeping only the first save of each outfit.
+
+        Returns the number of duplicates removed.
+        """
+        with self._lock, locking.file_lock(self.path):
+            seen = set()
+            kept = []
+            total = 0
+            for outfit in self:
+                total += 1
+                fingerprint = outfit_fingerprint(outfit)
+                if fingerprint in seen:
+                    continue
+                seen.add(fingerprint)
+                kept.append(outfit)
+
+            tmp_path = self.path + ".tmp"
+            tmp_index = self.index_path + ".tmp"
+            with open(tmp_path, "wb") as log, open(tmp_index, "wb") as index:
+                for outfit in kept:
+                    index.write(OFFSET.pack(log.tell()))
+                    log.write((json.dumps(outfit) + "\n").encode("utf-8"))
+            os.replace(tmp_path, self.path)
+            os.replace(tmp_index, self.index_path)
+            return total - len(kept)
+
+    def migrate_from_json(self, json_path):
+        """One-time import of the legacy saved_outfits.json, renamed afterwards"""
+        if not os.path.exists(json_path):
+            return 0
+        try:
+            with open(json_path, "r") as f:
+                outfits = json.load(f).get("outfits", [])
+        except Exception as e:
+            print(f"Error migrating outfits: {e}")
+            return 0
+        for outfit in outfits:
+            self.append(outfit)
+        os.replace(json_path, json_path + ".migrated")
+        return len(outfits)
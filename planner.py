@@ -0,0 +1,354 @@
+import os
+import io
+import sys
+import json
+import time
+import argparse
+from datetime import date, datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from PIL import Image
+import bulk_import
+import outfit_cache
+import outfit_engine
+import prompt_builder
+import retrieval
+import stylist
+import utils
+
+# Headless batch planning: generate outfits for a schedule of events, for one or
+# many users, without the Streamlit UI.
+#
+#   python run.py plan week.json --user alice --no-repeat tops=3 --output alice-week.json
+#   python run.py plan week.json --all-users --engine local --output-dir plans/
+
+ENGINES = ("gemini", "local")
+DEFAULT_CONCURRENCY = 4
+DEFAULT_OPTIONS = 3        # options generated per event for the constraint pass to choose from
+DEFAULT_REPAIR_ROUNDS = 2  # regenerations, without the conflicting items, for events with no valid option
+
+
+def load_schedule(path):
+    """Read a schedule file: a JSON list of events, or {"events": [...]}.
+
+    Each event has a date (YYYY-MM-DD) and optionally destination, activity,
+    time_of_day and location_image (a path, relative to the schedule file).
+    """
+    with open(path, "r") as f:
+        data = json.load(f)
+    raw_events = data.get("events", []) if isinstance(data, dict) else data
+    base = os.path.dirname(os.path.abspath(path))
+    events = []
+    for n, raw in enumerate(raw_events, start=1):
+        event = dict(raw)
+        event.setdefault("id", n)
+        try:
+            date.fromisoformat(str(event.get("date")))
+        except ValueError:
+            raise ValueError(f"Event {event['id']}: date must be YYYY-MM-DD, got {event.get('date')!r}")
+        if event.get("location_image"):
+            event["location_image"] = os.path.join(base, event["location_image"])
+        events.append(event)
+    return events
+
+
+def parse_constraints(specs):
+    """Turn ["tops=3", "shoes=2"] into {"tops": 3, "shoes": 2}"""
+    constraints = {}
+    for spec in specs or []:
+        category, _, days = spec.partition("=")
+        if category not in utils.CATEGORIES or not days.isdigit() or int(days) < 1:
+            raise ValueError(f"Constraint must look like <category>=<days>, e.g. tops=3; got {spec!r}")
+        constraints[category] = int(days)
+    return constraints
+
+
+class PlanContext:
+    """One user's data, loaded once and shared by all of their events"""
+
+    def __init__(self, user):
+        self.user = user
+        self.wardrobe = utils.load_wardrobe(user)
+        self.items = utils.ItemIndex(self.wardrobe)
+        self.profile = utils.load_profile(user)
+        self.index = retrieval.WardrobeIndex(stylist.try_embed_text, store=utils.get_embedding_store(user))
+        self.version = utils.wardrobe_version(user)
+
+    def warm(self):
+        """Embed every item up front, so concurrent events don't all embed the same items"""
+        self.index.shortlist(self.wardrobe, retrieval.build_query_text(self.profile))
+
+    def without(self, item_ids):
+        if not item_ids:
+            return self.wardrobe
+        return {category: [item for item in items if item["id"] not in item_ids]
+                for category, items in self.wardrobe.items()}
+
+
+def event_options(ctx, event, engine, limiter, max_retries, options=DEFAULT_OPTIONS, exclude=frozenset(),
+                  analyze_images=True):
+    """Generate ranked outfit options for one event, leaving out the excluded item ids"""
+    location_info = {"destination": event.get("destination", ""), "activity": event.get("activity", "")}
+    time_of_day = event.get("time_of_day")
+    location_analysis = None
+    if event.get("location_image") and analyze_images:
+        with open(event["location_image"], "rb") as f:
+            data = f.read()
+        image = Image.open(io.BytesIO(data))
+        location_analysis = bulk_import.call_with_retries(lambda: stylist.analyze_location(image, data), max_retries,
+                                                          wait=limiter.wait)
+
+    wardrobe = ctx.without(exclude)
+    if engine == "local":
+        return outfit_engine.generate_outfits(ctx.profile, wardrobe, location_info, time_of_day,
+                                              location_analysis, top_n=options)
+
+    # Same key as the app's, so plans and interactive sessions share generated results
+    settings = {"model": stylist.MODEL_NAME, "top_k": retrieval.DEFAULT_TOP_K,
+                "token_budget": prompt_builder.DEFAULT_TOKEN_BUDGET}
+    if exclude:
+        settings["exclude"] = sorted(exclude)
+    results_cache = outfit_cache.get_outfit_cache()
+    cache_key = outfit_cache.outfit_key(ctx.profile, location_info, time_of_day, location_analysis,
+                                        wardrobe_version=ctx.version, settings=settings, user=ctx.user)
+    outfits = results_cache.get(cache_key)
+    if outfits:
+        return outfits
+
+    query_text = retrieval.build_query_text(ctx.profile, location_info, time_of_day, location_analysis)
+    candidates = ctx.index.shortlist(wardrobe, query_text)
+    prompt, info = stylist.build_outfit_prompt(ctx.profile, candidates, location_info, time_of_day, location_analysis)
+    response = bulk_import.call_with_retries(lambda: stylist.generate_outfits(prompt, info["id_map"]), max_retries,
+                                             wait=limiter.wait)
+    outfits = json.loads(response)["outfit_options"]
+    if outfits:
+        results_cache.set(cache_key, outfits)
+    return outfits
+
+
+def _event_day(event):
+    return date.fromisoformat(str(event["date"]))
+
+
+def conflicts(outfit, day, worn, items, constraints):
+    """Constrained items of an outfit that were worn too recently.
+
+    worn is a list of (day, outfit) already in the plan; an item of a constrained
+    category can't be worn again until its number of days has passed.
+    """
+    found = []
+    for outfit_item in outfit.get("items", []):
+        item_id = outfit_item.get("item_id")
+        category = items.category(item_id)
+        if category not in constraints:
+            continue
+        for other_day, other in worn:
+            if abs((day - other_day).days) < constraints[category] and any(
+                    i.get("item_id") == item_id for i in other.get("items", [])):
+                found.append({"item_id": item_id, "category": category, "worn_on": other_day.isoformat()})
+    return found
+
+
+def assign(events, options_by_event, items, constraints):
+    """Pick one option per event in date order, skipping options that break a constraint.
+
+    Returns {event id: (outfit, violations)}; when every option conflicts, the
+    one with the fewest violations is kept and its violations are reported.
+    """
+    chosen = {}
+    worn = []
+    for event in sorted(events, key=lambda e: (_event_day(e), str(e["id"]))):
+        day = _event_day(event)
+        best = None
+        for outfit in options_by_event.get(event["id"]) or []:
+            found = conflicts(outfit, day, worn, items, constraints)
+            if best is None or len(found) < len(best[1]):
+                best = (outfit, found)
+            if not found:
+                break
+        if best is not None:
+            chosen[event["id"]] = best
+            worn.append((day, best[0]))
+    return chosen
+
+
+def blocked_items(event, events, chosen, items, constraints):
+    """Item ids the event must avoid given what the other events currently wear"""
+    day = _event_day(event)
+    blocked = set()
+    for other in events:
+        if other["id"] == event["id"] or other["id"] not in chosen:
+            continue
+        for outfit_item in chosen[other["id"]][0].get("items", []):
+            category = items.category(outfit_item.get("item_id"))
+            if category in constraints and abs((day - _event_day(other)).days) < constraints[category]:
+                blocked.add(outfit_item["item_id"])
+    return frozenset(blocked)
+
+
+def _label(outfit, items):
+    """Copy of an outfit with each item's category and a readable label, for the plan file"""
+    outfit = dict(outfit, items=[dict(i) for i in outfit.get("items", [])])
+    for outfit_item in outfit["items"]:
+        item = items.get(outfit_item.get("item_id"))
+        if item:
+            outfit_item["category"] = items.category(item["id"])
+            outfit_item["label"] = f"{item.get('color', '')} {item.get('type', '')}".strip()
+    return outfit
+
+
+def plan(jobs, engine="gemini", constraints=None, concurrency=DEFAULT_CONCURRENCY,
+         requests_per_minute=bulk_import.DEFAULT_REQUESTS_PER_MINUTE, max_retries=bulk_import.DEFAULT_MAX_RETRIES,
+         options=DEFAULT_OPTIONS, repair_rounds=DEFAULT_REPAIR_ROUNDS, analyze_images=True):
+    """Plan outfits for {user: events}; returns {user: plan dict}.
+
+    Every event of every user runs on one bounded thread pool under one rate
+    limit, with the analysis and outfit caches shared. Options are then
+    assigned per user in date order under the no-repeat constraints, and events
+    left without a valid option are regenerated without the conflicting items.
+    Location images need the model; with analyze_images=False they are ignored.
+    """
+    constraints = constraints or {}
+    started = time.perf_counter()
+    contexts = {user: PlanContext(user) for user in jobs}
+    limiter = bulk_import.RateLimiter(requests_per_minute)
+    options_by_event = {user: {} for user in jobs}
+    errors = {user: {} for user in jobs}
+    chosen = {}
+
+    def run(pool, tasks):
+        futures = {pool.submit(event_options, contexts[user], event, engine, limiter, max_retries, options, exclude,
+                               analyze_images): (user, event) for user, event, exclude in tasks}
+        for future in as_completed(futures):
+            user, event = futures[future]
+            try:
+                # Regenerated options go first; the originals stay as fallbacks
+                new = future.result() or []
+                options_by_event[user][event["id"]] = new + options_by_event[user].get(event["id"], [])
+                errors[user].pop(event["id"], None)
+            except Exception as e:
+                # A failed regeneration keeps the options the event already has
+                if not options_by_event[user].get(event["id"]):
+                    errors[user][event["id"]] = str(e)
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        ready = [user for user, ctx in contexts.items() if ctx.profile and any(ctx.wardrobe.values())]
+        if engine == "gemini":
+            warming = {pool.submit(contexts[user].warm): user for user in ready}
+            for future in as_completed(warming):
+                try:
+                    future.result()
+                except Exception as e:
+                    # Only a head start: the user's events still run, embedding as they go
+                    print(f"Error preparing the wardrobe index of user {warming[future]}: {e}")
+        run(pool, [(user, event, frozenset()) for user in ready for event in jobs[user]])
+
+        for attempt in range(repair_rounds + 1):
+            retry = []
+            for user in ready:
+                ctx = contexts[user]
+                chosen[user] = assign(jobs[user], options_by_event[user], ctx.items, constraints)
+                for event in jobs[user]:
+                    if event["id"] in chosen[user] and chosen[user][event["id"]][1]:
+                        retry.append((user, event, blocked_items(event, jobs[user], chosen[user],
+                                                                 ctx.items, constraints)))
+            if not retry or attempt == repair_rounds:
+                break
+            run(pool, retry)
+
+    plans = {}
+    for user, events in jobs.items():
+        ctx = contexts[user]
+        planned = []
+        for event in events:
+            entry = dict(event)
+            outfit, violations = chosen.get(user, {}).get(event["id"], (None, []))
+            entry["outfit"] = _label(outfit, ctx.items) if outfit else None
+            entry["options"] = len(options_by_event[user].get(event["id"], []))
+            entry["violations"] = violations
+            entry["error"] = errors[user].get(event["id"])
+            if event.get("location_image") and not analyze_images:
+                entry["note"] = "Location image ignored: no Gemini API key"
+            if not ctx.profile:
+                entry["error"] = "No style profile for this user"
+            elif not any(ctx.wardrobe.values()):
+                entry["error"] = "This user's wardrobe is empty"
+            planned.append(entry)
+        plans[user] = {
+            "user": user,
+            "created": datetime.now(timezone.utc).isoformat(),
+            "engine": engine,
+            "constraints": constraints,
+            "events": planned,
+            "summary": {
+                "events": len(planned),
+                "planned": sum(1 for e in planned if e["outfit"]),
+                "with_violations": sum(1 for e in planned if e["violations"]),
+                "failed": sum(1 for e in planned if not e["outfit"]),
+                "seconds": round(time.perf_counter() - started, 3),
+            },
+        }
+    return plans
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="run.py plan", description="Plan outfits for a schedule of events")
+    parser.add_argument("schedule", help="JSON schedule: a list of events with date, destination, activity, "
+                                         "time_of_day and optional location_image")
+    who = parser.add_mutually_exclusive_group()
+    who.add_argument("--user", default=utils.DEFAULT_USER, help="plan for one user (default: %(default)s)")
+    who.add_argument("--users", nargs="+", help="plan the same schedule for several users")
+    who.add_argument("--all-users", action="store_true", help="plan the schedule for every user on disk")
+    parser.add_argument("--engine", choices=ENGINES, default="gemini")
+    parser.add_argument("--no-repeat", action="append", default=[], metavar="CATEGORY=DAYS",
+                        help="don't wear the same item of a category again within DAYS days, e.g. tops=3")
+    parser.add_argument("--options", type=int, default=DEFAULT_OPTIONS,
+                        help="options per event for the local engine to choose from")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--requests-per-minute", type=int, default=bulk_import.DEFAULT_REQUESTS_PER_MINUTE)
+    parser.add_argument("--max-retries", type=int, default=bulk_import.DEFAULT_MAX_RETRIES)
+    parser.add_argument("--output", help="plan file for a single user (default: plan-<user>.json)")
+    parser.add_argument("--output-dir", default=".", help="directory for per-user plan files")
+    args = parser.parse_args(argv)
+
+    try:
+        events = load_schedule(args.schedule)
+        constraints = parse_constraints(args.no_repeat)
+        if args.all_users:
+            users = utils.list_users()
+        else:
+            users = [utils.normalise_user(user) for user in (args.users or [args.user])]
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        return 1
+
+    # The local engine works offline; Gemini is then only used for location images, if a key is set
+    from dotenv import load_dotenv
+    load_dotenv()
+    api_key = os.getenv("GEMINI_API_KEY")
+    has_model = bool(api_key) or os.getenv("STYLIST_BACKEND") == "fake"
+    if args.engine == "gemini" and not has_model:
+        print("Error: set GEMINI_API_KEY or use --engine local")
+        return 1
+    if api_key:
+        stylist.configure(api_key)
+
+    plans = plan({user: events for user in users}, engine=args.engine, constraints=constraints,
+                 concurrency=args.concurrency, requests_per_minute=args.requests_per_minute,
+                 max_retries=args.max_retries, options=args.options, analyze_images=has_model)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    for user, user_plan in plans.items():
+        if args.output and len(plans) == 1:
+            path = args.output
+        else:
+            path = os.path.join(args.output_dir, f"plan-{user}.json")
+        with open(path, "w") as f:
+            json.dump(user_plan, f, indent=2)
+        summary = user_plan["summary"]
+        print(f"{user}: planned {summary['planned']}/{summary['events']} events "
+              f"({summary['with_violations']} with repeats, {summary['failed']} failed) -> {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,131 @@
+import os
+import json
+from collections import Counter
+
+# Upper bound on estimated prompt tokens for outfit generation
+DEFAULT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "6000"))
+
+# Only these item fields are useful to the model; paths and ids are replaced by short ids
+ITEM_FIELDS = ["type", "color", "pattern", "style", "occasions"]
+
+# Short id prefix per category, e.g. the third top is "t3"
+CATEGORY_PREFIXES = {
+    "tops": "t",
+    "bottoms": "b",
+    "dresses": "d",
+    "shoes": "s",
+    "accessories": "a",
+}
+
+
+def estimate_tokens(text):
+    """Rough token count (about 4 characters per token for English and JSON).
+
+    Good enough for budgeting without a round trip to the tokenizer API.
+    """
+    return (len(text) + 3) // 4
+
+
+def _field(value):
+    if isinstance(value, (list, tuple)):
+        value = ",".join(str(v) for v in value)
+    return str(value if value is not None else "").replace("|", "/").replace("\n", " ").strip()
+
+
+def item_row(short_id, item):
+    return "|".join([short_id] + [_field(item.get(field, "")) for field in ITEM_FIELDS])
+
+
+def parse_json_text(text):
+    """Parse JSON text that may be wrapped in markdown fences; returns None if it isn't JSON"""
+    if isinstance(text, (dict, list)):
+        return text
+    text = str(text or "")
+    if "```" in text:
+        text = text.split("```json")[-1] if "```json" in text else text.strip("`")
+        text = text.split("```")[0]
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return None
+
+
+def compact_profile(profile):
+    """Reduce a profile (JSON text, possibly fenced, or free text) to compact key: value lines"""
+    data = parse_json_text(profile)
+    if data is None:
+        return " ".join(str(profile).split())
+    if not isinstance(data, dict):
+        return " ".join(json.dumps(data).split())
+    return "\n".join(f"{key}: {_field(value)}" for key, value in data.items() if value not in ("", [], None))
+
+
+def _category_summary(category, items):
+    colors = Counter(_field(item.get("color", "")).lower() for item in items if item.get("color"))
+    top_colors = ", ".join(color for color, _ in colors.most_common(4))
+    summary = f"(+{len(items)} more {category} not listed"
+    return summary + (f"; colors: {top_colors})" if top_colors else ")")
+
+
+def compact_wardrobe(wardrobe_items, token_budget=None):
+    """Encode a wardrobe as one header and one row per item, within a token budget.
+
+    Items are expected in relevance order within each category (as returned
+    by the retrieval shortlist). When over budget, rows are dropped from the
+    end of the largest category first and replaced with a one-line summary.
+    Returns (text, id_map, stats) where id_map maps short ids to item ids.
+    """
+    rows = {}
+    id_map = {}
+    for category, items in wardrobe_items.items():
+        prefix = CATEGORY_PREFIXES.get(category, category[:2])
+        rows[category] = []
+        for n, item in enumerate(items, start=1):
+            short_id = f"{prefix}{n}"
+            id_map[short_id] = item.get("id")
+            rows[category].append(item_row(short_id, item))
+
+    kept = {category: len(category_rows) for category, category_rows in rows.items()}
+
+    def render():
+        lines = ["id|" + "|".join(ITEM_FIELDS)]
+        for category, category_rows in rows.items():
+            if not category_rows:
+                continue
+            lines.append(f"[{category}]")
+            lines.extend(category_rows[:kept[category]])
+            dropped_items = wardrobe_items[category][kept[category]:]
+            if dropped_items:
+                lines.append(_category_summary(category, dropped_items))
+        return "\n".join(lines)
+
+    text = render()
+    if token_budget is not None:
+        def drop_one():
+            category = max(kept, key=lambda c: kept[c])
+            kept[category] -= 1
+            return estimate_tokens(rows[category][kept[category]] + "\n")
+
+        # Row costs are known up front, so trim by arithmetic first...
+        tokens = estimate_tokens(text)
+        while tokens > token_budget and any(n > 1 for n in kept.values()):
+            tokens -= drop_one()
+        text = render()
+        # ...then make up for the summary lines that replaced dropped rows
+        while estimate_tokens(text) > token_budget and any(n > 1 for n in kept.values()):
+            drop_one()
+            text = render()
+
+    total = sum(len(category_rows) for category_rows in rows.values())
+    sent = sum(kept.values())
+    stats = {"items": sent, "dropped": total - sent, "wardrobe_tokens": estimate_tokens(text)}
+    return text, id_map, stats
+
+
+def expand_item_ids(outfit, id_map):
+    """Replace short ids in an outfit's items with real wardrobe ids"""
+    for outfit_item in outfit.get("items", []):
+        short_id = str(outfit_item.get("item_id", ""))
+        if short_id in id_map:
+            outfit_item["item_id"] = id_map[short_id]
+    return outfit
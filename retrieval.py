@@ -0,0 +1,114 @@
+import numpy as np
+
+# Number of candidates per category passed on to the outfit prompt
+DEFAULT_TOP_K = 8
+
+
+def item_to_text(item):
+    """Build the text that represents a wardrobe item in embedding space"""
+    occasions = item.get("occasions", [])
+    if isinstance(occasions, (list, tuple)):
+        occasions = ", ".join(str(o) for o in occasions)
+    parts = [
+        item.get("type", ""),
+        f"color: {item.get('color', '')}",
+        f"pattern: {item.get('pattern', '')}",
+        f"style: {item.get('style', '')}",
+        f"occasions: {occasions}",
+    ]
+    return "; ".join(p for p in parts if p)
+
+
+def build_query_text(profile, location_info=None, time_of_day=None, location_analysis=None):
+    """Combine profile and outfit context into a single retrieval query"""
+    parts = [f"Profile: {profile}"]
+    if location_info:
+        parts.append(f"Destination: {location_info.get('destination', '')}")
+        parts.append(f"Activity: {location_info.get('activity', '')}")
+    if time_of_day:
+        parts.append(f"Time of day: {time_of_day}")
+    if location_analysis:
+        parts.append(f"Location: {location_analysis}")
+    return "\n".join(parts)
+
+
+class WardrobeIndex:
+    """Per-category nearest-neighbour index over wardrobe item embeddings.
+
+    Item vectors are computed once and reused across queries until the item's
+    text changes (an edit, a backfill, another process rewriting the item);
+    only categories that actually change are refitted. With a store, vectors
+    also persist across sessions so unchanged content is never embedded twice.
+    """
+
+    def __init__(self, embed_fn, store=None):
+        # embed_fn(text, task_type) -> np.ndarray or None
+        self.embed_fn = embed_fn
+        self.store = store
+        self._vectors = {}    # item id -> (item text, vector)
+        self._indexes = {}    # category -> ((item id, item text) tuple, NearestNeighbors)
+
+    def _embed(self, text, task_type, kind=None, item_id=None):
+        if self.store is not None:
+            return self.store.embed(text, task_type, self.embed_fn, kind=kind, item_id=item_id)
+        return self.embed_fn(text, task_type)
+
+    def _item_vector(self, item_id, text):
+        cached = self._vectors.get(item_id)
+        if cached is None or cached[0] != text:
+            vector = self._embed(text, "retrieval_document", kind="item", item_id=item_id)
+            if vector is None:
+                return None
+            cached = self._vectors[item_id] = (text, np.asarray(vector, dtype=np.float32))
+        return cached[1]
+
+    def _category_index(self, category, items):
+        contents = tuple((item.get("id"), item_to_text(item)) for item in items)
+        cached = self._indexes.get(category)
+        if cached and cached[0] == contents:
+            return cached[1]
+
+        vectors = []
+        for item_id, text in contents:
+            vector = self._item_vector(item_id, text)
+            if vector is None:
+                return None
+            vectors.append(vector)
+
+        # scikit-learn is slow to import; load it only once an index is actually built
+        from sklearn.neighbors import NearestNeighbors
+        nn = NearestNeighbors(metric="cosine")
+        nn.fit(np.vstack(vectors))
+        self._indexes[category] = (contents, nn)
+        return nn
+
+    def forget(self, item_id):
+        """Drop a removed or changed item's vector so the index doesn't hold stale entries.
+
+        Only the in-memory copy; utils.remove_wardrobe_item tombstones the stored one.
+        """
+        self._vectors.pop(item_id, None)
+
+    def shortlist(self, wardrobe_items, query_text, k=DEFAULT_TOP_K):
+        """Return a wardrobe dict with at most k items per category, closest to the query.
+
+        Categories with k items or fewer are passed through untouched, and a
+        category whose embeddings can't be computed falls back to all its items.
+        """
+        large = {c: items for c, items in wardrobe_items.items() if len(items) > k}
+        if not large:
+            return wardrobe_items
+
+        query = self._embed(query_text, "retrieval_query", kind="query")
+        if query is None:
+            return wardrobe_items
+        query = np.asarray(query, dtype=np.float32).reshape(1, -1)
+
+        shortlisted = dict(wardrobe_items)
+        for category, items in large.items():
+            nn = self._category_index(category, items)
+            if nn is None:
+                continue
+            _, indices = nn.kneighbors(query, n_neighbors=k)
+            shortlisted[category] = [items[i] for i in indices[0]]
+        return shortlisted
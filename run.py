@@ -1,6 +1,10 @@
 import os
 import sys
 import subprocess
+import importlib.util
+
+# Modules the app needs, checked without importing them
+REQUIRED_MODULES = ["streamlit", "google.generativeai", "numpy", "sklearn", "PIL", "dotenv"]
 
 def setup_directories():
     """Create necessary directories for storing data"""
@@ -8,19 +12,80 @@ def setup_directories():
     os.makedirs("uploads", exist_ok=True)
     
 def check_requirements():
-    """Check if required packages are installed"""
-    try:
-        import streamlit
-        import google.generativeai
-        import numpy
-        from PIL import Image
-        from dotenv import load_dotenv
+    """Check if required packages are installed, without importing them"""
+    missing = []
+    for name in REQUIRED_MODULES:
+        try:
+            found = importlib.util.find_spec(name) is not None
+        except ModuleNotFoundError:
+            # The parent package (e.g. google) is missing
+            found = False
+        if not found:
+            missing.append(name)
+    if not missing:
         return True
-    except ImportError as e:
-        print(f"Missing required package: {e}")
-        print("Installing requirements...")
-        subprocess.call([sys.executable, "-m", "pip", "install", "-r", "requirements.txt"])
-        return False
+    print(f"Missing required packages: {', '.join(missing)}")
+    print("Installing requirements...")
+    subprocess.call([sys.executable, "-m", "pip", "install", "-r", "requirements.txt"])
+    return False
+
+def backfill_thumbnails():
+    """Create thumbnail and medium images for wardrobe items that don't have them"""
+    import images
+    import utils
+    for user in utils.list_users():
+        wardrobe_items = utils.load_wardrobe(user)
+        updated = images.backfill(wardrobe_items,
+                                  lambda category, item: utils.add_wardrobe_item(category, item, user=user))
+        print(f"Created derivatives for {updated} wardrobe items of user {user}.")
+
+def backfill_colors():
+    """Extract named colors for wardrobe items added before local color extraction"""
+    import features
+    import utils
+    for user in utils.list_users():
+        wardrobe_items = utils.load_wardrobe(user)
+        updated = features.backfill(wardrobe_items,
+                                    lambda category, item: utils.add_wardrobe_item(category, item, user=user))
+        print(f"Extracted colors for {updated} wardrobe items of user {user}.")
+
+def dedupe_wardrobe(remove=False):
+    """Report groups of near-duplicate wardrobe items, optionally removing all but the first of each"""
+    import dedupe
+    import features
+    import images
+    import utils
+    for user in utils.list_users():
+        wardrobe_items = utils.load_wardrobe(user)
+        hashed = images.backfill_hashes(wardrobe_items,
+                                        lambda category, item: utils.add_wardrobe_item(category, item, user=user))
+        if hashed:
+            print(f"Hashed {hashed} wardrobe items of user {user}.")
+        items = {item["id"]: item for items in wardrobe_items.values() for item in items if item.get("id")}
+        groups = dedupe.find_duplicate_groups((item_id, item.get("phash"), features.item_color_family(item))
+                                              for item_id, item in items.items())
+        print(f"Found {len(groups)} groups of duplicates for user {user}.")
+        for keep, *extras in groups:
+            print(f"  keep {keep} ({items[keep].get('image_path', '')})")
+            for item_id in extras:
+                print(f"    duplicate {item_id} ({items[item_id].get('image_path', '')})")
+                if remove:
+                    utils.remove_wardrobe_item(item_id, user=user)
+        if remove and groups:
+            print(f"Removed {sum(len(group) - 1 for group in groups)} duplicate items of user {user}.")
+
+def check_uploads(delete=False):
+    """Report wardrobe items with missing images and uploads no item uses, optionally deleting the latter"""
+    import utils
+    for user in utils.list_users():
+        report = utils.check_uploads(user, delete=delete)
+        print(f"User {user}: {report['items']} items, {len(report['missing'])} with a missing image, "
+              f"{len(report['missing_derivatives'])} missing a thumbnail or medium image.")
+        for entry in report["missing"]:
+            print(f"  missing {entry['id']} ({entry['path']})")
+        print(f"  {len(report['orphans'])} unused uploads ({report['orphan_bytes'] / 1e6:.1f} MB).")
+        if delete:
+            print(f"  Deleted {report['deleted']}, reclaiming {report['reclaimed_bytes'] / 1e6:.1f} MB.")
 
 def main():
     """Main function to run the application"""
@@ -42,4 +107,16 @@ def main():
     subprocess.call(["streamlit", "run", "app.py"])
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    if len(sys.argv) > 1 and sys.argv[1] == "backfill-thumbnails":
+        backfill_thumbnails()
+    elif len(sys.argv) > 1 and sys.argv[1] == "backfill-colors":
+        backfill_colors()
+    elif len(sys.argv) > 1 and sys.argv[1] == "dedupe":
+        dedupe_wardrobe(remove="--remove" in sys.argv[2:])
+    elif len(sys.argv) > 1 and sys.argv[1] == "check-uploads":
+        check_uploads(delete="--delete" in sys.argv[2:])
+    elif len(sys.argv) > 1 and sys.argv[1] == "plan":
+        import planner
+        sys.exit(planner.main(sys.argv[2:]))
+    else:
+        main() 
\ No newline at end of file
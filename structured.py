@@ -0,0 +1,230 @@
+import json
+import metrics
+
+# Extra model calls allowed when a reply can't be parsed even after local repair
+DEFAULT_MAX_RECALLS = 1
+# How far back a truncated reply may be cut to the last complete value
+MAX_REPAIR_CUTS = 64
+
+
+class StructuredOutputError(ValueError):
+    """A model reply that isn't valid JSON of the expected shape, even after repair"""
+
+    def __init__(self, message, text=""):
+        super().__init__(message)
+        self.text = text
+
+
+def generation_config(schema, **config):
+    """Generation config asking the model for JSON matching schema.
+
+    The schema uses the OpenAPI subset Gemini accepts ("type", "properties",
+    "items", "required"); the same dict is used to validate the reply.
+    """
+    return dict(config, response_mime_type="application/json", response_schema=schema)
+
+
+def response_text(response):
+    """Text of a model response or stream chunk; "" for ones without text parts
+    (blocked, or finish metadata only), which parse() reports as an empty reply"""
+    try:
+        return response.text or ""
+    except ValueError:
+        return ""
+
+
+def strip_fences(text):
+    """Strip markdown code fences from a model response"""
+    text = text.strip()
+    if "```json" in text:
+        # If response is wrapped in markdown code block
+        text = text.split("```json", 1)[1]
+        text = text.split("```", 1)[0] if "```" in text else text
+    elif text.startswith("```"):
+        # If response is wrapped in generic code block
+        text = text.strip("`")
+    return text.strip()
+
+
+def _scan(text):
+    """Open brackets, whether a string is left open, and the positions of commas outside strings"""
+    stack, commas = [], []
+    in_string = escape = False
+    for i, ch in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append(ch)
+        elif ch in "}]":
+            if stack:
+                stack.pop()
+        elif ch == ",":
+            commas.append(i)
+    return stack, in_string, escape, commas
+
+
+def _drop_trailing_commas(text):
+    out = []
+    in_string = escape = False
+    for ch in text:
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "}]":
+            # Drop a comma (and the whitespace after it) just before a closing bracket
+            end = len(out)
+            while end and out[end - 1].isspace():
+                end -= 1
+            if end and out[end - 1] == ",":
+                del out[end - 1:]
+        out.append(ch)
+    return "".join(out)
+
+
+def _close(text):
+    """Close an unterminated string and any open brackets of a truncated reply"""
+    stack, in_string, escape, _ = _scan(text)
+    if in_string:
+        text = (text[:-1] if escape else text) + '"'
+    return text + "".join("}" if ch == "{" else "]" for ch in reversed(stack))
+
+
+def _loads(text):
+    # Parse the first JSON value, ignoring anything the model wrote after it
+    return json.JSONDecoder().raw_decode(text)[0]
+
+
+def repair(text, schema=None):
+    """Parse near-valid JSON locally, without another model call.
+
+    Handles code fences, prose before or after the JSON, trailing commas and
+    replies cut off mid-way (open strings and brackets are closed, and a
+    dangling key or value is dropped). A truncated reply is cut back to
+    earlier and earlier complete values; with a schema, the first cut that
+    also validates wins, so a half-written last element (e.g. an outfit cut
+    after its opening brace) is dropped rather than failing the whole reply.
+    Raises StructuredOutputError if nothing parses (and validates).
+    """
+    cleaned = strip_fences(text)
+    starts = [i for i in (cleaned.find("{"), cleaned.find("[")) if i >= 0]
+    if not starts:
+        raise StructuredOutputError("No JSON object in the model response", text)
+    cleaned = cleaned[min(starts):]
+
+    _, _, _, commas = _scan(cleaned)
+    cuts = [None] + commas[::-1][:MAX_REPAIR_CUTS]
+    invalid = None
+    for cut in cuts:
+        candidate = cleaned if cut is None else cleaned[:cut]
+        try:
+            data = _loads(_drop_trailing_commas(_close(candidate)))
+        except json.JSONDecodeError:
+            continue
+        if schema is None:
+            return data
+        try:
+            return validate(data, schema)
+        except StructuredOutputError as e:
+            invalid = invalid or e
+    if invalid is not None:
+        invalid.text = text
+        raise invalid
+    raise StructuredOutputError("Model response is not valid JSON", text)
+
+
+def _empty(schema):
+    return {"string": "", "array": [], "object": {}, "integer": 0, "number": 0.0, "boolean": False}.get(
+        schema.get("type"))
+
+
+def validate(value, schema, path="$"):
+    """Check value against schema and coerce near-misses; raises StructuredOutputError.
+
+    Missing optional fields get empty values, a lone value where a list is
+    expected becomes a one-item list, and numbers are accepted as strings (and
+    numeric strings as numbers). Fields not in the schema are kept.
+    """
+    kind = schema.get("type")
+    if kind == "object":
+        if not isinstance(value, dict):
+            raise StructuredOutputError(f"{path}: expected an object")
+        result = dict(value)
+        for name, field in schema.get("properties", {}).items():
+            if value.get(name) is not None:
+                result[name] = validate(value[name], field, f"{path}.{name}")
+            elif name in schema.get("required", ()):
+                raise StructuredOutputError(f"{path}: missing required field {name!r}")
+            else:
+                result[name] = _empty(field)
+        return result
+    if kind == "array":
+        if not isinstance(value, list):
+            value = [value]
+        return [validate(v, schema.get("items", {}), f"{path}[{n}]") for n, v in enumerate(value)]
+    if kind == "string":
+        if isinstance(value, (dict, list)):
+            raise StructuredOutputError(f"{path}: expected a string")
+        return value if isinstance(value, str) else str(value)
+    if kind in ("integer", "number"):
+        try:
+            number = int(value) if kind == "integer" else float(value)
+        except (TypeError, ValueError):
+            raise StructuredOutputError(f"{path}: expected a number") from None
+        if isinstance(value, bool):
+            raise StructuredOutputError(f"{path}: expected a number")
+        return number
+    if kind == "boolean":
+        if not isinstance(value, bool):
+            raise StructuredOutputError(f"{path}: expected true or false")
+    return value
+
+
+def parse(text, schema, kind):
+    """Parse and validate a model reply, repairing it locally if needed.
+
+    Recorded in metrics as json.parse.<kind>, with the number of replies that
+    needed repair in the "repaired" total; failures count as errors.
+    """
+    with metrics.get_metrics().timed(f"json.parse.{kind}", response_bytes=len(text.encode("utf-8"))) as sample:
+        if not text.strip():
+            raise StructuredOutputError("Empty model response (blocked or without text)", text)
+        try:
+            data = json.loads(text)
+        except json.JSONDecodeError:
+            data = repair(text, schema)
+            sample["repaired"] = 1
+        try:
+            return validate(data, schema)
+        except StructuredOutputError as e:
+            e.text = text
+            raise
+
+
+def generate(model, contents, schema, kind, config=None, max_recalls=DEFAULT_MAX_RECALLS):
+    """Call the model in JSON mode and return the validated reply.
+
+    A reply that can't be repaired or doesn't match the schema is requested
+    again up to max_recalls times; each re-call is recorded as
+    json.recall.<kind>. Raises StructuredOutputError when all attempts fail.
+    """
+    for attempt in range(max_recalls + 1):
+        response = model.generate_content(contents, generation_config=generation_config(schema, **(config or {})))
+        try:
+            return parse(response_text(response), schema, kind)
+        except StructuredOutputError as e:
+            if attempt == max_recalls:
+                raise
+            metrics.get_metrics().record(f"json.recall.{kind}", 0.0, reason=str(e)[:200])
@@ -0,0 +1,658 @@
+import os
+import json
+import time
+import threading
+from collections import deque
+# NumPy stays a top-level import here and in the other modules: ~110 ms of a cold start, but
+# st.image imports it on the first thumbnail anyway, so only an empty wardrobe would skip it
+import numpy as np
+import cache
+import embedding_store
+import features
+import images
+import json_stream
+import metrics
+import prompt_builder
+import structured
+
+MODEL_NAME = 'gemini-1.5-flash'
+
+# Model backend: the Gemini SDK, or a local stand-in with the same interface
+# (configure, GenerativeModel, embed_content) for benchmarks and offline runs.
+# The SDK takes over a second to import, so it's loaded on the first model call
+# rather than at startup.
+backend = None
+_api_key = None
+_models = {}
+_backend_lock = threading.Lock()
+
+
+def set_backend(new_backend):
+    """Swap the model backend, e.g. for a fake_gemini.FakeGemini in benchmarks"""
+    global backend
+    with _backend_lock:
+        backend = new_backend
+        _models.clear()
+        if _api_key:
+            backend.configure(api_key=_api_key)
+
+
+def get_backend():
+    """Return the model backend, importing and configuring it on first use"""
+    global backend
+    with _backend_lock:
+        if backend is None:
+            if os.getenv("STYLIST_BACKEND") == "fake":
+                import fake_gemini
+                backend = fake_gemini.FakeGemini()
+            else:
+                import google.generativeai as genai
+                backend = genai
+            if _api_key:
+                backend.configure(api_key=_api_key)
+        return backend
+
+
+def configure(api_key):
+    """Remember the API key; the backend is configured with it when loaded.
+
+    Cheap to call on every rerun: an already loaded backend is only
+    reconfigured when the key changes.
+    """
+    global _api_key
+    with _backend_lock:
+        if api_key == _api_key:
+            return
+        _api_key = api_key
+        _models.clear()
+        if backend is not None:
+            backend.configure(api_key=api_key)
+
+
+def _request_bytes(contents):
+    parts = contents if isinstance(contents, (list, tuple)) else [contents]
+    size = 0
+    for part in parts:
+        if isinstance(part, str):
+            size += len(part.encode("utf-8"))
+        elif isinstance(part, dict) and isinstance(part.get("data"), (bytes, bytearray)):
+            size += len(part["data"])
+    return size
+
+
+def _record_usage(response, sample):
+    usage = getattr(response, "usage_metadata", None)
+    if usage:
+        sample["input_tokens"] = getattr(usage, "prompt_token_count", None)
+        sample["output_tokens"] = getattr(usage, "candidates_token_count", None)
+
+
+class InstrumentedModel:
+    """Wraps a backend model so every generate_content call is recorded in metrics:
+    wall time, request and response bytes, and token counts when the backend reports them.
+    """
+
+    def __init__(self, model, op):
+        self.model = model
+        self.op = op
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        if stream:
+            return self._stream(contents, **kwargs)
+        with metrics.get_metrics().timed(self.op, request_bytes=_request_bytes(contents)) as sample:
+            response = self.model.generate_content(contents, **kwargs)
+            sample["response_bytes"] = len(structured.response_text(response).encode("utf-8"))
+            _record_usage(response, sample)
+        return response
+
+    def _stream(self, contents, **kwargs):
+        with metrics.get_metrics().timed(self.op, request_bytes=_request_bytes(contents), stream=True) as sample:
+            start = time.perf_counter()
+            sample["response_bytes"] = 0
+            for chunk in self.model.generate_content(contents, stream=True, **kwargs):
+                if "first_chunk_ms" not in sample:
+                    sample["first_chunk_ms"] = round((time.perf_counter() - start) * 1000, 3)
+                sample["response_bytes"] += len(structured.response_text(chunk).encode("utf-8"))
+                # Usage totals arrive with the last chunk
+                _record_usage(chunk, sample)
+                yield chunk
+
+
+def get_model(op="model.generate"):
+    """Return the backend model wrapped for metrics; op names the call in the metrics.
+
+    The underlying model object is created once per process and reused.
+    """
+    current = get_backend()
+    with _backend_lock:
+        model = _models.get(MODEL_NAME)
+        if model is None:
+            model = _models[MODEL_NAME] = current.GenerativeModel(MODEL_NAME)
+    return InstrumentedModel(model, op)
+
+
+def embed_text(text, task_type="retrieval_document"):
+    """Embed text with the embedding model; raises on model errors"""
+    with metrics.get_metrics().timed("model.embed", request_bytes=len(text.encode("utf-8"))):
+        result = get_backend().embed_content(
+            model=embedding_store.EMBEDDING_MODEL,
+            content=text,
+            task_type=task_type,
+        )
+    return np.array(result["embedding"])
+
+def try_embed_text(text, task_type="retrieval_document"):
+    """embed_text for retrieval.WardrobeIndex: prints model errors and returns None,
+    so shortlisting falls back to the whole wardrobe"""
+    try:
+        return embed_text(text, task_type)
+    except Exception as e:
+        print(f"Error creating embedding: {e}")
+        return None
+
+# Prompt templates; their text is part of the analysis cache key, so editing
+# a template invalidates the cached results produced by the old one
+PROFILE_PROMPT = '''Analyze the person's figure and skin tone. Return in this JSON format:
+            {
+              "body_shape": "",
+              "skin_tone": "",
+              "recommended_colors": [],
+              "avoid_styles": [],
+              "notes": ""
+            }'''
+
+CLOTHING_PROMPT = '''Analyze this clothing item and return in this JSON format:
+            {
+              "type": "",
+              "color": "",
+              "pattern": "",
+              "style": "",
+              "occasions": []
+            }'''
+
+LOCATION_PROMPT = '''Analyze this location and return in this JSON format:
+            {
+              "location_type": "",
+              "environment": "",
+              "weather_indication": "",
+              "dress_code_suggestion": "",
+              "notable_features": [],
+              "recommended_style_elements": []
+            }'''
+
+# Response schemas: the model is asked for JSON in these shapes and replies are
+# validated against them (see structured.py)
+_STRING = {"type": "string"}
+_STRINGS = {"type": "array", "items": _STRING}
+
+PROFILE_SCHEMA = {
+    "type": "object",
+    "properties": {"body_shape": _STRING, "skin_tone": _STRING, "recommended_colors": _STRINGS,
+                   "avoid_styles": _STRINGS, "notes": _STRING},
+    "required": ["body_shape", "skin_tone", "recommended_colors"],
+}
+
+CLOTHING_SCHEMA = {
+    "type": "object",
+    "properties": {"type": _STRING, "color": _STRING, "pattern": _STRING, "style": _STRING, "occasions": _STRINGS},
+    "required": ["type", "color"],
+}
+
+LOCATION_SCHEMA = {
+    "type": "object",
+    "properties": {"location_type": _STRING, "environment": _STRING, "weather_indication": _STRING,
+                   "dress_code_suggestion": _STRING, "notable_features": _STRINGS,
+                   "recommended_style_elements": _STRINGS},
+    "required": ["location_type", "environment"],
+}
+
+OUTFIT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "option_id": {"type": "integer"},
+        "name": _STRING,
+        "description": _STRING,
+        "items": {
+            "type": "array",
+            "items": {"type": "object", "properties": {"type": _STRING, "item_id": _STRING}, "required": ["item_id"]},
+        },
+        "occasions": _STRINGS,
+        "weather": _STRING,
+        "time_of_day": _STRING,
+        "location_appropriateness": _STRING,
+    },
+    "required": ["option_id", "items"],
+}
+
+OUTFITS_SCHEMA = {
+    "type": "object",
+    "properties": {"outfit_options": {"type": "array", "items": OUTFIT_SCHEMA}},
+    "required": ["outfit_options"],
+}
+
+DESCRIPTIONS_SCHEMA = {
+    "type": "object",
+    "properties": {"outfit_options": {"type": "array", "items": {
+        "type": "object",
+        "properties": {"option_id": {"type": "integer"}, "name": _STRING, "description": _STRING,
+                       "weather": _STRING, "location_appropriateness": _STRING},
+        "required": ["option_id"],
+    }}},
+    "required": ["outfit_options"],
+}
+
+OUTFIT_GENERATION_CONFIG = {"temperature": 0.7}
+
+# Cache of image analyses keyed by image content and prompt template
+analysis_cache = cache.get_cache("analysis", max_entries=1000, max_bytes=50 * 1024 * 1024)
+
+
+# Per-call image preprocessing stats, appended as JSON lines for offline tuning
+PREPROCESS_STATS_FILE = "data/preprocess_stats.jsonl"
+# Records kept in memory for the per-setting means; the file (rotated to .1 at
+# metrics.MAX_LOG_BYTES) has the rest
+PREPROCESS_STATS_RECENT = 1000
+_preprocess_stats = deque(maxlen=PREPROCESS_STATS_RECENT)
+_preprocess_totals = {"calls": 0, "bytes_saved": 0}
+_preprocess_stats_lock = threading.Lock()
+
+
+def record_preprocess_stats(record):
+    """Keep a preprocessing/latency record in memory and append it to the stats file"""
+    with _preprocess_stats_lock:
+        _preprocess_stats.append(record)
+        _preprocess_totals["calls"] += 1
+        if record["original_bytes"] is not None and record["sent_bytes"] is not None:
+            _preprocess_totals["bytes_saved"] += record["original_bytes"] - record["sent_bytes"]
+        try:
+            os.makedirs(os.path.dirname(PREPROCESS_STATS_FILE), exist_ok=True)
+            # Rotated like metrics.jsonl, so a long-running app doesn't grow it without bound
+            if os.path.exists(PREPROCESS_STATS_FILE) and os.path.getsize(PREPROCESS_STATS_FILE) > metrics.MAX_LOG_BYTES:
+                os.replace(PREPROCESS_STATS_FILE, PREPROCESS_STATS_FILE + ".1")
+            with open(PREPROCESS_STATS_FILE, "a") as f:
+                f.write(json.dumps(record) + "\n")
+        except OSError as e:
+            print(f"Error writing preprocess stats: {e}")
+
+
+def preprocess_summary():
+    """Calls and bytes saved this process, plus mean model latency per preprocessing
+    setting over the last PREPROCESS_STATS_RECENT calls"""
+    with _preprocess_stats_lock:
+        records = list(_preprocess_stats)
+        totals = dict(_preprocess_totals)
+    by_setting = {}
+    for r in records:
+        setting = f"max_edge={r['max_edge']} quality={r['quality']} crop={r['crop']}"
+        group = by_setting.setdefault(setting, {"calls": 0, "sent_bytes": 0, "model_ms": 0.0})
+        group["calls"] += 1
+        group["sent_bytes"] += r["sent_bytes"] or 0
+        group["model_ms"] += r["model_ms"]
+    for group in by_setting.values():
+        group["mean_sent_bytes"] = group.pop("sent_bytes") / group["calls"]
+        group["mean_model_ms"] = group.pop("model_ms") / group["calls"]
+    return {"calls": totals["calls"], "bytes_saved": totals["bytes_saved"], "by_setting": by_setting}
+
+
+def analysis_key(image, image_bytes, prompt, schema=None, settings=None):
+    """Key an analysis on the uploaded file bytes (or decoded pixels), the prompt,
+    the response schema and the preprocessing (and any other) settings"""
+    if image_bytes is None:
+        image_bytes = image.tobytes()
+    return cache.hash_key(image_bytes, prompt, json.dumps(schema, sort_keys=True),
+                          json.dumps(dict(images.model_settings(), **(settings or {})), sort_keys=True))
+
+
+def _cached_analysis(key):
+    """A cached analysis, or None; an entry that isn't a JSON object (e.g. a raw
+    reply cached by an earlier version) counts as a miss and is dropped"""
+    cached = analysis_cache.get(key)
+    if cached is not None:
+        try:
+            valid = isinstance(json.loads(cached), dict)
+        except (TypeError, ValueError):
+            valid = False
+        if not valid:
+            analysis_cache.delete(key)
+            cached = None
+    metrics.get_metrics().cache_lookup("analysis_cache", cached is not None)
+    return cached
+
+
+def _analyze(image, image_bytes, prompt, schema, kind, local=None):
+    settings = features.settings() if local else None
+    key = analysis_key(image, image_bytes, prompt, schema, settings)
+    cached = _cached_analysis(key)
+    if cached is not None:
+        return cached
+
+    known, extra = {}, {}
+    if local:
+        # Attributes settled locally aren't asked of the model
+        known, extra = local(image, image_bytes)
+        prompt, schema = _narrow_request(prompt, schema, known)
+
+    image_part, stats = images.prepare_for_model(image, image_bytes)
+    model = get_model(f"model.analyze_{kind}")
+    start = time.perf_counter()
+    data = structured.generate(model, [image_part, prompt], schema, kind)
+    stats["model_ms"] = (time.perf_counter() - start) * 1000
+    record_preprocess_stats(dict(stats, kind=kind, local_fields=len(known), **images.model_settings()))
+    data.update(known, **extra)
+    # Only validated replies are cached, as canonical JSON text
+    result = json.dumps(data)
+    analysis_cache.set(key, result, kind=kind)
+    return result
+
+
+def analyze_image(image, image_bytes=None):
+    """Analyze a photo of the user and return the profile as JSON text; raises on model errors"""
+    return _analyze(image, image_bytes, PROFILE_PROMPT, PROFILE_SCHEMA, "profile")
+
+
+def _narrow_request(prompt, schema, known):
+    """Prompt and schema asking only for the fields that aren't already known"""
+    if not known:
+        return prompt, schema
+    properties = {name: field for name, field in schema["properties"].items() if name not in known}
+    template = json.dumps({name: [] if field["type"] == "array" else "" for name, field in properties.items()},
+                          indent=2)
+    prompt = prompt.split("{", 1)[0].rstrip() + "\n" + template
+    schema = dict(schema, properties=properties,
+                  required=[name for name in schema.get("required", []) if name not in known])
+    return prompt, schema
+
+
+def _local_clothing_attributes(image, image_bytes=None):
+    """(confident attributes, always-added fields) from local colour and pattern extraction"""
+    extracted = features.extract(image, image_bytes)
+    metrics.get_metrics().record("features.extract", extracted["ms"] / 1000,
+                                 local_fields=len(features.confident_attributes(extracted)))
+    return features.confident_attributes(extracted), {"colors": extracted["colors"]}
+
+
+def analyze_clothing(image, image_bytes=None):
+    """Analyze a clothing item photo and return the item as JSON text; raises on model errors.
+
+    Color and pattern come from local extraction (features.py) when it is
+    confident, and the model is then only asked for the remaining fields.
+    The item's named colors are always added from the local extraction.
+    """
+    return _analyze(image, image_bytes, CLOTHING_PROMPT, CLOTHING_SCHEMA, "clothing",
+                    local=_local_clothing_attributes)
+
+
+def analyze_location(image, image_bytes=None):
+    """Analyze a location photo and return the analysis as JSON text; raises on model errors"""
+    return _analyze(image, image_bytes, LOCATION_PROMPT, LOCATION_SCHEMA, "location")
+
+
+# Clothing photos analysed per request by analyze_clothing_batch, and the most
+# image bytes sent in one request (Gemini caps inline request data at 20 MB)
+BATCH_MAX_ITEMS = int(os.getenv("CLOTHING_BATCH_SIZE", "8"))
+BATCH_MAX_BYTES = int(os.getenv("CLOTHING_BATCH_MAX_BYTES", str(15 * 1024 * 1024)))
+
+BATCH_CLOTHING_PROMPT = '''Analyze each clothing item image above. Images are numbered from 0 in the order given.
+Return one entry per image, with the image's number as "index", in this JSON format:
+            {
+              "items": [
+                {"index": 0, "type": "", "color": "", "pattern": "", "style": "", "occasions": []}
+              ]
+            }'''
+
+BATCH_ITEM_SCHEMA = dict(CLOTHING_SCHEMA,
+                         properties=dict({"index": {"type": "integer"}}, **CLOTHING_SCHEMA["properties"]),
+                         required=["index"] + CLOTHING_SCHEMA["required"])
+BATCH_CLOTHING_SCHEMA = {
+    "type": "object",
+    "properties": {"items": {"type": "array", "items": BATCH_ITEM_SCHEMA}},
+    "required": ["items"],
+}
+# Replies are parsed against the envelope only, so one bad entry doesn't fail the rest
+_BATCH_ENVELOPE = {"type": "object", "properties": {"items": {"type": "array", "items": {"type": "object"}}},
+                   "required": ["items"]}
+
+
+def _batches(pending, sizes, max_items, max_bytes):
+    """Group pending photos in order into requests of at most max_items photos and max_bytes image data"""
+    batch, batch_bytes = [], 0
+    for n in pending:
+        if batch and (len(batch) == max_items or batch_bytes + sizes[n] > max_bytes):
+            yield batch
+            batch, batch_bytes = [], 0
+        batch.append(n)
+        batch_bytes += sizes[n]
+    if batch:
+        yield batch
+
+
+def _analyze_batch(batch, photos, parts, keys, results, wait):
+    """Analyze photos[n] for n in batch in one request, splitting off what doesn't come back valid"""
+    if len(batch) == 1:
+        # A lone photo goes through the single-item path, with its own re-call
+        n = batch[0]
+        if wait:
+            wait()
+        try:
+            results[n] = analyze_clothing(*photos[n])
+        except structured.StructuredOutputError as e:
+            results[n] = e
+        return
+
+    contents = []
+    for position, n in enumerate(batch):
+        contents += [f"Image {position}:", parts[n]]
+    contents.append(BATCH_CLOTHING_PROMPT)
+    if wait:
+        wait()
+    model = get_model("model.analyze_clothing_batch")
+    start = time.perf_counter()
+    response = model.generate_content(contents, generation_config=structured.generation_config(BATCH_CLOTHING_SCHEMA))
+    try:
+        entries = structured.parse(structured.response_text(response), _BATCH_ENVELOPE, "clothing_batch")["items"]
+    except structured.StructuredOutputError:
+        entries = []
+
+    # Match entries back to photos by index; invalid, duplicate and out-of-range entries are dropped
+    analysed = {}
+    for entry in entries:
+        try:
+            item = structured.validate(entry, BATCH_ITEM_SCHEMA)
+        except structured.StructuredOutputError:
+            continue
+        position = item.pop("index")
+        if 0 <= position < len(batch):
+            analysed.setdefault(position, item)
+    for position, item in analysed.items():
+        n = batch[position]
+        known, extra = _local_clothing_attributes(*photos[n])
+        item.update(known, **extra)
+        results[n] = json.dumps(item)
+        analysis_cache.set(keys[n], results[n], kind="clothing")
+
+    missing = [n for position, n in enumerate(batch) if position not in analysed]
+    metrics.get_metrics().record("clothing_batch", time.perf_counter() - start, items=len(batch),
+                                 parsed=len(analysed), split=1 if missing else 0)
+    if missing:
+        # Retry what's left in halves: a smaller reply is less likely to be cut off
+        half = (len(missing) + 1) // 2
+        for part in (missing[:half], missing[half:]):
+            if part:
+                _analyze_batch(part, photos, parts, keys, results, wait)
+
+
+def analyze_clothing_batch(photos, wait=None, max_items=None, max_bytes=None):
+    """Analyze many clothing photos, several per model request.
+
+    photos is a list of (image, image_bytes). Returns a list in the same order
+    holding each item's JSON text (as analyze_clothing returns it, and cached
+    under the same key) or the StructuredOutputError it failed with. Photos are
+    packed in order into requests of at most max_items photos and max_bytes of
+    prepared image data; entries missing or invalid in a reply are retried in
+    halves, down to single-item calls. wait() is called before every request,
+    e.g. a rate limiter's. Other model errors are raised; the items analysed
+    before them stay cached, so a retry only asks for the rest.
+    """
+    max_items = max(1, max_items or BATCH_MAX_ITEMS)
+    max_bytes = max_bytes or BATCH_MAX_BYTES
+    results = [None] * len(photos)
+    keys, parts, sizes = {}, {}, {}
+    for n, (image, image_bytes) in enumerate(photos):
+        keys[n] = analysis_key(image, image_bytes, CLOTHING_PROMPT, CLOTHING_SCHEMA, features.settings())
+        results[n] = _cached_analysis(keys[n])
+        if results[n] is None:
+            parts[n], stats = images.prepare_for_model(image, image_bytes)
+            sizes[n] = stats["sent_bytes"] or 0
+
+    for batch in _batches(sorted(parts), sizes, max_items, max_bytes):
+        _analyze_batch(batch, photos, parts, keys, results, wait)
+    return results
+
+
+OUTFIT_PROMPT = """You're an expert stylist.
+Use the following profile, location context, and available wardrobe items to suggest 3 personalized outfit options.
+
+Profile:
+{profile}
+{location_context}
+Wardrobe (one item per line, columns given in the header):
+{wardrobe}
+
+Generate outfits that:
+1. Only use items available in the wardrobe
+2. Match the location's environment and dress code
+3. Are appropriate for the time of day
+4. Consider the weather and environment
+5. Only use colors from recommended_colors in the profile
+6. Avoid styles from avoid_styles in the profile
+
+Return JSON with 3 outfit options in this structure:
+{{"outfit_options": [{{"option_id": 1, "name": "Name of outfit", "description": "Brief description",
+"items": [{{"type": "top/bottom/etc", "item_id": "id from the wardrobe, e.g. t1"}}],
+"occasions": ["casual", "work"], "weather": "suitable weather condition", "time_of_day": "when to wear",
+"location_appropriateness": "why this outfit suits the location"}}]}}
+"""
+
+
+def build_location_context(location_info=None, time_of_day=None, location_analysis=None):
+    """Location and time section shared by the outfit prompts"""
+    location_context = ""
+    if location_info:
+        location_context = (
+            "\nLocation Context:\n"
+            f"- Destination: {location_info.get('destination', '')}\n"
+            f"- Activity: {location_info.get('activity', '')}\n"
+            f"- Time of Day: {time_of_day if time_of_day else 'Not specified'}\n"
+        )
+    if location_analysis:
+        location_context += f"\nLocation Analysis:\n{prompt_builder.compact_profile(location_analysis)}\n"
+    return location_context
+
+
+def build_outfit_prompt(profile, wardrobe_items, location_info=None, time_of_day=None, location_analysis=None,
+                        token_budget=None):
+    """Build the outfit generation prompt for a (shortlisted) wardrobe.
+
+    The wardrobe is encoded compactly with short ids and trimmed to fit the
+    token budget. Returns (prompt, info) where info holds the short id map and
+    the prompt size.
+    """
+    token_budget = prompt_builder.DEFAULT_TOKEN_BUDGET if token_budget is None else token_budget
+
+    location_context = build_location_context(location_info, time_of_day, location_analysis)
+    profile_text = prompt_builder.compact_profile(profile)
+    overhead = prompt_builder.estimate_tokens(
+        OUTFIT_PROMPT.format(profile=profile_text, location_context=location_context, wardrobe="")
+    )
+    wardrobe_text, id_map, stats = prompt_builder.compact_wardrobe(
+        wardrobe_items, token_budget=max(token_budget - overhead, 0)
+    )
+    prompt = OUTFIT_PROMPT.format(profile=profile_text, location_context=location_context, wardrobe=wardrobe_text)
+
+    info = dict(stats, id_map=id_map, chars=len(prompt),
+                tokens=prompt_builder.estimate_tokens(prompt), token_budget=token_budget)
+    return prompt, info
+
+
+def generate_outfits(prompt, id_map=None):
+    """Generate outfits in one request and return them as JSON text; raises on model errors"""
+    model = get_model("model.generate_outfits")
+    data = structured.generate(model, prompt, OUTFITS_SCHEMA, "outfits", OUTFIT_GENERATION_CONFIG)
+    for outfit in data["outfit_options"]:
+        prompt_builder.expand_item_ids(outfit, id_map or {})
+    return json.dumps(data)
+
+
+def stream_outfits(prompt, parser=None, id_map=None):
+    """Stream outfit generation, yielding each outfit option as soon as it is complete.
+
+    If nothing could be pulled out incrementally (for example the model
+    returned an unexpected shape), the full reply is parsed once at the end.
+    """
+    parser = parser or json_stream.ArrayItemParser()
+    model = get_model("model.stream_outfits")
+    response = model.generate_content(prompt, stream=True,
+                                      generation_config=structured.generation_config(OUTFITS_SCHEMA,
+                                                                                     **OUTFIT_GENERATION_CONFIG))
+    for chunk in response:
+        text = structured.response_text(chunk)
+        if not text:
+            continue
+        for outfit in parser.feed(text):
+            try:
+                outfit = structured.validate(outfit, OUTFIT_SCHEMA)
+            except structured.StructuredOutputError:
+                parser.errors += 1
+                continue
+            yield prompt_builder.expand_item_ids(outfit, id_map or {})
+
+    if not parser.items:
+        data = structured.parse(parser.text(), OUTFITS_SCHEMA, "outfits")
+        for outfit in data["outfit_options"]:
+            parser.items.append(outfit)
+            yield prompt_builder.expand_item_ids(outfit, id_map or {})
+
+
+DESCRIBE_PROMPT = """You're an expert stylist. These outfits were put together from the user's wardrobe.
+Give each one a short name, a one-sentence description, the weather it suits and why it fits the location.
+
+Profile:
+{profile}
+{location_context}
+Outfits (option_id: type color style; ...):
+{outfits}
+
+Return JSON in this structure:
+{{"outfit_options": [{{"option_id": 1, "name": "", "description": "", "weather": "", "location_appropriateness": ""}}]}}
+"""
+
+
+def describe_outfits(outfits, items_by_id, profile, location_info=None, time_of_day=None, location_analysis=None):
+    """Ask the model only to name and describe outfits chosen locally; raises on model errors.
+
+    Returns the outfits with name, description, weather and
+    location_appropriateness filled in from the reply, matched by option_id.
+    """
+    lines = []
+    for outfit in outfits:
+        parts = []
+        for outfit_item in outfit["items"]:
+            item = items_by_id(outfit_item["item_id"]) or {}
+            parts.append(" ".join(str(item.get(f, "")) for f in ("type", "color", "style")).strip())
+        lines.append(f"{outfit['option_id']}: " + "; ".join(parts))
+
+    prompt = DESCRIBE_PROMPT.format(
+        profile=prompt_builder.compact_profile(profile),
+        location_context=build_location_context(location_info, time_of_day, location_analysis),
+        outfits="\n".join(lines),
+    )
+    model = get_model("model.describe_outfits")
+    data = structured.generate(model, prompt, DESCRIPTIONS_SCHEMA, "descriptions", OUTFIT_GENERATION_CONFIG)
+
+    described = {str(d["option_id"]): d for d in data["outfit_options"]}
+    for outfit in outfits:
+        details = described.get(str(outfit["option_id"]), {})
+        for field in ("name", "description", "weather", "location_appropriateness"):
+            if details.get(field):
+                outfit[field] = details[field]
+    return outfits
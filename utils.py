@@ -1,84 +1,418 @@
 import os
+import re
 import json
-import pickle
+import threading
 from pathlib import Path
+import dedupe
+import embedding_store
+import features
+import integrity
+import locking
+import metrics
+import outfit_cache
+from wardrobe_store import WardrobeStore, CATEGORIES
+from outfit_history import OutfitHistory
 
-# File path for saving wardrobe data
-WARDROBE_FILE = "data/wardrobe.pkl"
-PROFILE_FILE = "data/profile.json"
-OUTFITS_FILE = "data/saved_outfits.json"
+# Each user's data lives in its own namespace. The default user keeps the
+# original layout (data/, uploads/); other users get data/users/<name>/ and
+# uploads/<name>/.
+DEFAULT_USER = "default"
+USERS_DIR = "data/users"
+USER_NAME = re.compile(r"^[a-z0-9][a-z0-9_-]{0,63}$")
 
-def ensure_data_dir():
+# File names inside a namespace's data directory
+WARDROBE_FILE = "wardrobe.pkl"  # legacy pickle, migrated into WARDROBE_DB
+WARDROBE_DB = "wardrobe.db"
+PROFILE_FILE = "profile.json"
+OUTFITS_FILE = "saved_outfits.json"  # legacy, migrated into the outfit history log
+HISTORY_FILE = "outfit_history.jsonl"
+HISTORY_INDEX = "outfit_history.idx"
+
+def normalise_user(user):
+    """Lower-cased user name, or DEFAULT_USER when empty; raises ValueError for unsafe names"""
+    user = (user or DEFAULT_USER).strip().lower()
+    if not USER_NAME.match(user):
+        raise ValueError(f"Invalid user name {user!r}: use letters, digits, '-' and '_'")
+    return user
+
+def data_dir(user=DEFAULT_USER):
+    """Directory holding a user's wardrobe, profile, outfits and embeddings"""
+    user = normalise_user(user)
+    return "data" if user == DEFAULT_USER else os.path.join(USERS_DIR, user)
+
+def uploads_dir(user=DEFAULT_USER):
+    """Directory holding a user's uploaded images"""
+    user = normalise_user(user)
+    return "uploads" if user == DEFAULT_USER else os.path.join("uploads", user)
+
+def upload_path(item_id, user=DEFAULT_USER):
+    """Where the uploaded image of a new item is stored"""
+    return f"{uploads_dir(user)}/{item_id}.jpg"
+
+def list_users():
+    """The default user plus every user with a namespace on disk"""
+    users = [DEFAULT_USER]
+    if os.path.isdir(USERS_DIR):
+        users += sorted(name for name in os.listdir(USERS_DIR)
+                        if USER_NAME.match(name) and os.path.isdir(os.path.join(USERS_DIR, name)))
+    return users
+
+def ensure_data_dir(user=DEFAULT_USER):
     """Ensure the data directory exists"""
     os.makedirs("data", exist_ok=True)
     os.makedirs("uploads", exist_ok=True)
+    os.makedirs(data_dir(user), exist_ok=True)
+    os.makedirs(uploads_dir(user), exist_ok=True)
 
-def save_wardrobe(wardrobe_items):
-    """Save wardrobe items to a pickle file"""
-    ensure_data_dir()
-    with open(WARDROBE_FILE, 'wb') as f:
-        pickle.dump(wardrobe_items, f)
+class ReadCache:
+    """In-process cache of loaded data shared by every session.
 
-def load_wardrobe():
-    """Load wardrobe items from pickle file if exists"""
-    ensure_data_dir()
-    if os.path.exists(WARDROBE_FILE):
-        try:
-            with open(WARDROBE_FILE, 'rb') as f:
-                return pickle.load(f)
-        except Exception as e:
-            print(f"Error loading wardrobe: {e}")
+    Each entry is stored with a cheap stamp of its source (a version counter
+    or file mtime); a read whose stamp still matches is served from memory
+    instead of re-reading and re-parsing the file.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, stamp, load):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == stamp:
+                return entry[1]
+        value = load()
+        with self._lock:
+            self._entries[key] = (stamp, value)
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+_read_cache = ReadCache()
+
+def _file_stamp(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+_wardrobe_stores = {}
+_wardrobe_store_lock = threading.Lock()
+
+def get_wardrobe_store(user=DEFAULT_USER):
+    """Return the shared wardrobe store of a user, migrating a legacy pickle on first use"""
+    user = normalise_user(user)
+    with _wardrobe_store_lock:
+        if user not in _wardrobe_stores:
+            ensure_data_dir(user)
+            store = WardrobeStore(os.path.join(data_dir(user), WARDROBE_DB))
+            legacy = os.path.join(data_dir(user), WARDROBE_FILE)
+            migrated = store.migrate_from_pickle(legacy)
+            if migrated:
+                print(f"Migrated {migrated} wardrobe items from {legacy}")
+            _wardrobe_stores[user] = store
+        return _wardrobe_stores[user]
+
+def get_embedding_store(user=DEFAULT_USER):
+    """Return the embedding store of a user"""
+    return embedding_store.get_store(data_dir(user))
+
+_duplicate_indexes = {}
+_duplicate_index_lock = threading.Lock()
+
+def get_duplicate_index(user=DEFAULT_USER):
+    """Return the near-duplicate index over a user's image hashes, built on first use"""
+    user = normalise_user(user)
+    with _duplicate_index_lock:
+        if user not in _duplicate_indexes:
+            wardrobe = get_wardrobe_store(user).load_all()
+            _duplicate_indexes[user] = dedupe.DuplicateIndex(
+                (item.get("id"), item.get("phash"), features.item_color_family(item))
+                for items in wardrobe.values() for item in items
+            )
+        return _duplicate_indexes[user]
+
+@metrics.instrument("storage.add_wardrobe_item")
+def add_wardrobe_item(category, item, user=DEFAULT_USER):
+    """Save a single wardrobe item"""
+    get_wardrobe_store(user).add(category, item)
+    index = _duplicate_indexes.get(normalise_user(user))
+    if index is not None and item.get("phash"):
+        index.add(item.get("id"), item["phash"], features.item_color_family(item))
+
+@metrics.instrument("storage.remove_wardrobe_item")
+def remove_wardrobe_item(item_id, user=DEFAULT_USER):
+    """Delete a single wardrobe item, its embeddings and cached outfits that use it"""
+    removed = get_wardrobe_store(user).remove(item_id)
+    get_embedding_store(user).delete_item(item_id)
+    index = _duplicate_indexes.get(normalise_user(user))
+    if index is not None:
+        index.remove(item_id)
+    # Cached outfits that used this item are no longer valid
+    outfit_cache.get_outfit_cache().invalidate_item(item_id)
+    return removed
+
+def get_wardrobe_item(item_id, user=DEFAULT_USER):
+    """Look up (category, item) by id, or None"""
+    return get_wardrobe_store(user).get(item_id)
+
+def wardrobe_stamp(user=DEFAULT_USER):
+    """Stamp of the stored wardrobe's current state, for save_wardrobe(expected=...)"""
+    return get_wardrobe_store(user).stamp()
+
+def wardrobe_version(user=DEFAULT_USER):
+    """Version counter of the stored wardrobe, bumped when items are added or changed"""
+    return get_wardrobe_store(user).version()
+
+@metrics.instrument("storage.load_category")
+def load_category(category, user=DEFAULT_USER):
+    """Load the items of a single category"""
+    return get_wardrobe_store(user).by_category(category)
+
+class ItemIndex:
+    """id -> (category, item) index over a wardrobe dict, kept in step with adds and removes.
+
+    The persisted counterpart is the wardrobe store's primary key; this is the
+    in-session view used for rendering. Each item's position in its category
+    list is indexed too, so removal swaps the last item into the gap instead
+    of shifting the list; items() restores the added order when it's read.
+    """
+
+    def __init__(self, wardrobe_items):
+        self.wardrobe_items = wardrobe_items
+        self._items = {}
+        self._positions = {}   # item id -> index in its category list
+        self._order = {}       # item id -> sequence number in the order items were added
+        self._unsorted = set() # categories whose list removals have shuffled
+        self._added = 0
+        for category, items in wardrobe_items.items():
+            for position, item in enumerate(items):
+                self._index(category, item, position)
+
+    def _index(self, category, item, position):
+        self._items[item["id"]] = (category, item)
+        self._positions[item["id"]] = position
+        self._order[item["id"]] = self._added
+        self._added += 1
+
+    def __contains__(self, item_id):
+        return item_id in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, item_id):
+        """Return the item with this id, or None"""
+        entry = self._items.get(item_id)
+        return entry[1] if entry else None
+
+    def category(self, item_id):
+        """Return the category of the item with this id, or None"""
+        entry = self._items.get(item_id)
+        return entry[0] if entry else None
+
+    def items(self, category):
+        """A category's items in the order they were added"""
+        items = self.wardrobe_items.get(category, [])
+        if category in self._unsorted:
+            # Mostly in order already, so the sort is close to linear
+            items.sort(key=lambda item: self._order[item["id"]])
+            for position, item in enumerate(items):
+                self._positions[item["id"]] = position
+            self._unsorted.discard(category)
+        return items
+
+    def add(self, category, item):
+        """Append an item to its category and index it"""
+        items = self.wardrobe_items.setdefault(category, [])
+        items.append(item)
+        self._index(category, item, len(items) - 1)
+
+    def remove(self, item_id):
+        """Remove an item from its category in constant time; returns the removed item or None"""
+        entry = self._items.pop(item_id, None)
+        if entry is None:
+            return None
+        category, item = entry
+        items = self.wardrobe_items[category]
+        position = self._positions.pop(item_id)
+        del self._order[item_id]
+        last = items.pop()
+        if last is not item:
+            items[position] = last
+            self._positions[last["id"]] = position
+            self._unsorted.add(category)
+        return item
+
+# Item attributes matched by the wardrobe search box
+SEARCH_FIELDS = ("type", "color", "colors", "pattern", "style", "occasions")
+
+def _occasions(item):
+    occasions = item.get("occasions", [])
+    return [occasions] if isinstance(occasions, str) else list(occasions)
+
+def item_colors(item):
+    """Named colors of an item for filtering: the palette names found by local
+    extraction (features.py), or its color description for older items"""
+    if item.get("colors"):
+        return list(item["colors"])
+    return [item["color"]] if item.get("color") else []
+
+def filter_items(items, query="", colors=(), types=(), occasions=()):
+    """Items matching a free-text query and any of the selected colors, types and occasions"""
+    query = query.strip().lower()
+    colors = set(colors)
+    matched = []
+    for item in items:
+        if colors and colors.isdisjoint(item_colors(item)):
+            continue
+        if types and item.get("type") not in types:
+            continue
+        if occasions and not set(occasions) & set(_occasions(item)):
+            continue
+        if query:
+            text = " ".join(str(item.get(field, "")) for field in SEARCH_FIELDS).lower()
+            if query not in text:
+                continue
+        matched.append(item)
+    return matched
+
+def filter_options(items):
+    """Sorted distinct colors, types and occasions of a list of items, for filter widgets"""
+    colors, types, occasions = set(), set(), set()
+    for item in items:
+        colors.update(item_colors(item))
+        types.add(item.get("type", ""))
+        occasions.update(_occasions(item))
+    return sorted(colors - {""}), sorted(types - {""}), sorted(occasions - {""})
+
+@metrics.instrument("storage.save_wardrobe")
+def save_wardrobe(wardrobe_items, user=DEFAULT_USER, expected=None):
+    """Sync the whole wardrobe dict to the store, writing only changed items.
+
+    For imports and tools; the app adds and removes single items instead. Pass
+    expected=wardrobe_stamp(user) taken when the dict was loaded to get
+    wardrobe_store.StaleWardrobeError rather than overwrite newer changes.
+    """
+    removed = get_wardrobe_store(user).replace_all(wardrobe_items, expected=expected)
+    for item_id in removed:
+        outfit_cache.get_outfit_cache().invalidate_item(item_id)
+    # Hashes may have changed along with the items; rebuild the index on next use
+    with _duplicate_index_lock:
+        _duplicate_indexes.pop(normalise_user(user), None)
+    # Drop embeddings of items that are no longer in the wardrobe
+    get_embedding_store(user).retain_items(
+        item.get("id") for items in wardrobe_items.values() for item in items
+    )
+
+@metrics.instrument("storage.load_wardrobe")
+def load_wardrobe(user=DEFAULT_USER):
+    """Load wardrobe items from the store.
+
+    Parsed wardrobes are shared between sessions until the store changes;
+    each caller gets its own lists and item dicts to modify.
+    """
+    try:
+        store = get_wardrobe_store(user)
+        wardrobe = _read_cache.get(("wardrobe", normalise_user(user)), store.stamp(), store.load_all)
+        return {category: [dict(item) for item in items] for category, items in wardrobe.items()}
+    except Exception as e:
+        print(f"Error loading wardrobe: {e}")
     
-    # Return default wardrobe structure if file doesn't exist or error occurs
-    return {
-        "tops": [],
-        "bottoms": [],
-        "dresses": [],
-        "shoes": [],
-        "accessories": []
-    }
-
-def save_profile(profile_data):
-    """Save user profile to a JSON file"""
-    ensure_data_dir()
-    with open(PROFILE_FILE, 'w') as f:
-        json.dump({"profile": profile_data}, f)
-
-def load_profile():
+    # Return default wardrobe structure if the store can't be read
+    return {category: [] for category in CATEGORIES}
+
+@metrics.instrument("storage.save_profile")
+def save_profile(profile_data, user=DEFAULT_USER):
+    """Save user profile to a JSON file, replacing it atomically"""
+    ensure_data_dir(user)
+    path = os.path.join(data_dir(user), PROFILE_FILE)
+    with locking.file_lock(path):
+        locking.atomic_write(path, json.dumps({"profile": profile_data}))
+    _read_cache.invalidate(("profile", normalise_user(user)))
+
+def _read_profile(path):
+    with open(path, 'r') as f:
+        return json.load(f).get("profile", None)
+
+@metrics.instrument("storage.load_profile")
+def load_profile(user=DEFAULT_USER):
     """Load user profile from JSON file if exists"""
-    ensure_data_dir()
-    if os.path.exists(PROFILE_FILE):
+    ensure_data_dir(user)
+    path = os.path.join(data_dir(user), PROFILE_FILE)
+    stamp = _file_stamp(path)
+    if stamp is not None:
         try:
-            with open(PROFILE_FILE, 'r') as f:
-                data = json.load(f)
-                return data.get("profile", None)
+            return _read_cache.get(("profile", normalise_user(user)), stamp, lambda: _read_profile(path))
         except Exception as e:
             print(f"Error loading profile: {e}")
     return None
 
-def save_outfits(outfits):
-    """Save outfit history to a JSON file"""
-    ensure_data_dir()
-    with open(OUTFITS_FILE, 'w') as f:
-        json.dump({"outfits": outfits}, f)
+_outfit_histories = {}
+_outfit_history_lock = threading.Lock()
 
-def load_outfits():
-    """Load outfit history from JSON file if exists"""
-    ensure_data_dir()
-    if os.path.exists(OUTFITS_FILE):
-        try:
-            with open(OUTFITS_FILE, 'r') as f:
-                data = json.load(f)
-                return data.get("outfits", [])
-        except Exception as e:
-            print(f"Error loading outfits: {e}")
+def get_outfit_history(user=DEFAULT_USER):
+    """Return the shared outfit history of a user, migrating the legacy JSON file on first use"""
+    user = normalise_user(user)
+    with _outfit_history_lock:
+        if user not in _outfit_histories:
+            ensure_data_dir(user)
+            directory = data_dir(user)
+            history = OutfitHistory(os.path.join(directory, HISTORY_FILE), os.path.join(directory, HISTORY_INDEX))
+            legacy = os.path.join(directory, OUTFITS_FILE)
+            migrated = history.migrate_from_json(legacy)
+            if migrated:
+                print(f"Migrated {migrated} saved outfits from {legacy}")
+            _outfit_histories[user] = history
+        return _outfit_histories[user]
+
+@metrics.instrument("storage.save_outfit")
+def save_outfit(outfit, user=DEFAULT_USER):
+    """Append a single outfit to the history"""
+    get_outfit_history(user).append(outfit)
+
+def count_outfits(user=DEFAULT_USER):
+    """Number of saved outfits"""
+    return len(get_outfit_history(user))
+
+@metrics.instrument("storage.load_outfits_page")
+def load_outfits_page(page, page_size=10, user=DEFAULT_USER):
+    """Load one page of saved outfits, newest first"""
+    try:
+        return get_outfit_history(user).page(page, page_size)
+    except Exception as e:
+        print(f"Error loading outfits: {e}")
+    return []
+
+@metrics.instrument("storage.load_outfits")
+def load_outfits(user=DEFAULT_USER):
+    """Load the full outfit history, oldest first"""
+    try:
+        return list(get_outfit_history(user))
+    except Exception as e:
+        print(f"Error loading outfits: {e}")
     return []
 
-def clean_missing_items(wardrobe_items):
-    """Remove any wardrobe items whose image files don't exist anymore"""
-    for category in wardrobe_items:
-        wardrobe_items[category] = [
-            item for item in wardrobe_items[category] 
-            if os.path.exists(item.get("image_path", ""))
-        ]
-    return wardrobe_items 
\ No newline at end of file
+@metrics.instrument("storage.compact_outfits")
+def compact_outfits(user=DEFAULT_USER):
+    """Remove duplicate saves of the same outfit; returns how many were removed"""
+    return get_outfit_history(user).compact()
+
+def clean_missing_items(user=DEFAULT_USER):
+    """Remove the stored wardrobe items whose image files don't exist anymore; returns their ids.
+
+    Works from the store rather than a session's copy and removes item by
+    item, so items other sessions or jobs added meanwhile are left alone.
+    """
+    report = integrity.reconcile(get_wardrobe_store(user).load_all())
+    missing = [entry["id"] for entry in report["missing"] if entry["id"] is not None]
+    return [item_id for item_id in missing if remove_wardrobe_item(item_id, user=user)]
+
+@metrics.instrument("storage.check_uploads")
+def check_uploads(user=DEFAULT_USER, delete=False):
+    """Reconcile a user's stored wardrobe with their uploads directory, optionally
+    deleting unreferenced uploads; returns the integrity.reconcile report"""
+    return integrity.reconcile(get_wardrobe_store(user).load_all(), uploads_dir(user), delete=delete) 
\ No newline at end of file
@@ -0,0 +1,182 @@
+import os
+import json
+import pickle
+import sqlite3
+import threading
+
+WARDROBE_DB = "data/wardrobe.db"
+
+CATEGORIES = ["tops", "bottoms", "dresses", "shoes", "accessories"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    id TEXT PRIMARY KEY,
+    category TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS items_category ON items (category);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+
+class StaleWardrobeError(RuntimeError):
+    """The store changed since the wardrobe snapshot being written back was loaded"""
+
+
+class WardrobeStore:
+    """SQLite-backed wardrobe with single-item writes.
+
+    Items are stored as JSON blobs keyed by item id, so adding or removing one
+    item touches one row instead of rewriting the whole wardrobe. The database
+    runs in WAL mode so readers in other sessions never block a writer.
+    """
+
+    def __init__(self, path=WARDROBE_DB):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._conn() as conn:
+            conn.executescript(SCHEMA)
+
+    def _conn(self):
+        # sqlite3 connections can't be shared across threads; keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _bump_version(self, conn):
+        conn.execute(
+            "INSERT INTO meta (key, value) VALUES ('version', 1) "
+            "ON CONFLICT(key) DO UPDATE SET value = value + 1"
+        )
+
+    def version(self):
+        """Counter that changes whenever items are added or modified.
+
+        Removals don't bump it: results built only from remaining items stay valid.
+        """
+        row = self._conn().execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        return row[0] if row else 0
+
+    def stamp(self):
+        """(version, item count): changes with every add, modification and removal,
+        so it identifies the state a snapshot of the wardrobe was loaded from"""
+        return self.version(), self.count()
+
+    def add(self, category, item):
+        """Insert or update a single item"""
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT INTO items (id, category, data) VALUES (?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET category = excluded.category, data = excluded.data",
+                (item["id"], category, json.dumps(item)),
+            )
+            self._bump_version(conn)
+
+    def remove(self, item_id):
+        """Delete a single item; returns True if it existed"""
+        with self._conn() as conn:
+            cursor = conn.execute("DELETE FROM items WHERE id = ?", (item_id,))
+            return cursor.rowcount > 0
+
+    def get(self, item_id):
+        """Return (category, item) for an id, or None"""
+        row = self._conn().execute(
+            "SELECT category, data FROM items WHERE id = ?", (item_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    def by_category(self, category):
+        """Return the items of one category in insertion order"""
+        rows = self._conn().execute(
+            "SELECT data FROM items WHERE category = ? ORDER BY rowid", (category,)
+        ).fetchall()
+        return [json.loads(data) for (data,) in rows]
+
+    def load_all(self):
+        """Return the full wardrobe as {category: [items]}"""
+        wardrobe = {category: [] for category in CATEGORIES}
+        rows = self._conn().execute("SELECT category, data FROM items ORDER BY rowid").fetchall()
+        for category, data in rows:
+            wardrobe.setdefault(category, []).append(json.loads(data))
+        return wardrobe
+
+    def count(self):
+        return self._conn().execute("SELECT COUNT(*) FROM items").fetchone()[0]
+
+    def replace_all(self, wardrobe_items, expected=None):
+        """Make the store match a full wardrobe dict in one transaction.
+
+        For imports and migrations; interactive code writes item by item with
+        add() and remove(), since a whole snapshot would delete anything added
+        after it was loaded. With expected, the stamp() the snapshot was
+        loaded at, StaleWardrobeError is raised instead if the store has
+        changed since. Only rows that differ are written, so calling this
+        with an unchanged wardrobe costs a read and no writes. Returns the
+        ids that were removed.
+        """
+        wanted = {}
+        for category, items in wardrobe_items.items():
+            for item in items:
+                wanted[item["id"]] = (category, json.dumps(item))
+
+        with self._conn() as conn:
+            # Hold the write lock from the check to the last write
+            conn.execute("BEGIN IMMEDIATE")
+            if expected is not None and tuple(expected) != self.stamp():
+                raise StaleWardrobeError(f"Wardrobe changed since it was loaded ({tuple(expected)} -> {self.stamp()})")
+            current = {}
+            for item_id, category, data in conn.execute("SELECT id, category, data FROM items"):
+                current[item_id] = (category, data)
+
+            stale = [(item_id,) for item_id in current if item_id not in wanted]
+            if stale:
+                conn.executemany("DELETE FROM items WHERE id = ?", stale)
+            changed = [(item_id, category, data) for item_id, (category, data) in wanted.items()
+                       if current.get(item_id) != (category, data)]
+            if changed:
+                conn.executemany(
+                    "INSERT INTO items (id, category, data) VALUES (?, ?, ?) "
+                    "ON CONFLICT(id) DO UPDATE SET category = excluded.category, data = excluded.data",
+                    changed,
+                )
+                self._bump_version(conn)
+        return [item_id for (item_id,) in stale]
+
+    def migrate_from_pickle(self, pickle_path):
+        """One-time import of a legacy pickled wardrobe.
+
+        The pickle is renamed to *.migrated afterwards so the import never runs twice.
+        """
+        if not os.path.exists(pickle_path):
+            return 0
+        try:
+            with open(pickle_path, "rb") as f:
+                wardrobe_items = pickle.load(f)
+        except Exception as e:
+            print(f"Error migrating wardrobe: {e}")
+            return 0
+
+        migrated = 0
+        with self._conn() as conn:
+            for category, items in wardrobe_items.items():
+                for item in items:
+                    if "id" not in item:
+                        continue
+                    conn.execute(
+                        "INSERT OR IGNORE INTO items (id, category, data) VALUES (?, ?, ?)",
+                        (item["id"], category, json.dumps(item)),
+                    )
+                    migrated += 1
+            self._bump_version(conn)
+        os.replace(pickle_path, pickle_path + ".migrated")
+        return migrated